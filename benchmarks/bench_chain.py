@@ -0,0 +1,49 @@
+'''Benchmarks for complete ray-traces from the source to the detector.'''
+from marxs.source import FixedPointing
+from marxs.optics import (CircleAperture, ThinLens, RadialMirrorScatter, FlatGrating,
+                          FlatDetector, uniform_efficiency_factory)
+from marxs.simulator import Sequence
+from marxs.missions import chandra
+from marxs.missions.chandra.hess import HETG
+
+from .common import COORDS, source_photons, _PhotonBenchmark
+
+CHANDRA_FOCALLENGTH = 10070.
+'''Focal length of the Chandra mirror in mm.
+
+MARX is not available in every installation, so the Chandra mirror is
+replaced by a `marxs.optics.ThinLens` with the same focal length in
+`HETGACIS`.
+'''
+
+
+class _ChainBenchmark(_PhotonBenchmark):
+    def make_photons(self, n):
+        return source_photons(n)
+
+
+class GratingSpectrometer(_ChainBenchmark):
+    '''Pointing, aperture, lens, scatter, a single grating and a detector.'''
+    def make_element(self):
+        return Sequence(sequence=[FixedPointing(coords=COORDS),
+                                  CircleAperture(position=[1e3, 0, 0], zoom=[1, 100, 100]),
+                                  ThinLens(focallength=1e3, position=[1e3, 0, 0], zoom=100),
+                                  RadialMirrorScatter(inplanescatter=1e-5),
+                                  FlatGrating(d=2e-4, order_selector=uniform_efficiency_factory(),
+                                              position=[500., 0, 0], zoom=100),
+                                  FlatDetector(pixsize=0.04, zoom=1e3)],
+                        random_state=0)
+
+
+class HETGACIS(_ChainBenchmark):
+    '''Chandra with dither, HETG and ACIS-S.'''
+    def make_element(self):
+        return Sequence(sequence=[chandra.LissajousDither(coords=COORDS, roll=15.),
+                                  CircleAperture(position=[CHANDRA_FOCALLENGTH, 0, 0],
+                                                 zoom=[1, 600, 600]),
+                                  ThinLens(focallength=CHANDRA_FOCALLENGTH,
+                                           position=[CHANDRA_FOCALLENGTH, 0, 0], zoom=600),
+                                  HETG(),
+                                  chandra.ACIS(chips=[4, 5, 6, 7, 8, 9],
+                                               aimpoint=chandra.AIMPOINTS['ACIS-S'])],
+                        random_state=0)
@@ -0,0 +1,77 @@
+'''Benchmarks for individual optical elements.
+
+All elements are placed such that most photons from
+`benchmarks.common.pointed_photons` hit them.
+'''
+from marxs.source import FixedPointing
+from marxs.optics import (RectangleAperture, CircleAperture, ThinLens, FlatGrating,
+                          RadialMirrorScatter, FlatDetector, uniform_efficiency_factory)
+from marxs.design import RowlandTorus, GratingArrayStructure
+
+from .common import COORDS, source_photons, _PhotonBenchmark
+
+
+class _ApertureBenchmark(_PhotonBenchmark):
+    def make_photons(self, n):
+        return FixedPointing(coords=COORDS)(source_photons(n))
+
+
+class RectangleApertureBenchmark(_ApertureBenchmark):
+    def make_element(self):
+        return RectangleAperture(position=[100., 0, 0], zoom=[1, 20, 20], random_state=0)
+
+
+class CircleApertureBenchmark(_ApertureBenchmark):
+    def make_element(self):
+        return CircleAperture(position=[100., 0, 0], zoom=[1, 20, 20], random_state=0)
+
+
+class ThinLensBenchmark(_PhotonBenchmark):
+    def make_element(self):
+        return ThinLens(focallength=50., position=[50., 0, 0], zoom=40)
+
+
+class FlatGratingBenchmark(_PhotonBenchmark):
+    def make_element(self):
+        return FlatGrating(d=1./500, order_selector=uniform_efficiency_factory(),
+                           position=[50., 0, 0], zoom=40, random_state=0)
+
+
+class RadialMirrorScatterBenchmark(_PhotonBenchmark):
+    def make_element(self):
+        return RadialMirrorScatter(inplanescatter=1e-5, perpplanescatter=1e-6,
+                                   random_state=0)
+
+
+class FlatDetectorBenchmark(_PhotonBenchmark):
+    def make_element(self):
+        return FlatDetector(pixsize=0.04, zoom=40)
+
+
+class GratingArrayStructureBenchmark(_PhotonBenchmark):
+    '''Grating array structure with a few hundred facets.
+
+    Photons are focussed by a `marxs.optics.ThinLens` (not timed) so that they
+    pass through the grating array as they would in an instrument.
+    '''
+    def make_element(self):
+        torus = RowlandTorus(5000., 5000.)
+        return GratingArrayStructure(torus, d_facet=30., x_range=[8e3, 1e4],
+                                     radius=[50., 500.], elem_class=FlatGrating,
+                                     elem_args={'zoom': 15, 'd': 2e-4,
+                                                'order_selector': uniform_efficiency_factory()})
+
+    def make_photons(self, n):
+        photons = FixedPointing(coords=COORDS)(source_photons(n))
+        aperture = CircleAperture(position=[1.2e4, 0, 0], zoom=[1, 500, 500], random_state=0)
+        lens = ThinLens(focallength=1.2e4, position=[1.2e4, 0, 0], zoom=500)
+        return lens(aperture(photons))
+
+
+class SmallGratingArrayStructureBenchmark(GratingArrayStructureBenchmark):
+    '''Grating array structure for small photon lists.
+
+    For small photon lists, the overhead of routing photons through the spatial
+    index of a `marxs.simulator.Parallel` can dominate the run time.
+    '''
+    params = [10, 100, 1000]
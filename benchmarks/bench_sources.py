@@ -0,0 +1,49 @@
+'''Benchmarks for sources and pointing models.'''
+import numpy as np
+
+from marxs.source import PointSource, FixedPointing
+from marxs.missions.chandra import LissajousDither
+
+from .common import PHOTON_COUNTS, COORDS, source_photons, _PhotonBenchmark
+
+
+def _powerlaw(times):
+    return 0.5 + np.random.pareto(1.5, size=len(times))
+
+
+ENERGIES = {'scalar': 1.,
+            'table': np.vstack([np.linspace(0.2, 10., 100), np.ones(100)]),
+            'callable': _powerlaw}
+
+
+class PointSourceEnergy(object):
+    '''Generate photons from a point source with different energy specifications.'''
+    params = [PHOTON_COUNTS, sorted(ENERGIES.keys())]
+    param_names = ['n_photons', 'energy']
+    timeout = 1200
+
+    def setup(self, n, energy):
+        self.source = PointSource(coords=COORDS, energy=ENERGIES[energy], flux=1.,
+                                  random_state=0)
+
+    def time_generate_photons(self, n, energy):
+        self.source.generate_photons(n)
+
+    def peakmem_generate_photons(self, n, energy):
+        self.source.generate_photons(n)
+
+
+class FixedPointingBenchmark(_PhotonBenchmark):
+    def make_element(self):
+        return FixedPointing(coords=COORDS)
+
+    def make_photons(self, n):
+        return source_photons(n)
+
+
+class LissajousDitherBenchmark(_PhotonBenchmark):
+    def make_element(self):
+        return LissajousDither(coords=COORDS, roll=15.)
+
+    def make_photons(self, n):
+        return source_photons(n)
@@ -0,0 +1,79 @@
+'''Shared setup for the marxs benchmarks.
+
+Every benchmark is run for photon lists of different length (`PHOTON_COUNTS`).
+Elements in marxs change the photon list in place, so the photons are
+generated in ``setup`` and each timed call gets a fresh list (``number = 1``
+and no warmup, see `_PhotonBenchmark`).
+Names that should not be collected as benchmarks start with an underscore.
+'''
+import numpy as np
+
+from marxs.source import PointSource, FixedPointing
+from marxs.optics import RectangleAperture
+
+PHOTON_COUNTS = [int(1e3), int(1e4), int(1e5), int(1e6), int(1e7)]
+'''Length of the photon lists used in the benchmarks.'''
+
+COORDS = (30., 30.)
+'''Position of the source and the pointing direction in all benchmarks.'''
+
+
+def source_photons(n, energy=1.):
+    '''Generate ``n`` photons from a point source.
+
+    Parameters
+    ----------
+    n : int
+        Number of photons.
+    energy : see `marxs.source.Source`
+        Energy specification of the source.
+
+    Returns
+    -------
+    photons : `astropy.table.Table`
+    '''
+    mysource = PointSource(coords=COORDS, energy=energy, flux=1., random_state=0)
+    return mysource.generate_photons(n)
+
+
+def pointed_photons(n):
+    '''Generate ``n`` photons in the spacecraft coordinate system.
+
+    The photons come from a point source, are processed with a
+    `marxs.source.FixedPointing` and start from a `marxs.optics.RectangleAperture`
+    at ``x = 100``, i.e. they have ``pos`` and ``dir`` columns and can be fed
+    into any optical element.
+    '''
+    photons = source_photons(n)
+    photons = FixedPointing(coords=COORDS)(photons)
+    aperture = RectangleAperture(position=[100., 0, 0], zoom=[1, 20, 20], random_state=0)
+    return aperture(photons)
+
+
+class _PhotonBenchmark(object):
+    '''Base class for benchmarks that process a photon list of length ``n``.
+
+    Derived classes implement ``make_element()``, which returns the element (or
+    sequence of elements) that is measured, and can override ``make_photons(n)``
+    to change the input photon list.
+    '''
+    params = PHOTON_COUNTS
+    param_names = ['n_photons']
+    number = 1
+    repeat = 3
+    warmup_time = 0
+    timeout = 1200
+
+    def make_photons(self, n):
+        return pointed_photons(n)
+
+    def setup(self, n):
+        np.random.seed(0)
+        self.element = self.make_element()
+        self.photons = self.make_photons(n)
+
+    def time_process(self, n):
+        self.element(self.photons)
+
+    def peakmem_process(self, n):
+        self.element(self.photons)
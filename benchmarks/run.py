@@ -0,0 +1,182 @@
+'''Run the marxs benchmarks without asv.
+
+The benchmarks in this directory follow the conventions of
+`asv <https://asv.readthedocs.io>`_ and can be run with
+``asv run --python=same`` from this directory. This script is a minimal
+alternative that needs nothing but marxs and its dependencies and prints a
+table of run time and peak memory for each benchmark and photon number::
+
+    python -m benchmarks.run --max-photons 1e5 -b Grating
+
+Time and memory are measured in separate runs. Peak memory is measured with
+`tracemalloc` as the largest amount of memory allocated during
+the ``peakmem_`` call above what was allocated before the call, i.e. unlike in
+asv it does not include the input photon list.
+On Python 2, where `tracemalloc` is not available, each ``peakmem_`` benchmark is
+run in a new Python process instead and the maximum resident set size of that
+process (`resource.getrusage`) is reported. As in asv, this includes the
+interpreter, the imported modules and ``setup``, so these numbers can only be
+compared with each other, not with the `tracemalloc` numbers.
+'''
+from __future__ import print_function
+
+import argparse
+import ast
+import glob
+import importlib
+import inspect
+import itertools
+import os
+import re
+import subprocess
+import sys
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def find_benchmarks(pattern=None):
+    '''Find all benchmark classes in the ``bench_*.py`` modules of this package.
+
+    Parameters
+    ----------
+    pattern : string or ``None``
+        Regular expression. If given, only benchmarks where
+        ``module.class`` matches are returned.
+
+    Returns
+    -------
+    benchmarks : list of (name, class)
+    '''
+    benchmarks = []
+    path = os.path.dirname(os.path.abspath(__file__))
+    for filename in sorted(glob.glob(os.path.join(path, 'bench_*.py'))):
+        modname = os.path.splitext(os.path.basename(filename))[0]
+        module = importlib.import_module('benchmarks.' + modname)
+        for name, cls in sorted(inspect.getmembers(module, inspect.isclass)):
+            if name.startswith('_') or cls.__module__ != module.__name__:
+                continue
+            fullname = modname + '.' + name
+            if (pattern is not None) and (re.search(pattern, fullname) is None):
+                continue
+            benchmarks.append((fullname, cls))
+    return benchmarks
+
+
+def param_combinations(cls):
+    '''List all combinations of parameters for a benchmark class.'''
+    params = getattr(cls, 'params', [])
+    if len(params) == 0:
+        return [()]
+    if not isinstance(params[0], (list, tuple)):
+        params = [params]
+    return list(itertools.product(*params))
+
+
+def _maxrss():
+    '''Maximum resident set size of this process in bytes.'''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS, but in kilobytes on Linux.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def measure_peakmem(name, cls, method, args):
+    '''Measure the peak memory of ``method`` in bytes.
+
+    Returns
+    -------
+    result : int or ``None``
+        ``None`` if neither `tracemalloc` nor `resource` is available.
+    '''
+    if tracemalloc is not None:
+        return measure(cls, method, args, trace=True)
+    elif resource is not None:
+        # The maximum resident set size cannot be reset and a forked process
+        # inherits it from its parent, so every benchmark needs a new interpreter.
+        out = subprocess.check_output([sys.executable, '-m', 'benchmarks.run',
+                                       '--rss', name, method, repr(tuple(args))],
+                                      cwd=os.path.dirname(os.path.dirname(
+                                          os.path.abspath(__file__))))
+        return int(out.split()[-1])
+    else:
+        return None
+
+
+def measure(cls, method, args, trace=False, rss=False):
+    '''Run ``setup``, then call ``method`` once and measure it.
+
+    Returns
+    -------
+    result : float or int
+        Wall clock time in seconds or, if ``trace=True``, peak memory in bytes
+        from `tracemalloc` or, if ``rss=True``, the maximum resident set size
+        of the process in bytes.
+    '''
+    bench = cls()
+    if hasattr(bench, 'setup'):
+        bench.setup(*args)
+    func = getattr(bench, method)
+    if rss:
+        func(*args)
+        result = _maxrss()
+    elif trace:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        func(*args)
+        result = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+    else:
+        t0 = default_timer()
+        func(*args)
+        result = default_timer() - t0
+    if hasattr(bench, 'teardown'):
+        bench.teardown(*args)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-b', '--bench', default=None,
+                        help='Regular expression to select benchmarks (module.class).')
+    parser.add_argument('--max-photons', type=float, default=1e7,
+                        help='Skip benchmarks with more photons than this.')
+    parser.add_argument('--rss', nargs=3, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.rss is not None:
+        # Run by measure_peakmem in a new process
+        name, method, par = args.rss
+        cls = dict(find_benchmarks())[name]
+        print(measure(cls, method, ast.literal_eval(par), rss=True))
+        return
+
+    print('{0:60s} {1:>20s} {2:>12s} {3:>12s}'.format('benchmark', 'params',
+                                                       'time [s]', 'peak [MB]'))
+    for name, cls in find_benchmarks(args.bench):
+        methods = sorted(m for m in dir(cls) if m.startswith('time_'))
+        for method in methods:
+            for par in param_combinations(cls):
+                if par[0] > args.max_photons:
+                    continue
+                t = measure(cls, method, par)
+                mem = 'n/a'
+                peakmethod = 'peakmem_' + method[len('time_'):]
+                if hasattr(cls, peakmethod):
+                    peak = measure_peakmem(name, cls, peakmethod, par)
+                    if peak is not None:
+                        mem = '{0:.1f}'.format(peak / 2.**20)
+                print('{0:60s} {1:>20s} {2:12.4f} {3:>12s}'.format(
+                    name + '.' + method, ', '.join(str(p) for p in par), t, mem))
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+'''Compare ray-traces in single and double precision.
+
+Single precision (see `marxs.precision`) makes the photon lists smaller and
+the simulations faster, but it also makes the results less accurate. This
+script runs the same simulation twice with the same random numbers, once in
+double and once in single precision, and prints for every column how much the
+results differ::
+
+    python -m benchmarks.validate_precision --n-photons 1e5
+
+For float columns, the table lists the largest absolute difference and the
+99th percentile of the absolute difference (ignoring photons that have
+``NaN`` in both runs). For all other columns (e.g. the grating order or the
+CCD_ID), it lists the number of photons with different values.
+The last column of the table gives the number of photons that have ``NaN``
+(or the fill value) in one run but not in the other, i.e. photons that hit an
+element in one run and missed it in the other.
+
+The simulations are the Chandra HETG/ACIS-S setup (`HETGACIS`) and a generic
+spectrometer with a grating array structure on a Rowland torus (`Rowland`).
+'''
+from __future__ import print_function
+
+import argparse
+
+import numpy as np
+
+from marxs.precision import precision
+from marxs.source import FixedPointing
+from marxs.optics import (CircleAperture, ThinLens, FlatGrating, FlatDetector,
+                          uniform_efficiency_factory)
+from marxs.design import RowlandTorus, GratingArrayStructure
+from marxs.simulator import Sequence
+
+from .common import COORDS, source_photons
+from .bench_chain import HETGACIS
+
+
+class Rowland(object):
+    '''Lens, grating array structure on a Rowland torus and detector in the focal plane.'''
+    def make_element(self):
+        torus = RowlandTorus(5000., 5000.)
+        gas = GratingArrayStructure(torus, d_facet=30., x_range=[8e3, 1e4],
+                                    radius=[50., 500.], elem_class=FlatGrating,
+                                    elem_args={'zoom': 15, 'd': 2e-4,
+                                               'order_selector': uniform_efficiency_factory(1)})
+        return Sequence(sequence=[FixedPointing(coords=COORDS),
+                                  CircleAperture(position=[1.2e4, 0, 0], zoom=[1, 500, 500]),
+                                  ThinLens(focallength=1.2e4, position=[1.2e4, 0, 0], zoom=500),
+                                  gas,
+                                  FlatDetector(pixsize=0.024, zoom=[1, 300, 300])],
+                        random_state=0)
+
+
+SETUPS = [('HETGACIS', HETGACIS), ('Rowland', Rowland)]
+'''Simulations that are compared.'''
+
+
+def run(setup, n, value):
+    '''Run the simulation ``setup`` for ``n`` photons in precision ``value``.'''
+    with precision(value):
+        np.random.seed(0)
+        element = setup().make_element()
+        return element(source_photons(n))
+
+
+def compare(p64, p32):
+    '''Compare the columns of two photon lists.
+
+    Parameters
+    ----------
+    p64, p32 : `astropy.table.Table`
+        Photon lists from the same simulation in double and single precision.
+
+    Returns
+    -------
+    result : list of tuples
+        For each column: name, data types, maximum difference, 99th percentile
+        of the difference and number of photons that are valid in one list only.
+        For non-float columns, the maximum difference is replaced by the number
+        of photons with different values and the percentile is ``None``.
+    '''
+    result = []
+    for c in p64.colnames:
+        a = np.asarray(p64[c])
+        b = np.asarray(p32[c])
+        types = '{0}/{1}'.format(a.dtype, b.dtype)
+        if a.dtype.kind == 'f':
+            nan_a = np.isnan(a)
+            nan_b = np.isnan(b)
+            both = ~nan_a & ~nan_b
+            diff = np.abs(a[both] - b[both]).astype(np.float64)
+            if diff.size == 0:
+                diff = np.zeros(1)
+            result.append((c, types, diff.max(), np.percentile(diff, 99),
+                           (nan_a != nan_b).sum()))
+        else:
+            result.append((c, types, (a != b).sum(), None, None))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--n-photons', type=float, default=1e5,
+                        help='Number of photons in each simulation.')
+    args = parser.parse_args(argv)
+
+    for name, setup in SETUPS:
+        p64 = run(setup, int(args.n_photons), 'double')
+        p32 = run(setup, int(args.n_photons), 'single')
+        print(name)
+        print('{0:20s} {1:>16s} {2:>12s} {3:>12s} {4:>8s}'.format('column', 'types', 'max diff',
+                                                                 '99% diff', 'valid'))
+        for c, types, maxdiff, perc, valid in compare(p64, p32):
+            if perc is None:
+                print('{0:20s} {1:>16s} {2:12d}'.format(c, types, maxdiff))
+            else:
+                print('{0:20s} {1:>16s} {2:12.3g} {3:12.3g} {4:8d}'.format(c, types, maxdiff,
+                                                                          perc, valid))
+        print()
+
+
+if __name__ == '__main__':
+    main()
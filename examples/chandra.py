@@ -25,8 +25,8 @@ photons = marxm(photons)
 photons = photons[photons['probability'] > 0]
 
 photons = hetg(photons)
-photons['hetgy'] = photons['pos'].data[:,1]/photons['pos'].data[:,3]
-photons['hetgz'] = photons['pos'].data[:,2]/photons['pos'].data[:,3]
+photons['hetgy'] = photons['pos'].data[:,1]
+photons['hetgz'] = photons['pos'].data[:,2]
 
 photons = acis(photons)
 mypointing.write_asol(photons, 'asol.fits')
@@ -82,7 +82,7 @@ def find_best_detector_position(photons, col='det_y', objective_func=sigma_clipp
     '''
     def width(x, photons):
         mdet = FlatDetector(position=np.array([x, 0, 0]), orientation=orientation, zoom=1e5, pixsize=1.)
-        photons = mdet.process_photons(photons)
+        photons = mdet(photons)
         return objective_func(photons[col].data)
 
     return scipy.optimize.minimize(width, 0, args=(photons,), options={'maxiter': 20, 'disp': True},
@@ -125,7 +125,7 @@ def fwhm_per_order(gas, photons, orders=np.arange(-11,-1)):
             facet.order_selector = gratingeff
 
         pg = photons.copy()
-        pg = gas.process_photons(pg)
+        pg = gas(pg)
         pg = pg[pg['order'] == order]  # Remove photons that slip between the gratings
         xbest = find_best_detector_position(pg, objective_func=measure_FWHM)
         fwhm[i] = xbest.fun
@@ -6,6 +6,10 @@ from transforms3d import affines
 
 from astropy.table import Column
 
+from .math.random import check_random_state, HaltonSequence
+from .photons import to_euclidean
+from .precision import float_type
+
 class GeometryError(Exception):
     pass
 
@@ -64,6 +68,59 @@ class MarxsElement(object):
     def describe(self):
         return OrderedDict(element=self.name)
 
+    @property
+    def pos4d(self):
+        '''Affine transformation that places the element in the global coordinate system.
+
+        Setting ``pos4d`` moves the element: All properties that are derived from
+        ``pos4d`` (e.g. the `~marxs.optics.base.OpticalElement.geometry` of an
+        optical element) are recalculated for the new position. This happens when
+        they are needed next, so moving an element several times costs no more
+        than setting the matrix.
+        '''
+        return self._pos4d
+
+    @pos4d.setter
+    def pos4d(self, pos4d):
+        self._pos4d = pos4d
+        self._pos4d_inv = None
+        self._geometry_stale = True
+
+    @property
+    def pos4d_inv(self):
+        '''Inverse of `pos4d`, which transforms from the global to the local coordinate system.
+
+        The inverse is calculated when it is first needed after `pos4d` was set.
+        Changing individual numbers in the `pos4d` array in place does not update
+        the inverse; set ``pos4d`` to a new array instead.
+        '''
+        if self._pos4d_inv is None:
+            self._pos4d_inv = np.linalg.inv(self.pos4d)
+        return self._pos4d_inv
+
+    _geometry_stale = False
+
+    def _update_geometry(self):
+        '''Recalculate the properties that depend on `pos4d` if `pos4d` was set.
+
+        Code that uses properties calculated in `_geometry_from_pos4d` directly
+        (and not through a `~marxs.optics.base.OpticalElement.geometry`
+        dictionary, which does that automatically) needs to call this first.
+        '''
+        if self._geometry_stale:
+            self._geometry_stale = False
+            self._geometry_from_pos4d()
+
+    def _geometry_from_pos4d(self):
+        '''Calculate properties that depend on `pos4d`.
+
+        This is called through `_update_geometry` when the properties are needed
+        for the first time after `pos4d` was set. Derived classes that calculate
+        properties from `pos4d` should extend this method, so that those properties
+        are updated when the element is moved.
+        '''
+        pass
+
 class SimulationSequenceElement(MarxsElement):
     '''Base class for all elements in a simulation sequence that processes photons.'''
 
@@ -79,10 +136,10 @@ class SimulationSequenceElement(MarxsElement):
     The following properties are always included in the output and do not need to be listed here:
 
         dir : `numpy.ndarray`
-            4-d direction vector of ray in homogeneous coordinates
+            3-d direction vector of ray in Euclidean coordinates
         pos : `numpy.ndarray`
-            4-d position of last interaction pf the photons with any optical element in
-            homogeneous coordinates. Together with ``dir`` this determines the equation
+            3-d position of last interaction pf the photons with any optical element in
+            Euclidean coordinates. Together with ``dir`` this determines the equation
             of the ray.
         energy : float
             Photon energy in keV.
@@ -94,6 +151,21 @@ class SimulationSequenceElement(MarxsElement):
             the photons passes.
     '''
 
+    output_column_types = {}
+    '''Data type and fill value for output columns.
+
+    Dictionary of the form ``{'column name': (dtype, fill value)}``. When `add_output_cols`
+    adds one of these columns to the photon list, the column gets this type and is
+    filled with the fill value, which marks photons that did not interact with the
+    element. Use small integer types for integer quantities (e.g. ``np.int8`` for a
+    grating order) and a fill value that cannot occur otherwise.
+    Columns that are not listed here are float columns filled with ``np.nan``; their
+    precision is set by `marxs.precision`.
+    '''
+
+    id_col_type = (np.int16, -1)
+    '''Data type and fill value for the `id_col`.'''
+
     id_col = None
     '''String that names an id column for output.
 
@@ -107,15 +179,101 @@ class SimulationSequenceElement(MarxsElement):
     Currently, this will not work with all optical elements.
     '''
 
+    random_state = check_random_state(None)
+    '''Random number generator (`numpy.random.RandomState`) for this element.
+
+    By default, all elements share the global random number generator of ``np.random``.
+    Pass a ``random_state`` keyword on initialization or call `set_random_state` to give
+    an element its own random number stream.
+    '''
+
+    quasi_random = False
+    '''Use quasi-random instead of pseudo-random numbers where the element supports it.
+
+    Elements that place photons (apertures and sources) can draw their uniform random
+    numbers from a scrambled `~marxs.math.random.HaltonSequence` (see `draw_uniform`).
+    Quasi-random numbers cover the parameter space more evenly, so that e.g. an
+    effective area or the width of a PSF reaches the same accuracy with fewer photons.
+    Pass ``quasi_random=True`` on initialization to switch this on.
+    '''
+
+    quasi_random_bases = {'xy': [2, 3], 'pos': [5, 7], 'dir': [11, 13],
+                          'energy': [17, 19], 'polarization': [23, 29]}
+    '''Bases of the Halton sequences used by `draw_uniform` for each quantity.
+
+    Each quantity has its own fixed bases, so that the quasi-random numbers for
+    different quantities (e.g. the position in the aperture and the energy of a
+    photon) are not correlated and a simulation with the same seed gives the same
+    result every time. Derived classes that draw quasi-random numbers for other
+    quantities need to add a key for them.
+    '''
+
     def __init__(self, **kwargs):
         self.id_num = kwargs.pop('id_num', -9)
         # We want to use id_col as a class attribute, but overwrite it if given as a kwarg
         if 'id_col' in kwargs:
             self.id_col = kwargs.pop('id_col')
+        if 'quasi_random' in kwargs:
+            self.quasi_random = kwargs.pop('quasi_random')
+        self._quasi_random_sequences = {}
+        if 'random_state' in kwargs:
+            self.set_random_state(kwargs.pop('random_state'))
         super(SimulationSequenceElement, self).__init__(**kwargs)
 
+    def set_random_state(self, seed):
+        '''Set the random number generator for this element.
+
+        Containers (e.g. `marxs.simulator.Sequence`) pass independent seeds on to
+        their elements.
+
+        Parameters
+        ----------
+        seed : ``None``, int, `~marxs.math.random.SeedTree` or `numpy.random.RandomState`
+            See `marxs.math.random.check_random_state`.
+        '''
+        self.random_state = check_random_state(seed)
+        self._quasi_random_sequences = {}
+
+    def draw_uniform(self, n, dim, key):
+        '''Draw numbers uniformly distributed in the interval [0, 1).
+
+        If `quasi_random` is ``False``, these are ``dim`` arrays of pseudo-random numbers
+        from the `random_state` of the element. Otherwise, the numbers are taken from a
+        scrambled `~marxs.math.random.HaltonSequence` of dimension ``dim``. There is one
+        sequence for each ``key`` and each call continues the sequence where the last
+        call stopped. The sequences are scrambled with the `random_state` of the
+        element and start again with a new scrambling when `set_random_state` is
+        called. Their bases are set in `quasi_random_bases`.
+
+        Parameters
+        ----------
+        n : int
+            Number of draws.
+        dim : int
+            Number of uniform numbers needed for each draw, e.g. 2 for a position
+            on a plane.
+        key : string
+            Name of the quantity that the numbers are used for. Independent
+            quantities need different keys, so that they are not correlated.
+            For quasi-random numbers, the key must be in `quasi_random_bases`.
+
+        Returns
+        -------
+        u : list of ``dim`` `numpy.ndarray`
+            Each array has ``n`` elements.
+        '''
+        if not self.quasi_random:
+            return [self.random_state.random_sample(n) for i in range(dim)]
+        if key not in self._quasi_random_sequences:
+            bases = self.quasi_random_bases[key]
+            if len(bases) < dim:
+                raise ValueError('quasi_random_bases has only {0} bases for {1}.'.format(len(bases), key))
+            self._quasi_random_sequences[key] = HaltonSequence(dim, random_state=self.random_state,
+                                                               bases=bases[:dim])
+        return list(self._quasi_random_sequences[key](n))
+
     def add_output_cols(self, photons, colnames=[]):
-        '''Add output columns of the correct format (currently: float) to the photon array.
+        '''Add output columns of the correct format to the photon array.
 
         This function takes the column names that are added to ``photons`` from several sources:
 
@@ -130,20 +288,26 @@ class SimulationSequenceElement(MarxsElement):
         colnames : list of strings
             Column names to be added; in addition several object properties can be used to
             set the column names, see description above.
+
+        See also
+        --------
+        output_column_types, id_col_type
         '''
-        temp = np.empty(len(photons))
-        temp[:] = np.nan
         for n in self.output_columns + colnames:
             if n not in photons.colnames:
-                photons.add_column(Column(name=n, data=temp))
+                dtype, fill = self.output_column_types.get(n, (float_type(n), np.nan))
+                photons.add_column(Column(name=n, data=np.full(len(photons), fill, dtype=dtype)))
 
         if self.id_col is not None:
             if self.id_col not in photons.colnames:
-                photons.add_column(Column(name=self.id_col, data=-np.ones(len(photons))))
+                dtype, fill = self.id_col_type
+                photons.add_column(Column(name=self.id_col,
+                                          data=np.full(len(photons), fill, dtype=dtype)))
 
 
     def __call__(self, photons, *args, **kwargs):
-        return self.process_photons(photons, *args, **kwargs)
+        # Photon lists with homogeneous pos and dir columns are converted on input.
+        return self.process_photons(to_euclidean(photons), *args, **kwargs)
 
 
 def _parse_position_keywords(kwargs):
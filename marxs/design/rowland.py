@@ -8,7 +8,6 @@ from ..optics.base import OpticalElement
 from ..base import _parse_position_keywords, MarxsElement
 from ..optics import FlatDetector
 from ..math.rotations import ex2vec_fix
-from ..math.pluecker import e2h, h2e
 from ..simulator import Parallel
 
 
@@ -41,7 +40,7 @@ def find_radius_of_photon_shell(photons, mirror_shell, x, percentile=[1,99]):
     '''
     p = photons[:]
     mdet = FlatDetector(position=np.array([x, 0, 0]), zoom=1e8, pixsize=1.)
-    p = mdet.process_photons(p)
+    p = mdet(p)
     ind = (p['probability'] > 0) & (p['mirror_shell'] == mirror_shell)
     r = np.sqrt(p['det_x'][ind]**2+p['det_y'][ind]**2.)
     return np.percentile(r, percentile)
@@ -88,8 +87,7 @@ class RowlandTorus(MarxsElement):
             raise ValueError('Input coordinates must be defined in Eukledian space.')
 
         if transform:
-            invpos4d = np.linalg.inv(self.pos4d)
-            xyz = h2e(np.einsum('...ij,...j', invpos4d, e2h(xyz, 1)))
+            xyz = np.dot(xyz, self.pos4d_inv[:3, :3].T) + self.pos4d_inv[:3, 3]
         return ((xyz**2).sum(axis=-1) + self.R**2. - self.r**2.)**2. - 4. * self.R**2. * (xyz[..., :2]**2).sum(axis=-1)
 
     def solve_quartic(self, x=None, y=None, z=None, interval=[0, 1]):
@@ -156,8 +154,7 @@ class RowlandTorus(MarxsElement):
         '''
         # For r,R  >> 1 even marginal differences lead to large
         # numbers on the quartic because of R**4 -> normalize
-        invpos4d = np.linalg.inv(self.pos4d)
-        xyz = h2e(np.einsum('...ij,...j', invpos4d, e2h(xyz, 1)))
+        xyz = np.dot(xyz, self.pos4d_inv[:3, :3].T) + self.pos4d_inv[:3, 3]
 
         if not np.allclose(self.quartic(xyz, transform=False) / self.R**4., 0.):
             raise ValueError('Gradient vector field is only defined for points on torus surface.')
@@ -166,7 +163,7 @@ class RowlandTorus(MarxsElement):
         dFdy = factor * xyz[..., 1] - 8. * self.R**2 * xyz[..., 1]
         dFdz = factor * xyz[..., 2]
         gradient = np.vstack([dFdx, dFdy, dFdz]).T
-        return h2e(np.einsum('...ij,...j', self.pos4d, e2h(gradient, 0)))
+        return np.dot(gradient, self.pos4d[:3, :3].T)
 
 def design_tilted_torus(f, alpha, beta):
     '''Design a torus with specifications similar to Heilmann et al. 2010
@@ -7,6 +7,7 @@ from ..rowland import RowlandTorus, GratingArrayStructure, find_radius_of_photon
 from ...optics.base import OpticalElement
 from ...source import PointSource, FixedPointing
 from ...optics import MarxMirror, uniform_efficiency_factory, FlatGrating
+from ...optics.grating import NO_ORDER
 
 def parametrictorus(R, r, theta, phi):
     '''Just another way to specify a torus with z-axis as symmetry'''
@@ -288,7 +289,7 @@ def test_run_photons_through_gas():
         mygas = GratingArrayStructure(mytorus, d_facet=60., x_range=[5e3,1e4], radius=[538., 550.], elem_class=FlatGrating, elem_args=facet_args, **kwargs)
 
         p = mygas(photons.copy())
-        indorder = np.isfinite(p['order'])
+        indorder = p['order'] != NO_ORDER
         indfacet = p[f] >=0
         assert np.all(indorder == indfacet)
 
@@ -0,0 +1,143 @@
+'''Bounding volume hierarchy to find optical elements that a ray might hit.
+
+Containers like `marxs.simulator.Parallel` can hold hundreds of elements, but
+every photon typically interacts with only one or two of them. Instead of
+calculating the intersection of every ray with every element, the elements are
+sorted into a tree of bounding spheres. A ray is then tested against the
+spheres in the tree and the exact intersection is calculated only for those
+elements that are close to the ray.
+'''
+import numpy as np
+
+
+def ray_near_sphere(e_dir, e_pos, center, radius):
+    '''Test if a line passes within a sphere.
+
+    All inputs are broadcast against each other, e.g. ``e_dir`` and ``e_pos`` of
+    shape (N, 1, 3) and ``center`` of shape (M, 3) test N lines against M spheres.
+
+    Parameters
+    ----------
+    e_dir : np.array of shape (N, 3)
+        Euclidean direction vectors of the lines. They do not have to be normalized.
+    e_pos : np.array of shape (N, 3)
+        Euclidean coordinates of one point on each line.
+    center : np.array of shape (3, )
+        Center of the sphere.
+    radius : float
+        Radius of the sphere.
+
+    Returns
+    -------
+    near : np.array of bool with shape (N, )
+        ``True`` if the distance between the line and the center of the sphere is
+        less or equal to ``radius``. Lines with ``nan`` entries are never near.
+    '''
+    d = center - e_pos
+    # The cross product is written out, because np.cross has a large overhead
+    # for the small arrays that are common in the tree.
+    c0 = d[..., 1] * e_dir[..., 2] - d[..., 2] * e_dir[..., 1]
+    c1 = d[..., 2] * e_dir[..., 0] - d[..., 0] * e_dir[..., 2]
+    c2 = d[..., 0] * e_dir[..., 1] - d[..., 1] * e_dir[..., 0]
+    dir2 = e_dir[..., 0]**2 + e_dir[..., 1]**2 + e_dir[..., 2]**2
+    return c0 * c0 + c1 * c1 + c2 * c2 <= radius**2 * dir2
+
+
+class BoundingSphereTree(object):
+    '''Binary tree of bounding spheres.
+
+    Each leaf of the tree holds a small number of elements. Each node holds a
+    sphere that encloses the spheres of all elements in the leaves below it.
+    The tree is built by splitting the elements at the median of their centers
+    along the axis with the largest spread.
+
+    Elements can be sorted into groups, e.g. to hold several copies of the same
+    elements at slightly different positions. Each group gets its own tree and
+    rays are only tested against the elements of their own group.
+
+    Parameters
+    ----------
+    centers : np.array of shape (M, 3)
+        Center of the bounding sphere for each element.
+    radii : np.array of shape (M, )
+        Radius of the bounding sphere for each element.
+    leafsize : int
+        Maximal number of elements in a leaf.
+    groups : np.array of int with shape (M, ) or ``None``
+        Group number for each element.
+    '''
+    def __init__(self, centers, radii, leafsize=4, groups=None):
+        self.centers = np.asanyarray(centers, dtype=float)
+        self.radii = np.asanyarray(radii, dtype=float)
+        if (self.centers.ndim != 2) or (self.centers.shape[1] != 3):
+            raise ValueError('centers must have shape (M, 3).')
+        if self.radii.shape != (self.centers.shape[0], ):
+            raise ValueError('There must be one radius for each center.')
+        self.leafsize = leafsize
+        if groups is None:
+            self.roots = {None: self._build(np.arange(len(self.radii)))}
+        else:
+            groups = np.asanyarray(groups)
+            if groups.shape != self.radii.shape:
+                raise ValueError('There must be one group number for each center.')
+            self.roots = dict([(g, self._build(np.flatnonzero(groups == g)))
+                               for g in np.unique(groups)])
+
+    def _build(self, ind):
+        '''Recursively build nodes of the form (center, radius, children, elements).'''
+        center = self.centers[ind].mean(axis=0)
+        radius = np.max(np.linalg.norm(self.centers[ind] - center, axis=1) + self.radii[ind])
+        if len(ind) <= self.leafsize:
+            return (center, radius, [], ind)
+        spread = self.centers[ind].max(axis=0) - self.centers[ind].min(axis=0)
+        order = np.argsort(self.centers[ind, np.argmax(spread)], kind='mergesort')
+        half = len(ind) // 2
+        return (center, radius,
+                [self._build(ind[order[:half]]), self._build(ind[order[half:]])],
+                None)
+
+    def query(self, e_dir, e_pos, groups=None):
+        '''Find elements that each ray may intersect.
+
+        Parameters
+        ----------
+        e_dir : np.array of shape (N, 3)
+            Euclidean direction vectors of the rays.
+        e_pos : np.array of shape (N, 3)
+            Euclidean coordinates of one point on each ray.
+        groups : np.array of int with shape (N, ) or ``None``
+            Group number for each ray. This is required if the tree was built with
+            groups and ignored otherwise.
+
+        Returns
+        -------
+        candidates : dict
+            The keys are the indices of those elements that are close to at least one
+            ray; the values are sorted arrays of indices into ``e_dir`` and ``e_pos``
+            of the rays that pass through the bounding sphere of this element.
+        '''
+        candidates = {}
+        if None in self.roots:
+            stack = [(self.roots[None], np.arange(e_dir.shape[0]))]
+        else:
+            if groups is None:
+                raise ValueError('The tree was built with groups, so groups must be given.')
+            groups = np.asanyarray(groups)
+            stack = [(self.roots[g], np.flatnonzero(groups == g))
+                     for g in np.unique(groups) if g in self.roots]
+        while stack:
+            (center, radius, children, elements), ind = stack.pop()
+            ind = ind[ray_near_sphere(e_dir[ind], e_pos[ind], center, radius)]
+            if len(ind) == 0:
+                continue
+            if elements is None:
+                stack.extend([(c, ind) for c in children])
+            else:
+                # test all elements in the leaf at once
+                near = ray_near_sphere(e_dir[ind][:, None, :], e_pos[ind][:, None, :],
+                                       self.centers[elements], self.radii[elements])
+                for j, e in enumerate(elements):
+                    hit = ind[near[:, j]]
+                    if len(hit) > 0:
+                        candidates[e] = hit
+        return candidates
@@ -0,0 +1,215 @@
+'''Compiled versions of the geometric kernels used in the ray-trace.
+
+The functions in this module are optional, compiled replacements for the
+innermost loops of `marxs.optics.FlatOpticalElement.intersect`,
+`marxs.optics.FlatGrating.diffract_photons`, `marxs.math.rotations.axangle2mat`
+and `marxs.optics.polarization.polarization_vectors`. They are compiled with
+`numba <http://numba.pydata.org>`_ if that package is installed. Each kernel
+does the work for one photon at a time in a single loop (that can be
+parallelized over all cores), instead of creating many temporary arrays like
+the numpy code.
+
+The numpy code in the calling functions is the reference implementation. The
+compiled kernels are used automatically if numba is installed; set
+``marxs.math.kernels.use_numba = False`` to use the numpy code instead, e.g.
+to compare results. Within the usual floating point accuracy, both give the
+same results.
+
+By default, the kernels run in a single thread. Set
+``marxs.math.kernels.use_parallel = True`` to distribute the loops over all
+cores. Do not combine this with `marxs.simulator.Sequence.run_parallel` or
+other process pools that fork the Python process: Depending on the threading
+layer that numba uses, forking a process that has started numba threads can
+dead-lock (see the numba documentation on threading layers).
+'''
+import numpy as np
+
+try:
+    import numba
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+use_numba = HAS_NUMBA
+'''Use the compiled kernels if numba is installed.'''
+
+use_parallel = False
+'''Run the compiled kernels in parallel on all cores.'''
+
+
+def _compile(func):
+    '''Compile ``func`` for serial and parallel execution and choose at run time.
+
+    numba compiles each version the first time it is called.
+    '''
+    serial = numba.njit(func)
+    threaded = numba.njit(parallel=True)(func)
+
+    def kernel(*args):
+        if use_parallel:
+            return threaded(*args)
+        return serial(*args)
+    kernel.__name__ = func.__name__
+    kernel.__doc__ = func.__doc__
+    kernel.dispatchers = (serial, threaded)
+    return kernel
+
+
+if HAS_NUMBA:
+    @_compile
+    def flat_intersect(dir, pos, proj, size, interpos, intercoos, intersect):
+        '''Intersect rays with a flat element.
+
+        See `marxs.optics.FlatOpticalElement.intersect` for the meaning of
+        ``proj`` and ``size``. Results are written into ``interpos``,
+        ``intercoos`` and ``intersect``.
+        '''
+        for i in numba.prange(dir.shape[0]):
+            p_dir0 = 0.
+            p_dir1 = 0.
+            p_dir2 = 0.
+            p_pos0 = proj[3, 0]
+            p_pos1 = proj[3, 1]
+            p_pos2 = proj[3, 2]
+            for k in range(3):
+                p_dir0 += dir[i, k] * proj[k, 0]
+                p_dir1 += dir[i, k] * proj[k, 1]
+                p_dir2 += dir[i, k] * proj[k, 2]
+                p_pos0 += pos[i, k] * proj[k, 0]
+                p_pos1 += pos[i, k] * proj[k, 1]
+                p_pos2 += pos[i, k] * proj[k, 2]
+            t = - (p_pos0 / p_dir0)
+            intercoos[i, 0] = p_dir1 * t + p_pos1
+            intercoos[i, 1] = p_dir2 * t + p_pos2
+            intersect[i] = ((abs(intercoos[i, 0]) <= size[0]) and
+                            (abs(intercoos[i, 1]) <= size[1]))
+            for k in range(3):
+                if intersect[i]:
+                    interpos[i, k] = dir[i, k] * t + pos[i, k]
+                else:
+                    interpos[i, k] = np.nan
+
+    @_compile
+    def axangle2mat(axes, angles, is_normalized):
+        '''Rotation matrices for rotations by ``angles`` around ``axes``.
+
+        See `marxs.math.rotations.axangle2mat`.
+        '''
+        n = axes.shape[0]
+        mat = np.empty((n, 3, 3))
+        for i in numba.prange(n):
+            x = axes[i, 0]
+            y = axes[i, 1]
+            z = axes[i, 2]
+            if not is_normalized:
+                norm = np.sqrt(x * x + y * y + z * z)
+                x = x / norm
+                y = y / norm
+                z = z / norm
+            c = np.cos(angles[i])
+            s = np.sin(angles[i])
+            C = 1 - c
+            xs = x * s
+            ys = y * s
+            zs = z * s
+            xC = x * C
+            yC = y * C
+            zC = z * C
+            xyC = x * yC
+            yzC = y * zC
+            zxC = z * xC
+            mat[i, 0, 0] = x * xC + c
+            mat[i, 0, 1] = xyC - zs
+            mat[i, 0, 2] = zxC + ys
+            mat[i, 1, 0] = xyC + zs
+            mat[i, 1, 1] = y * yC + c
+            mat[i, 1, 2] = yzC - xs
+            mat[i, 2, 0] = zxC - ys
+            mat[i, 2, 1] = yzC + xs
+            mat[i, 2, 2] = z * zC + c
+        return mat
+
+    @_compile
+    def diffract(p, l, d, n, basis, m, wave, sign, grating_d, transmission):
+        '''Diffract photons on a grating.
+
+        See `marxs.optics.FlatGrating.diffract_photons`. ``p`` are the normalized
+        Euclidean directions of the incoming photons, ``l``, ``d`` and ``n`` the
+        groove direction, the dispersion direction and the normal of the grating,
+        and ``basis`` is the (3, 3) matrix of those three vectors as rows
+        (in the order ``d, l, n``).
+
+        Returns
+        -------
+        dir : np.array of shape (N, 3)
+            Euclidean direction of the diffracted photons.
+        blazeangle : np.array of shape (N, )
+        '''
+        N = p.shape[0]
+        dir = np.empty((N, 3))
+        blazeangle = np.empty(N)
+        for i in numba.prange(N):
+            p_d = 0.
+            p_l = 0.
+            p_n = 0.
+            for k in range(3):
+                p_d += p[i, k] * d[k]
+                p_l += p[i, k] * l[k]
+                p_n += p[i, k] * n[k]
+            # blaze angle: angle between normal and ray projected in plane
+            # perpendicular to the grooves
+            perp_norm2 = 0.
+            perp_n = 0.
+            for k in range(3):
+                perp = p[i, k] - p_l * l[k]
+                perp_norm2 += perp * perp
+                perp_n += perp * n[k]
+            blazeangle[i] = np.arccos(abs(perp_n / np.sqrt(perp_norm2)))
+
+            direction = np.sign(p_n)
+            if not transmission:
+                direction *= -1
+            new_d = p_d + sign[i] * m[i] * wave[i] / grating_d
+            new_n = direction * np.sqrt(1. - new_d**2 - p_l**2)
+            for k in range(3):
+                dir[i, k] = new_d * basis[0, k] + p_l * basis[1, k] + new_n * basis[2, k]
+        return dir, blazeangle
+
+    @_compile
+    def polarization_vectors(dir, angles):
+        '''Polarization vectors for the polarization ``angles`` of photons with direction ``dir``.
+
+        See `marxs.optics.polarization.polarization_vectors`.
+        '''
+        n = len(angles)
+        polarization = np.zeros((n, 3))
+        for i in numba.prange(n):
+            norm = np.sqrt(dir[i, 0]**2 + dir[i, 1]**2 + dir[i, 2]**2)
+            r0 = dir[i, 0] / norm
+            r1 = dir[i, 1] / norm
+            r2 = dir[i, 2] / norm
+            # Same tolerance as np.isclose(r, 0)
+            if (abs(r0) <= 1e-8) and (abs(r2) <= 1e-8):
+                # polarization relative to positive x at 0
+                v0 = 1. - r0 * r0
+                v1 = - r1 * r0
+                v2 = - r2 * r0
+            else:
+                # polarization relative to positive y at 0
+                v0 = - r0 * r1
+                v1 = 1. - r1 * r1
+                v2 = - r2 * r1
+            vnorm = np.sqrt(v0 * v0 + v1 * v1 + v2 * v2)
+            v0 /= vnorm
+            v1 /= vnorm
+            v2 /= vnorm
+            # right hand coordinate system is v_1, v_2, r (photon direction)
+            w0 = r1 * v2 - r2 * v1
+            w1 = r2 * v0 - r0 * v2
+            w2 = r0 * v1 - r1 * v0
+            c = np.cos(angles[i])
+            s = np.sin(angles[i])
+            polarization[i, 0] = v0 * c + w0 * s
+            polarization[i, 1] = v1 * c + w1 * s
+            polarization[i, 2] = v2 * c + w2 * s
+        return polarization
@@ -50,7 +50,10 @@ def h2e(h):
         Euclidean coordinates. Same shape as ``e`` except that the last
         last dimension is now has 3 elements.
     '''
-    if np.all(h[..., 3] == 0) or np.allclose(h[..., 3], 1):
+    w = h[..., 3]
+    # Check the exact cases first, they are much cheaper than allclose
+    # and cover the photon lists where w is set explicitly.
+    if (not np.any(w)) or np.all(w == 1) or np.allclose(w, 1):
         return h[..., :3]
     elif np.all(h[..., 3] != 0):
         return (h[..., :3] / h[..., 3][..., None])
@@ -1,6 +1,199 @@
+import os
+import binascii
+import hashlib
+import numbers
+
 import numpy as np
 
-class RandomArbitraryPdf(object):
+
+class SeedTree(object):
+    '''Derive seeds for independent random number streams from a single seed.
+
+    A simulation has many elements that draw random numbers. To make the
+    simulation reproducible, each of them gets its own random number generator.
+    The seeds for these generators are derived from a single simulation seed in a
+    tree: Each node of the tree can `spawn` children, which can spawn children
+    themselves and so on. The seed of a node is a hash of the simulation seed
+    and the path from the root to this node, such that the seeds for different
+    nodes are independent of each other, but they are the same every time the
+    tree is built from the same simulation seed.
+
+    Parameters
+    ----------
+    entropy : int or ``None``
+        Simulation seed, must be a non-negative integer.
+        If ``None``, a seed is taken from the operating system.
+    spawn_key : tuple of int
+        Path from the root of the tree to this node. This is set by `spawn` and
+        should not be set by hand.
+
+    Example
+    -------
+    >>> from marxs.math.random import SeedTree
+    >>> tree = SeedTree(12345)
+    >>> chunks = tree.spawn(3)
+    >>> chunks[1].spawn_key
+    (1,)
+    >>> rs = chunks[1].make_random_state()
+    >>> rs2 = SeedTree(12345, (1,)).make_random_state()
+    >>> rs.rand() == rs2.rand()
+    True
+    '''
+    def __init__(self, entropy=None, spawn_key=()):
+        if entropy is None:
+            entropy = int(binascii.hexlify(os.urandom(16)), 16)
+        if entropy < 0:
+            raise ValueError('entropy must be a non-negative integer.')
+        self.entropy = entropy
+        self.spawn_key = tuple(spawn_key)
+        self.n_children_spawned = 0
+
+    def spawn(self, n):
+        '''Make ``n`` new children of this node.
+
+        Calling `spawn` several times gives new children every time.
+
+        Parameters
+        ----------
+        n : int
+            Number of children.
+
+        Returns
+        -------
+        children : list of `SeedTree`
+        '''
+        children = [SeedTree(self.entropy, self.spawn_key + (i, ))
+                    for i in range(self.n_children_spawned, self.n_children_spawned + n)]
+        self.n_children_spawned += n
+        return children
+
+    def generate_state(self):
+        '''Return the seed of this node.
+
+        Returns
+        -------
+        state : np.array of 8 np.uint32
+        '''
+        key = '{0}:{1}'.format(self.entropy, ','.join([str(k) for k in self.spawn_key]))
+        return np.frombuffer(hashlib.sha256(key.encode('ascii')).digest(),
+                             dtype='<u4').astype(np.uint32)
+
+    def make_random_state(self):
+        '''Make a random number generator seeded with the seed of this node.
+
+        Returns
+        -------
+        random_state : `numpy.random.RandomState`
+        '''
+        return np.random.RandomState(self.generate_state())
+
+
+def check_random_state(seed):
+    '''Turn ``seed`` into a `numpy.random.RandomState` instance.
+
+    Parameters
+    ----------
+    seed : ``None``, int, `SeedTree` or `numpy.random.RandomState`
+        If ``None``, return the global random number generator used by
+        ``np.random``. For an int, return a new generator seeded with
+        ``seed``. For a `SeedTree`, return a generator seeded with the seed of
+        this node. A `numpy.random.RandomState` is returned unchanged.
+
+    Returns
+    -------
+    random_state : `numpy.random.RandomState`
+    '''
+    if seed is None:
+        return np.random.mtrand._rand
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    if isinstance(seed, SeedTree):
+        return seed.make_random_state()
+    if isinstance(seed, numbers.Integral):
+        return np.random.RandomState(seed)
+    raise ValueError('{0} cannot be used to seed a RandomState.'.format(seed))
+
+
+def spawn_random_states(seed, n):
+    '''Make seeds for the ``n`` elements of a container.
+
+    Parameters
+    ----------
+    seed : ``None``, int, `SeedTree` or `numpy.random.RandomState`
+        Seed of the container.
+    n : int
+        Number of elements in the container.
+
+    Returns
+    -------
+    seeds : list
+        ``n`` seeds that can be passed to `check_random_state`. For an int or a `SeedTree`,
+        these are independent children in a `SeedTree`. ``None`` and a
+        `numpy.random.RandomState` instance are passed through to all elements, i.e. all
+        elements share the same random number generator.
+    '''
+    if isinstance(seed, numbers.Integral):
+        seed = SeedTree(seed)
+    if isinstance(seed, SeedTree):
+        return seed.spawn(n)
+    else:
+        return [seed] * n
+
+
+class RandomSampler(object):
+    '''Base class for random draws from a probability distribution.
+
+    A sampler transforms uniform random numbers into random numbers that follow
+    some other distribution. Derived classes implement this transformation in
+    `from_uniform` and set `n_uniform`; calling the object with the number of
+    draws then takes the uniform numbers from a random number generator.
+
+    All samplers in this module are initialized with a tabulated pdf, but
+    they differ in how they interpret the table and in the speed of the
+    initialization and of each draw:
+
+    - `RandomArbitraryPdf`: Piecewise constant pdf, a binary search over the
+      cdf for each draw.
+    - `RandomAliasPdf`: Same pdf as `RandomArbitraryPdf`, but each draw takes
+      the same time for any number of bins (alias method). This is faster
+      for spectra with many bins.
+    - `RandomPiecewiseLinearPdf`: Piecewise linear pdf, e.g. for smooth model
+      spectra.
+    '''
+    n_uniform = 1
+    '''Number of uniform random numbers needed for each draw.'''
+
+    def from_uniform(self, u):
+        '''Transform uniform random numbers into draws from the distribution.
+
+        Parameters
+        ----------
+        u : sequence of `n_uniform` np.arrays
+            Random numbers uniformly distributed in the interval [0, 1). All
+            arrays have the same length.
+
+        Returns
+        -------
+        draws : np.array
+            One random draw for each element in the arrays in ``u``.
+        '''
+        raise NotImplementedError
+
+    def __call__(self, N, random_state=None):
+        '''Draw from the distribution function. See docstring of class.
+
+        Parameters
+        ----------
+        N : int
+            Number of random draws.
+        random_state : ``None``, int or `numpy.random.RandomState`
+            Random number generator to use. See `check_random_state`.
+        '''
+        random_state = check_random_state(random_state)
+        return self.from_uniform([random_state.rand(N) for i in range(self.n_uniform)])
+
+
+class RandomArbitraryPdf(RandomSampler):
     '''Take random draw from an arbitrary (and arbitrarily binned) pdf.
 
     The PDF is approximated as piecewice constant.
@@ -65,6 +258,7 @@ class RandomArbitraryPdf(object):
         pdf = np.asarray(pdf) * self.bin_width
         self.sort = sort
         self.randomize_in_bin = randomize_in_bin
+        self.n_uniform = 2 if randomize_in_bin else 1
 
         # sort the pdf - otherwise bins with small numbers might be lost to round-off errors
         # idea is from http://stackoverflow.com/questions/21100716/
@@ -76,10 +270,9 @@ class RandomArbitraryPdf(object):
         # cumulative distribution function
         self.cdf = np.cumsum(self.pdf)
 
-    def __call__(self, N):
-        """Draw from the distribution function. See docstring of class."""
+    def from_uniform(self, u):
         #pick numbers which are uniformly random over the cumulative distribution function
-        choice = np.random.uniform(high=self.cdf[-1], size=N)
+        choice = u[0] * self.cdf[-1]
         # Now here is the difficult and comparatively expensive part:
         # We need a reverse lookup to find the bin in the cdf so that we an use it
         # to map this back to the x values of the pdf
@@ -89,6 +282,255 @@ class RandomArbitraryPdf(object):
         if self.sort:
             index = self.sortindex[index]
         if self.randomize_in_bin:
-            return self.x[index - 1] + self.bin_width[index] * np.random.rand(N)
+            return self.x[index - 1] + self.bin_width[index] * u[1]
+        else:
+            return self.x[index]
+
+
+class RandomAliasPdf(RandomSampler):
+    '''Random draws from a binned pdf with the alias method.
+
+    This sampler interprets its input exactly like `RandomArbitraryPdf`, i.e.
+    the pdf is piecewise constant, ``x`` are the **upper** bin edges and
+    ``pdf[0]`` is ignored. Instead of a binary search over the cdf, it uses
+    Vose's version of Walker's alias method: Every bin is split into a part
+    that belongs to the bin itself and a part that belongs to one other bin
+    (the "alias"), such that all bins have the same total probability. A draw
+    then picks one bin with equal probability for all bins and decides
+    between the bin and its alias with a single comparison, so the time for
+    a draw does not depend on the number of bins.
+
+    Setting up the tables takes longer than for `RandomArbitraryPdf` (a
+    Python loop over all bins), so this sampler is most useful if many
+    photons are drawn from the same pdf.
+
+    Parameters
+    ----------
+    x : np.array
+        **Upper** bin edge for input bins
+    pdf : np.array
+        Value of the pdf for each bin. ``pdf[0]`` is ignored, since the lower edge
+        of that bin is undefined.
+    randomize_in_bin : bool
+        If ``True`` randomize the return value over each bin. If ``False`` the return
+        value will be exactly the **upper** bin edge.
+
+    References
+    ----------
+    Vose, M. D. (1991), A linear algorithm for generating random numbers with
+    a given distribution, IEEE Transactions on Software Engineering, 17, 972
+    '''
+    def __init__(self, x, pdf, randomize_in_bin=True):
+        if not len(x) == len(pdf):
+            raise ValueError('x and pdf must have same number of elements.')
+        if not np.all(pdf >= 0):
+            raise ValueError('pdf cannot have negative elements.')
+
+        self.x = np.asarray(x)
+        self.bin_width = np.hstack(([0], np.diff(x)))
+        if not np.all(self.bin_width >=0):
+            raise ValueError('x must be input in increasing order.')
+        self.randomize_in_bin = randomize_in_bin
+        self.n_uniform = 2 if randomize_in_bin else 1
+
+        weights = np.asarray(pdf, dtype=float) * self.bin_width
+        n = len(weights)
+        prob = weights * n / weights.sum()
+        alias = np.arange(n)
+        small = list(np.nonzero(prob < 1)[0])
+        large = list(np.nonzero(prob >= 1)[0])
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            alias[s] = l
+            prob[l] = (prob[l] + prob[s]) - 1.
+            if prob[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        # Whatever is left over is 1 up to round-off errors
+        prob[small + large] = 1.
+        self.prob = prob
+        self.alias = alias
+
+    def from_uniform(self, u):
+        # One uniform number selects the bin and decides between bin and alias
+        scaled = u[0] * len(self.prob)
+        index = np.minimum(scaled.astype(int), len(self.prob) - 1)
+        index = np.where(scaled - index < self.prob[index], index, self.alias[index])
+        if self.randomize_in_bin:
+            return self.x[index - 1] + self.bin_width[index] * u[1]
         else:
             return self.x[index]
+
+
+class RandomPiecewiseLinearPdf(RandomSampler):
+    '''Random draws from a piecewise linear pdf.
+
+    Unlike `RandomArbitraryPdf`, which treats the input as a histogram, this
+    sampler interpolates linearly between the tabulated values of the pdf.
+    This is a better description for smooth model spectra that are given on
+    a grid. Random numbers are drawn by inverting the cdf, which is quadratic
+    between two grid points.
+
+    Parameters
+    ----------
+    x : np.array
+        Points where the pdf is given, in strictly increasing order.
+        No numbers are drawn outside of the range of ``x``.
+    pdf : np.array
+        Value of the pdf at ``x``.
+
+    Examples
+    --------
+    A pdf that increases linearly from 0 to 1 has a mean of 2/3:
+
+    >>> import numpy as np
+    >>> a = RandomPiecewiseLinearPdf(np.array([0., 1.]), np.array([0., 2.]))
+    >>> draws = a(10000, random_state=0)
+    >>> print(round(draws.mean(), 2))
+    0.66
+    '''
+    def __init__(self, x, pdf):
+        if not len(x) == len(pdf):
+            raise ValueError('x and pdf must have same number of elements.')
+        if len(x) < 2:
+            raise ValueError('x and pdf must have at least two elements.')
+        if not np.all(pdf >= 0):
+            raise ValueError('pdf cannot have negative elements.')
+        self.x = np.asarray(x, dtype=float)
+        self.pdf = np.asarray(pdf, dtype=float)
+        self.width = np.diff(self.x)
+        if not np.all(self.width > 0):
+            raise ValueError('x must be input in strictly increasing order.')
+        self.slope = np.diff(self.pdf) / self.width
+        self.area = 0.5 * (self.pdf[:-1] + self.pdf[1:]) * self.width
+        self.cdf = np.cumsum(self.area)
+
+    def from_uniform(self, u):
+        choice = u[0] * self.cdf[-1]
+        # Segments with zero area are never selected with side='right'
+        index = np.minimum(np.searchsorted(self.cdf, choice, side='right'), len(self.cdf) - 1)
+        # Area to be covered in this segment
+        r = choice - (self.cdf[index] - self.area[index])
+        f0 = self.pdf[index]
+        # Solve f0 * t + slope / 2 * t**2 = r for t; this form is stable
+        # for slope = 0 and for f0 = 0.
+        root = np.sqrt(np.maximum(f0**2 + 2 * self.slope[index] * r, 0))
+        denom = f0 + root
+        t = np.where(denom > 0, 2 * r / np.where(denom > 0, denom, 1.), 0.)
+        return self.x[index] + np.clip(t, 0, self.width[index])
+
+
+def _primes(n):
+    '''All prime numbers smaller than ``n``.'''
+    sieve = np.ones(n, dtype=bool)
+    sieve[:2] = False
+    for i in range(2, int(np.sqrt(n)) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = False
+    return np.nonzero(sieve)[0]
+
+
+class HaltonSequence(object):
+    '''Scrambled Halton sequence of quasi-random points in the unit cube.
+
+    Quasi-random (or low-discrepancy) points cover the unit cube much more evenly
+    than pseudo-random numbers. When they replace the uniform random numbers in a
+    Monte-Carlo simulation, integrals such as the effective area or the width of a
+    PSF converge faster with the number of photons: The error of a quasi-random
+    estimate decreases almost as :math:`1/N` instead of :math:`1/\\sqrt{N}`, if the
+    quantity depends smoothly on the random numbers.
+
+    Coordinate ``k`` of point ``i`` in the Halton sequence is the radical inverse
+    of ``i`` in base :math:`b_k`, i.e. the digits of ``i`` in base :math:`b_k`
+    mirrored at the decimal point; different coordinates use different prime
+    numbers as base. In the scrambled version, the digits are permuted with a
+    random permutation for each coordinate and digit position. This removes the
+    correlations between coordinates with large bases and makes every point
+    uniformly distributed, so that estimates from the sequence are unbiased and
+    independent scramblings can be used to estimate the uncertainty.
+
+    The sequence remembers how many points it has generated and continues
+    from there on the next call.
+
+    Parameters
+    ----------
+    dim : int
+        Number of dimensions.
+    scramble : bool
+        If ``True``, scramble the digits with random permutations.
+    random_state : ``None``, int or `numpy.random.RandomState`
+        Random number generator used for the scrambling. See `check_random_state`.
+    bases : list of int or ``None``
+        Prime numbers used as bases. If ``None``, the first ``dim`` prime numbers
+        are used. Sequences with the same bases are correlated, even if they are
+        scrambled differently, so quantities that should be independent need
+        sequences with different bases.
+
+    Examples
+    --------
+    >>> halton = HaltonSequence(2, scramble=False, bases=[2, 3])
+    >>> print(halton(4))
+    [[0.         0.5        0.25       0.75      ]
+     [0.         0.33333333 0.66666667 0.11111111]]
+
+    References
+    ----------
+    Owen, A. B. (2017), A randomized Halton algorithm in R, arXiv:1706.02808
+    '''
+    def __init__(self, dim, scramble=True, random_state=None, bases=None):
+        if bases is None:
+            bases = _primes(max(10, int(3 * dim * np.log(dim + 1))))[:dim]
+        if len(bases) != dim:
+            raise ValueError('Need one base for each dimension.')
+        self.bases = [int(b) for b in bases]
+        self.scramble = scramble
+        self.index = 0
+        random_state = check_random_state(random_state)
+        self.permutations = []
+        self.tails = []
+        for b in self.bases:
+            # enough digits to cover the resolution of a double
+            ndigits = int(np.ceil(53 * np.log(2) / np.log(b)))
+            if scramble:
+                perm = np.array([random_state.permutation(b) for j in range(ndigits)])
+            else:
+                perm = np.tile(np.arange(b), (ndigits, 1))
+            self.permutations.append(perm)
+            # Contribution of all digits from position k on if these digits
+            # are 0 in the index.
+            weights = float(b) ** -np.arange(1, ndigits + 1)
+            self.tails.append(np.hstack([np.cumsum((perm[:, 0] * weights)[::-1])[::-1], [0.]]))
+
+    def __call__(self, n):
+        '''Return the next ``n`` points of the sequence.
+
+        Parameters
+        ----------
+        n : int
+            Number of points.
+
+        Returns
+        -------
+        points : np.array of shape (dim, n)
+            Points in the interval [0, 1) in each dimension.
+        '''
+        n = int(n)
+        index = np.arange(self.index, self.index + n, dtype=np.int64)
+        self.index += n
+        points = np.zeros((len(self.bases), n))
+        for d, b in enumerate(self.bases):
+            perm = self.permutations[d]
+            # Number of digits that can be non-zero in this batch
+            ndigits = 1
+            while (ndigits < perm.shape[0]) and (b ** ndigits <= self.index):
+                ndigits += 1
+            rest = index.copy()
+            weight = 1. / b
+            for j in range(ndigits):
+                points[d, :] += perm[j, rest % b] * weight
+                rest //= b
+                weight /= b
+            points[d, :] += self.tails[d][ndigits]
+        return np.minimum(points, 1. - 2. ** -53)
@@ -1,6 +1,8 @@
 import numpy as np
 from transforms3d.utils import normalized_vector
 
+from . import kernels
+
 def ex2vec_fix(e1, efix):
     '''Rotate x-axis to e1, keeping a vector that is coplanar with fix coplanar.
 
@@ -65,6 +67,9 @@ def axangle2mat(axes, angles, is_normalized=False):
     '''
     if len(angles) != axes.shape[0]:
         raise ValueError('There must be one angle for each axes vector.')
+    if kernels.use_numba:
+        return kernels.axangle2mat(np.asarray(axes, dtype=np.float64),
+                                   np.asarray(angles, dtype=np.float64), is_normalized)
 
     if not is_normalized:
         axes = axes / np.linalg.norm(axes, axis=1)[:, None]
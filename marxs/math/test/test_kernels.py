@@ -0,0 +1,113 @@
+'''Compare the compiled kernels with the numpy reference implementation.'''
+import numpy as np
+import pytest
+from transforms3d.axangles import axangle2aff
+
+from .. import kernels
+from ..rotations import axangle2mat
+from ...optics import FlatDetector, FlatGrating, CATGrating, uniform_efficiency_factory
+from ...optics.polarization import polarization_vectors
+from ...utils import generate_test_photons
+from ...precision import precision
+
+pytestmark = pytest.mark.skipif(not kernels.HAS_NUMBA, reason='numba is not installed')
+
+
+def both(monkeypatch, func):
+    '''Run ``func`` with the numpy code and with the compiled kernels.'''
+    results = []
+    for value in [False, True]:
+        monkeypatch.setattr(kernels, 'use_numba', value)
+        results.append(func())
+    return results
+
+
+def test_flat_intersect(monkeypatch):
+    det = FlatDetector(position=[3, 2, 1], zoom=[1, 3, 5],
+                       orientation=axangle2aff(np.array([1, 2, 3]), .3)[:3, :3])
+    rand = np.random.RandomState(0)
+    pos = rand.normal(size=(1000, 3)) * 3 + [10, 0, 0]
+    dir = rand.normal(size=(1000, 3)) * .1 + [-1, 0, 0]
+    ref, res = both(monkeypatch, lambda: det.intersect(dir, pos))
+    assert np.all(ref[0] == res[0])
+    assert 100 < res[0].sum() < 1000
+    for i in [1, 2]:
+        assert np.allclose(ref[i], res[i], equal_nan=True)
+    ref, res = both(monkeypatch, lambda: det.intersect(dir[0], pos[0]))
+    assert ref[0] == res[0]
+    for i, shape in [(1, (3, )), (2, (2, ))]:
+        assert ref[i].shape == shape
+        assert res[i].shape == shape
+        assert np.allclose(ref[i], res[i], equal_nan=True)
+
+
+def test_axangle2mat(monkeypatch):
+    rand = np.random.RandomState(0)
+    axes = rand.normal(size=(100, 3))
+    angles = rand.uniform(-np.pi, np.pi, size=100)
+    ref, res = both(monkeypatch, lambda: axangle2mat(axes, angles))
+    assert np.allclose(ref, res)
+    norm = axes / np.linalg.norm(axes, axis=1)[:, None]
+    ref, res = both(monkeypatch, lambda: axangle2mat(norm, angles, is_normalized=True))
+    assert np.allclose(ref, res)
+
+
+@pytest.mark.parametrize('gratingclass', [FlatGrating, CATGrating])
+@pytest.mark.parametrize('transmission', [True, False])
+def test_diffract(monkeypatch, gratingclass, transmission):
+    photons = generate_test_photons(500)
+    rand = np.random.RandomState(0)
+    photons['dir'][:, 1:3] = rand.normal(scale=0.1, size=(500, 2))
+    photons['energy'] = rand.uniform(.3, 2., size=500)
+
+    def run():
+        grat = gratingclass(d=1e-4, order_selector=uniform_efficiency_factory(),
+                            groove_angle=.3, transmission=transmission, random_state=0,
+                            orientation=axangle2aff(np.array([0, 1, 1]), .2)[:3, :3])
+        return grat.diffract_photons(photons, np.arange(500))
+
+    ref, res = both(monkeypatch, run)
+    assert np.all(ref[1] == res[1])
+    for i in [0, 2, 3]:
+        assert np.allclose(ref[i], res[i])
+
+
+def test_polarization_vectors(monkeypatch):
+    rand = np.random.RandomState(0)
+    dir = rand.normal(size=(200, 3))
+    # special case: parallel to the y axis
+    dir[:10] = [0, 1, 0]
+    angles = rand.uniform(0, 2 * np.pi, size=200)
+    ref, res = both(monkeypatch, lambda: polarization_vectors(dir, angles))
+    assert ref.shape == (200, 3)
+    assert np.allclose(ref, res)
+
+
+def test_single_precision(monkeypatch):
+    '''Single precision photon columns give the same results as the numpy code.'''
+    with precision('single'):
+        photons = generate_test_photons(500)
+        rand = np.random.RandomState(0)
+        photons['dir'][:, 1:3] = rand.normal(scale=0.1, size=(500, 2))
+        photons['energy'] = rand.uniform(.3, 2., size=500)
+    assert photons['dir'].dtype == np.float32
+    det = FlatDetector(position=[-1, 0, 0], zoom=[1, 3, 5])
+    ref, res = both(monkeypatch, lambda: det.intersect(photons['dir'].data,
+                                                       photons['pos'].data))
+    assert np.all(ref[0] == res[0])
+    for i in [1, 2]:
+        assert np.allclose(ref[i], res[i], equal_nan=True)
+
+    def run():
+        grat = FlatGrating(d=1e-4, order_selector=uniform_efficiency_factory(),
+                           groove_angle=.3, random_state=0)
+        return grat.diffract_photons(photons, np.arange(500))
+
+    ref, res = both(monkeypatch, run)
+    assert np.all(ref[1] == res[1])
+    for i in [0, 2, 3]:
+        assert np.allclose(ref[i], res[i], rtol=1e-5)
+    # no additional compilation for single precision input
+    for kernel in [kernels.flat_intersect, kernels.diffract]:
+        for sig in kernel.dispatchers[0].signatures:
+            assert 'float32' not in str(sig)
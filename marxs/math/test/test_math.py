@@ -59,3 +59,19 @@ def test_intersect_line_plane():
     lines = e_pointpoint2line(p, q)
     plane = np.array([0, -1., 0, 5])
     assert np.allclose(h2e(intersect_line_plane(lines, plane)), p)
+
+
+def test_bvh_groups():
+    '''Rays are only routed to the elements of their own group.'''
+    from ..bvh import BoundingSphereTree
+    centers = np.array([[0., 0, 0], [0, 0, 0], [0, 5, 0]])
+    tree = BoundingSphereTree(centers, np.ones(3), groups=[0, 1, 0])
+    e_dir = np.tile([1., 0, 0], (3, 1))
+    e_pos = np.array([[5., 0, 0], [5, 0, 0], [5, 5, 0]])
+    cand = tree.query(e_dir, e_pos, groups=[0, 1, 0])
+    assert set(cand.keys()) == set([0, 1, 2])
+    assert list(cand[0]) == [0]
+    assert list(cand[1]) == [1]
+    assert list(cand[2]) == [2]
+    with pytest.raises(ValueError):
+        tree.query(e_dir, e_pos)
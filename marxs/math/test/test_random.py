@@ -1,6 +1,9 @@
 import numpy as np
 
-from ..random import RandomArbitraryPdf
+import pytest
+
+from ..random import (RandomArbitraryPdf, RandomAliasPdf, RandomPiecewiseLinearPdf,
+                      HaltonSequence, SeedTree, check_random_state, spawn_random_states)
 
 # Any number will do. Just make it repeatable.
 np.random.seed(12324)
@@ -26,3 +29,95 @@ def test_unequal_bins():
     draws = rand(1e4)
     draws.sort()
     assert draws[1000] > 1
+
+def test_random_state_pdf():
+    '''A RandomState makes draws reproducible and independent of the global state.'''
+    rand = RandomArbitraryPdf(np.arange(10.), np.ones(10))
+    d1 = rand(100, random_state=np.random.RandomState(3))
+    d2 = rand(100, random_state=3)
+    assert np.all(d1 == d2)
+
+def test_arbitrary_pdf_from_uniform():
+    '''Calling the sampler uses the same random numbers as from_uniform.'''
+    rand = RandomArbitraryPdf(np.arange(10.), np.arange(10.))
+    rs = np.random.RandomState(5)
+    u = [rs.rand(50), rs.rand(50)]
+    assert np.all(rand(50, random_state=5) == rand.from_uniform(u))
+
+@pytest.mark.parametrize('randomize_in_bin', [True, False])
+def test_alias_same_pdf(randomize_in_bin):
+    '''Alias method and cdf inversion sample the same binned pdf.'''
+    x = np.array([0., 1., 3., 4., 8., 9.])
+    pdf = np.array([5., 1., 0., 3., 0.5, 2.])
+    draws = RandomAliasPdf(x, pdf, randomize_in_bin=randomize_in_bin)(100000, random_state=1)
+    ref = RandomArbitraryPdf(x, pdf, randomize_in_bin=randomize_in_bin)(100000, random_state=2)
+    # index of the bin (given by its upper edge) for each draw
+    hist = np.bincount(np.searchsorted(x, draws), minlength=len(x))[1:]
+    histref = np.bincount(np.searchsorted(x, ref), minlength=len(x))[1:]
+    assert hist[1] == 0
+    assert np.allclose(hist, histref, rtol=0.03)
+    assert np.allclose(hist / 1e5, pdf[1:] * np.diff(x) / (pdf[1:] * np.diff(x)).sum(),
+                       atol=0.005)
+    if randomize_in_bin:
+        assert np.isclose(draws[(draws > 4) & (draws < 8)].mean(), 6, rtol=0.02)
+
+def test_piecewise_linear():
+    '''Compare with the analytical cdf of a piecewise linear pdf.'''
+    x = np.array([0., 1., 2., 2.5])
+    pdf = np.array([0., 2., 2., 0.])
+    draws = RandomPiecewiseLinearPdf(x, pdf)(100000, random_state=0)
+    assert draws.min() >= 0
+    assert draws.max() <= 2.5
+    # Areas of the segments are 1, 2, 0.5
+    hist, edges = np.histogram(draws, bins=x)
+    assert np.allclose(hist / 1e5, [1. / 3.5, 2. / 3.5, .5 / 3.5], atol=0.005)
+    # cdf in first segment is x**2
+    assert np.isclose((draws < 0.5).sum() / 1e5, 0.25 / 3.5, atol=0.005)
+    # segments with zero area are skipped
+    rand = RandomPiecewiseLinearPdf(np.array([0., 1., 2., 3.]), np.array([0., 0., 1., 1.]))
+    assert np.all(rand(1000, random_state=0) >= 1.)
+
+def test_seedtree():
+    '''Nodes with the same path give the same stream, different nodes differ.'''
+    tree = SeedTree(42)
+    a, b = tree.spawn(2)
+    c = tree.spawn(1)[0]
+    assert c.spawn_key == (2, )
+    assert not np.all(a.generate_state() == b.generate_state())
+    assert np.all(a.spawn(1)[0].generate_state() == SeedTree(42, (0, 0)).generate_state())
+    r1 = check_random_state(SeedTree(42).spawn(2)[1]).rand(5)
+    r2 = b.make_random_state().rand(5)
+    assert np.all(r1 == r2)
+    assert not np.all(SeedTree(43, (1, )).make_random_state().rand(5) == r2)
+
+def test_spawn_random_states():
+    rs = np.random.RandomState(0)
+    assert spawn_random_states(rs, 3) == [rs] * 3
+    assert spawn_random_states(None, 2) == [None, None]
+    assert [s.spawn_key for s in spawn_random_states(5, 2)] == [(0, ), (1, )]
+    assert check_random_state(None) is check_random_state(None)
+
+def test_halton():
+    '''Unscrambled sequence is the radical inverse; sequences continue.'''
+    halton = HaltonSequence(2, scramble=False, bases=[2, 3])
+    assert np.allclose(halton(5), [[0, .5, .25, .75, .125], [0, 1. / 3, 2. / 3, 1. / 9, 4. / 9]])
+    assert np.allclose(halton(2), [[.625, .375], [7. / 9, 2. / 9]])
+
+def test_halton_scrambled():
+    '''Scrambled points are evenly distributed and depend on the seed.'''
+    p1 = HaltonSequence(2, random_state=1)(2 ** 10)
+    p2 = HaltonSequence(2, random_state=2)(2 ** 10)
+    assert not np.allclose(p1, p2)
+    assert np.all((p1 >= 0) & (p1 < 1))
+    # every interval of length 1/2**k contains the same number of points in base 2
+    assert np.all(np.histogram(p1[0], bins=64, range=[0, 1])[0] == 16)
+    # Same seed, same sequence
+    halton = HaltonSequence(2, random_state=1, bases=[2, 3])
+    assert np.allclose(np.hstack([halton(100), halton(924)]),
+                       HaltonSequence(2, random_state=1, bases=[2, 3])(1024))
+
+def test_halton_bases():
+    '''By default, the first primes are used as bases.'''
+    assert HaltonSequence(2).bases == [2, 3]
+    assert HaltonSequence(5).bases == [2, 3, 5, 7, 11]
+    assert len(HaltonSequence(100).bases) == 100
@@ -1,7 +1,8 @@
 import numpy as np
 
 from ..import utils
-from transforms3d.affines import compose
+from transforms3d.affines import compose, decompose44
+from transforms3d.euler import euler2mat
 
 def test_random_mat():
     '''Compare multiplication of trans and zoom matrixes with transfomrs3d.
@@ -36,3 +37,30 @@ def test_normalize():
     for i in range(5):
         vecout[i, :] = vec[i, :] / np.linalg.norm(vec[i, :])
     assert np.allclose(vecout, utils.norm_vector(vec))
+
+def test_decompose44_stack():
+    '''Compare vectorized decomposition with transforms3d.'''
+    mats = [compose(np.random.rand(3), euler2mat(*np.random.rand(3)), np.random.rand(3) + .1)
+            for i in range(5)]
+    # include a reflection
+    mats.append(compose([1, 2, 3], np.eye(3), [-1, 2, 3]))
+    t, r, z, s = utils.decompose44_stack(np.array(mats))
+    for i, m in enumerate(mats):
+        t1, r1, z1, s1 = decompose44(m)
+        assert np.allclose(t[i], t1)
+        assert np.allclose(r[i], r1)
+        assert np.allclose(z[i], z1)
+        assert np.allclose(s[i], s1)
+
+def test_apply_affine():
+    '''Compare with the multiplication in homogeneous coordinates.'''
+    from ..pluecker import e2h, h2e
+    aff = compose(np.random.rand(3), euler2mat(*np.random.rand(3)), np.random.rand(3) + .1)
+    vec = np.random.rand(5, 3)
+    for w in [0, 1]:
+        assert np.allclose(utils.apply_affine(aff, vec, w),
+                           h2e(np.dot(e2h(vec, w), aff.T)))
+    expected = h2e(np.dot(e2h(vec, 1), aff.T))
+    out = utils.apply_affine(aff, vec, 1, out=vec)
+    assert out is vec
+    assert np.allclose(vec, expected)
@@ -59,6 +59,36 @@ def mat2aff(mat):
     m[:3, :3] = mat
     return m
 
+def apply_affine(aff, vec, w, out=None):
+    '''Apply an affine 4*4 matrix to Euklidean positions or directions.
+
+    This gives the same result as ``h2e(np.dot(e2h(vec, w), aff.T))``, but
+    without the homogeneous temporaries.
+
+    Parameters
+    ----------
+    aff : (4, 4) array
+        affine transformation matrix
+    vec : np.array
+        Euklidean vectors of shape (n, 3)
+    w : int
+        ``1`` for positions, ``0`` for directions (which are not translated)
+    out : np.array or ``None``
+        If given, the result is written into this array, which can be ``vec``
+        itself.
+
+    Returns
+    -------
+    vec : np.array
+        Transformed vectors of shape (n, 3)
+    '''
+    if not ((w == 0) or (w == 1)):
+        raise ValueError('w must be 0 or 1.')
+    out = np.matmul(vec, aff[:3, :3].T, out=out)
+    if w == 1:
+        out += aff[:3, 3]
+    return out
+
 def norm_vector(vec):
     '''Normalize euklidean vectors.
 
@@ -74,3 +104,51 @@ def norm_vector(vec):
     '''
     length2 = np.sum(vec * vec, axis=-1)
     return vec / np.sqrt(length2)[:, None]
+
+
+def decompose44_stack(aff):
+    '''Decompose a stack of affine 4*4 matrices into translation, rotation, zoom and shear.
+
+    This is a vectorized version of `transforms3d.affines.decompose44` and follows the
+    same conventions.
+
+    Parameters
+    ----------
+    aff : (M, 4, 4) array
+        affine transformation matrices
+
+    Returns
+    -------
+    trans : (M, 3) array
+        translation vectors
+    rot : (M, 3, 3) array
+        rotation matrices
+    zoom : (M, 3) array
+        zoom factors in x, y, z
+    shear : (M, 3) array
+        shear factors for x-y, x-z, y-z
+    '''
+    aff = np.asanyarray(aff, dtype=float)
+    trans = aff[:, :3, 3].copy()
+    m0 = aff[:, :3, 0].copy()
+    m1 = aff[:, :3, 1].copy()
+    m2 = aff[:, :3, 2].copy()
+    sx = np.sqrt((m0 * m0).sum(axis=1))
+    m0 /= sx[:, None]
+    sx_sxy = (m0 * m1).sum(axis=1)
+    m1 -= sx_sxy[:, None] * m0
+    sy = np.sqrt((m1 * m1).sum(axis=1))
+    m1 /= sy[:, None]
+    sx_sxz = (m0 * m2).sum(axis=1)
+    sy_syz = (m1 * m2).sum(axis=1)
+    m2 -= sx_sxz[:, None] * m0 + sy_syz[:, None] * m1
+    sz = np.sqrt((m2 * m2).sum(axis=1))
+    m2 /= sz[:, None]
+    rot = np.stack([m0, m1, m2], axis=2)
+    # Make sure this is a proper rotation (det = +1), put the reflection into the zoom
+    flip = np.linalg.det(rot) < 0
+    sx[flip] *= -1
+    rot[flip, :, 0] *= -1
+    zoom = np.vstack([sx, sy, sz]).T
+    shear = np.vstack([sx_sxy / sx, sx_sxz / sx, sy_syz / sy]).T
+    return trans, rot, zoom, shear
@@ -32,7 +32,7 @@ from ...optics import MarxMirror as HDMA
 from ...optics import FlatDetector, FlatGrating, uniform_efficiency_factory
 from ...source import FixedPointing
 from ...simulator import Sequence, Parallel
-from ...math.pluecker import h2e
+from ...photons import to_homogeneous
 from .fitsheaders import complete_header
 from .data import (NOMINAL_FOCALLENGTH, AIMPOINTS, TDET, ODET, PIXSIZE,
     PIX_CORNER_LSI_PAR)
@@ -86,7 +86,7 @@ class ACISChip(FlatDetector):
         # from pixel coordinates because that's all we have.
         # Here, we already know the spacecraft coordiantes (STF), so we can start from there.
         # I just hope it is consistent and I did not screw up the offsets at some point.
-        fc = h2e(interpos[intersect, :])
+        fc = interpos[intersect, :]
         mn = fc  # Systems differ only in x-direction
         mn[:, 0] -= NOMINAL_FOCALLENGTH
         x = mn[:, 1] / mn[:, 0] / self.pixsize_in_rad
@@ -293,7 +293,7 @@ class LissajousDither(FixedPointing):
         return pointing
 
     def photons_dir(self, ra, dec, time):
-        '''Calculate direction on photons in homogeneous coordinates.
+        '''Calculate direction on photons in Euclidean coordinates.
 
         Parameters
         ----------
@@ -306,12 +306,12 @@ class LissajousDither(FixedPointing):
 
         Returns
         -------
-        photons_dir : np.array of shape (n, 4)
-            Homogeneous direction vector for each photon
+        photons_dir : np.array of shape (n, 3)
+            Euclidean direction vector for each photon
         '''
         # Minus sign here because photons start at +inf and move towards origin
         pointing = self.pointing(time)
-        photons_dir = np.zeros((len(ra), 4))
+        photons_dir = np.zeros((len(ra), 3))
         photons_dir[:, 0] = - np.cos(dec) * np.cos(ra)
         photons_dir[:, 1] = - np.cos(dec) * np.sin(ra)
         photons_dir[:, 2] = - np.sin(dec)
@@ -320,7 +320,7 @@ class LissajousDither(FixedPointing):
                               - pointing[i, 1],
                               - pointing[i, 2], 'rzyx')
 
-            photons_dir[i, :3] = np.dot(mat3d.T, photons_dir[i, :3])
+            photons_dir[i, :] = np.dot(mat3d.T, photons_dir[i, :])
 
         return photons_dir
 
@@ -379,6 +379,8 @@ class Chandra(Sequence):
         # rename RA, DEC columns - otherwise CIAO tasks will be confused.
         photons.rename_column('ra', 'marxs_ra')
         photons.rename_column('dec', 'marxs_dec')
+        # Event files keep pos and dir in homogeneous coordinates as in earlier versions.
+        to_homogeneous(photons)
         complete_header(photons.meta, photons, 'EVT1', ['OGIP', 'EVENTS', 'ALL'])
         photons.write(filename, format='fits')
         # add_GTIs(filename)
@@ -27,9 +27,33 @@ class HETG(Parallel):
         # Gratings are defined in order MEG, then HEG
         d = [4001.95 * 1e-7] * 192 + [2000.81 * 1e-7] * 144
         kwargs['elem_args'] = {'order_selector': uniform_efficiency_factory(),
-                               'd': d, 'name' : list(self.hess['hessloc'])}
+                               'd': d, 'name' : list(self.hess['hessloc']),
+                               'groove_angle': list(self.groove_angles())}
         super(HETG, self).__init__(**kwargs)
 
+    def groove_angles(self):
+        '''Calculate the groove angle of each facet from the groove directions in the table.
+
+        The table lists the direction of the grooves (``ul``) and the dispersion direction
+        (``ud``) for each facet. The groove angle is chosen such that the dispersion
+        direction of the `~marxs.optics.FlatGrating` (``e_perp_groove``) matches ``ud``.
+        ``ul`` and ``ud`` in the table do not form a right-handed system with the facet
+        normal, so ``e_groove`` points in the direction of ``-ul``. That does not
+        change the diffraction, which depends only on the sign of the dispersion direction.
+
+        Returns
+        -------
+        groove_angles : np.array
+            Groove angle for each facet in radian.
+        '''
+        hess = self.hess
+        facnorm = np.vstack([hess[s+'u'].data for s in 'xyz'])
+        uyf = np.vstack([hess[s+'uyf'].data for s in 'xyz'])
+        ud = np.vstack([hess[s+'ud'].data for s in 'xyz'])
+        # Angle of the rotation around the facet normal that turns uyf (the local z axis) into ud.
+        return np.arctan2((facnorm * np.cross(uyf, ud, axis=0)).sum(axis=0),
+                          (uyf * ud).sum(axis=0))
+
     def calculate_elempos(self):
         '''Read position of facets from file.
 
@@ -65,14 +89,3 @@ class HETG(Parallel):
             pos4d = compose(cen[:, i], rot, zoom)
             pos4ds.append(pos4d)
         return pos4ds
-
-    def generate_elements(self):
-        '''generate elements as usual, set groove direction from table afterwards.'''
-        super(HETG, self).generate_elements()
-        ul = np.vstack([self.hess[s+'ul'].data for s in 'xyz'])
-        ud = np.vstack([self.hess[s+'ud'].data for s in 'xyz'])
-        for i in range(len(self.elements)):
-            # No need to calculate those from groove angle
-            # They are already in the input table.
-            self.elements[i].geometry['e_groove'][:3] = ul[:, i]
-            self.elements[i].geometry['e_perp_groove'][:3] = ud[:, i]
@@ -4,6 +4,7 @@ import numpy as np
 from astropy.table import Table
 
 from ... import chandra
+from ..hess import HETG
 from ....source import PointSource, FixedPointing
 #from .....optics import MarxMirror
 
@@ -58,8 +59,8 @@ def test_detector_coordsystems():
     # We want reproducible direction, so don't use mirror, but set direction by hand
     # photons = marxm(photons)
     # photons = photons[photons['probability'] > 0]
-    photons['pos'] = np.array([[100., 0, 0, 1],[100, 10, 0, 1], [100, 0, 10, 1],
-                               [100, -10, 0, 1], [100, 0, -10, 1]])
+    photons['pos'] = np.array([[100., 0, 0],[100, 10, 0], [100, 0, 10],
+                               [100, -10, 0], [100, 0, -10]])
 
     photons.meta['MISSION'] = ('AXAF', 'Mission')
     photons.meta['TELESCOP'] = ('CHANDRA', 'Telescope')
@@ -98,3 +99,20 @@ def test_ACIS_pixel_number():
     acis = chandra.ACIS(chips=[4, 5, 6, 7, 8, 9], aimpoint=chandra.AIMPOINTS['ACIS-I'])
     for i in range(5):
         assert acis.elements[i].npix == [1024, 1024]
+
+
+def test_HETG_groove_direction():
+    '''The dispersion direction of the HETG facets is taken from the HESS table.
+
+    It is part of the facet parameters, so it moves with the facets.
+    '''
+    hetg = HETG()
+    ud = np.vstack([hetg.hess[s + 'ud'].data for s in 'xyz']).T
+    dispdir = np.array([e.geometry['e_perp_groove'][:3] for e in hetg.elements])
+    assert np.allclose(dispdir, ud, atol=1e-5)
+
+    hetg.pos4d = np.dot(hetg.pos4d, np.diag([1., -1., -1., 1.]))
+    hetg.generate_elements()
+    dispdir = np.array([e.geometry['e_perp_groove'][:3] for e in hetg.elements])
+    ud[:, 1:] *= -1
+    assert np.allclose(dispdir, ud, atol=1e-5)
@@ -3,6 +3,7 @@ from astropy.table import Column
 
 from .base import FlatOpticalElement
 from ..base import GeometryError
+from ..math.pluecker import h2e
 
 
 class BaseAperture(object):
@@ -11,9 +12,8 @@ class BaseAperture(object):
     @staticmethod
     def add_colpos(photons):
         '''add columns ['pos'] to photon array'''
-        photoncoords = Column(name='pos', length=len(photons), shape=(4,))
+        photoncoords = Column(name='pos', length=len(photons), shape=(3,))
         photons.add_column(photoncoords)
-        photons['pos'][:, 3] = 1
 
     def area(self):
         '''Area of the aperture.
@@ -25,7 +25,12 @@ class BaseAperture(object):
 
 
 class FlatAperture(BaseAperture, FlatOpticalElement):
-    'Base class for geometrically flat apertures defined in python'
+    '''Base class for geometrically flat apertures defined in python
+
+    Set ``quasi_random=True`` to distribute the photons over the aperture with
+    quasi-random numbers (see
+    `~marxs.base.SimulationSequenceElement.quasi_random`).
+    '''
     def generate_local_xy(self, n):
         '''Generate x, y in the local coordinate system
 
@@ -45,13 +50,15 @@ class FlatAperture(BaseAperture, FlatOpticalElement):
         self.add_output_cols(photons, self.loc_coos_name)
         # Add ID number to ID col, if requested
         if self.id_col is not None:
-            photons[self.id_col] = self.id_num
+            photons[self.id_col][:] = self.id_num
         # Set position in different coordinate systems
+        # Write into the existing columns to keep their data type.
         x, y = self.generate_local_xy(len(photons))
         if self.loc_coos_name is not None:
-            photons[self.loc_coos_name[0]] = x
-            photons[self.loc_coos_name[1]] = y
-        photons['pos'] = self.geometry['center'] + x.reshape((-1, 1)) * self.geometry['v_y'] + y.reshape((-1, 1)) * self.geometry['v_z']
+            photons[self.loc_coos_name[0]][:] = x
+            photons[self.loc_coos_name[1]][:] = y
+        photons['pos'] = (h2e(self.geometry['center']) + x.reshape((-1, 1)) * h2e(self.geometry['v_y']) +
+                          y.reshape((-1, 1)) * h2e(self.geometry['v_z']))
 
         return photons
 
@@ -61,9 +68,8 @@ class RectangleAperture(FlatAperture):
 
     '''
     def generate_local_xy(self, n):
-        x = np.random.random(n) * 2. - 1.
-        y = np.random.random(n) * 2. - 1.
-        return x, y
+        x, y = self.draw_uniform(n, 2, 'xy')
+        return x * 2. - 1., y * 2. - 1.
 
     @property
     def area(self):
@@ -81,8 +87,9 @@ class CircleAperture(FlatAperture):
 
     '''
     def generate_local_xy(self, n):
-        phi = np.random.random(n) * 2. * np.pi
-        r = np.sqrt(np.random.random(n))
+        u_phi, u_r = self.draw_uniform(n, 2, 'xy')
+        phi = u_phi * 2. * np.pi
+        r = np.sqrt(u_r)
         if not np.isclose(np.linalg.norm(self.geometry['v_y']),
                         np.linalg.norm(self.geometry['v_z'])):
             raise GeometryError('Aperture does not have same size in y, z direction.')
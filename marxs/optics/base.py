@@ -5,7 +5,37 @@ import numpy as np
 from astropy.table import Table, Row
 
 from ..math.pluecker import *
+from ..math.utils import apply_affine
+from ..math import kernels
 from ..base import SimulationSequenceElement, _parse_position_keywords
+from ..photons import to_euclidean
+
+class _LazyGeometry(dict):
+    '''Dictionary of geometric properties that are derived from ``pos4d`` on demand.
+
+    Reading from the dictionary first calls ``_update_geometry`` on the element,
+    which recalculates all entries if ``pos4d`` has been set since the last time.
+    '''
+    def __init__(self, element, *args, **kwargs):
+        super(_LazyGeometry, self).__init__(*args, **kwargs)
+        self._element = element
+
+
+def _updating(name):
+    method = getattr(dict, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._element._update_geometry()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ['__getitem__', '__contains__', '__iter__', '__len__', '__repr__', '__eq__',
+              '__ne__', 'get', 'keys', 'values', 'items', 'copy',
+              'iteritems', 'iterkeys', 'itervalues', 'has_key']:
+    if hasattr(dict, _name):
+        setattr(_LazyGeometry, _name, _updating(_name))
+
 
 class OpticalElement(SimulationSequenceElement):
     '''Base class for all optical elements in marxs.
@@ -20,13 +50,28 @@ class OpticalElement(SimulationSequenceElement):
     If no vectorized implementation is available, it is sufficient to overwrite `process_photon`.
     Marxs will call `process_photons`, which (if not overwritten) contains a simple for-loop to
     loop over all photons in the array and call `process_photon` on each of them.
+    The photons are processed in blocks of `process_block_size`; the blocks can be
+    distributed over several threads or processes by setting `pool`.
+    '''
+
+    process_block_size = 10000
+    '''Number of photons in one block for the `process_photon` loop in `process_photons`.'''
+
+    pool = None
+    '''Pool of workers to process blocks of photons with `process_photon`.
+
+    This can be any object with a ``map`` method, e.g. a `multiprocessing.Pool` or
+    a `multiprocessing.pool.ThreadPool`. If ``None``, all blocks are processed in
+    the current thread. For a process pool, the optical element must be picklable.
+    This has no effect for elements that implement a vectorized `process_photons`.
     '''
 
     geometry = {}
     '''A dictionary of geometric properties.
 
     Any entry in this dictionary that contains a 4-d array will be automatically transformed
-    with the `pos4d` matrix when the object is initialized.
+    with the `pos4d` matrix when the object is initialized. When `pos4d` is set later, all
+    entries are recalculated the next time the dictionary is read.
 
     For example, we might set ``geometry['center_of_mirror']=np.array([0, 0, 0, 1])``. When the user
     initializes an object of this type with the keyword ``position=[2,0,0]`` then the center
@@ -34,16 +79,28 @@ class OpticalElement(SimulationSequenceElement):
     '''
 
     def __init__(self, **kwargs):
+        # Before we change any numbers, we need to copy geometry from the class
+        # attribute to an instance attribute. The untransformed geometry is kept
+        # to move the element later.
+        self._local_geometry = copy(self.geometry)
+        self.geometry = _LazyGeometry(self, self.geometry)
         self.pos4d = _parse_position_keywords(kwargs)
 
-        # Before we change any numbers, we need to copy geometry from the class
-        # attribute to an instance attribute
-        self.geometry = copy(self.geometry)
+        super(OpticalElement, self).__init__(**kwargs)
 
-        for elem, val in self.geometry.iteritems():
+    def __copy__(self):
+        # A shallow copy needs its own geometry, so that the copy can be moved
+        # without moving the original.
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        new.geometry = _LazyGeometry(new, dict.items(self.geometry))
+        return new
+
+    def _geometry_from_pos4d(self):
+        '''Transform the 4-d entries of `geometry` with `pos4d`.'''
+        for elem, val in self._local_geometry.iteritems():
             if isinstance(val, np.ndarray) and (val.shape[-1] == 4):
                 self.geometry[elem] = np.dot(self.pos4d, val)
-        super(OpticalElement, self).__init__(**kwargs)
 
     def process_photon(self, dir, pos, energy, polarization):
         '''Simulate interaction of optical element with a single photon.
@@ -53,10 +110,10 @@ class OpticalElement(SimulationSequenceElement):
         Parameters
         ----------
         dir : `numpy.ndarray`
-            4-d direction vector of ray in homogeneous coordinates
+            3-d direction vector of ray in Euclidean coordinates
         pos : `numpy.ndarray`
-            4-d position of last interaction pf the photons with any optical element in
-            homogeneous coordinates. Together with ``dir`` this determines the equation
+            3-d position of last interaction pf the photons with any optical element in
+            Euclidean coordinates. Together with ``dir`` this determines the equation
             of the ray.
         energy : float
             Photon energy in keV.
@@ -66,10 +123,10 @@ class OpticalElement(SimulationSequenceElement):
         Returns
         -------
         dir : `numpy.ndarray`
-            4-d direction vector of ray in homogeneous coordinates
+            3-d direction vector of ray in Euclidean coordinates
         pos : `numpy.ndarray`
-            4-d position of last interaction pf the photons with any optical element in
-            homogeneous coordinates. Together with ``dir`` this determines the equation
+            3-d position of last interaction pf the photons with any optical element in
+            Euclidean coordinates. Together with ``dir`` this determines the equation
             of the ray.
         energy : float
             Photon energy in keV.
@@ -106,19 +163,48 @@ class OpticalElement(SimulationSequenceElement):
         '''
         if isinstance(photons, Row):
             photons = Table(photons)
+        photons = to_euclidean(photons)
+        self.add_output_cols(photons)
         outcols = ['dir', 'pos', 'energy', 'polarization', 'probability'] + self.output_columns
-        for i, photon in enumerate(photons):
-            outs = self.process_photon(photon['dir'], photon['pos'],
-                                       photon['energy'],
-                                       photon['polarization'])
+        incols = [photons[c].data for c in ['dir', 'pos', 'energy', 'polarization']]
+        starts = range(0, len(photons), self.process_block_size)
+        blocks = [[self] + [c[i: i + self.process_block_size] for c in incols]
+                  for i in starts]
+        if self.pool is None:
+            results = map(_process_photon_block, blocks)
+        else:
+            results = self.pool.map(_process_photon_block, blocks)
+        for i, outs in zip(starts, results):
+            ind = slice(i, i + self.process_block_size)
             for a, b in zip(outcols, outs):
                 if a == 'probability':
-                    photons['probability'][i] *= b
+                    photons['probability'][ind] *= b
                 else:
-                    photons[a][i] = b
+                    photons[a][ind] = b
         return photons
 
 
+def _process_photon_block(args):
+    '''Call ``process_photon`` for every photon in a block.
+
+    This is a module level function, so that it can be send to the workers of a
+    process pool.
+
+    Parameters
+    ----------
+    args : list
+        Optical element and the arrays for dir, pos, energy and polarization.
+
+    Returns
+    -------
+    outs : list of `numpy.ndarray`
+        One array for each return value of ``process_photon``.
+    '''
+    elem, dir, pos, energy, polarization = args
+    outs = [elem.process_photon(dir[i], pos[i], energy[i], polarization[i])
+            for i in range(len(energy))]
+    return [np.array(o) for o in zip(*outs)]
+
 
 class FlatOpticalElement(OpticalElement):
     '''Base class for geometrically flat optical elements.
@@ -131,7 +217,10 @@ class FlatOpticalElement(OpticalElement):
     they can implement a function called
     ``specific_process_photons(self, photons, intersect, interpos, intercoos)`` that returns a dictionary
     of the form ``{'column name': value, ...}`` where value is an array that holds one value for
-    each photon that intersects the optical element. In the special case of ``probability`` the
+    each photon that intersects the optical element. ``intersect`` is an integer array with the
+    indices of those photons, such that e.g. ``photons['energy'].data[intersect]`` and
+    ``interpos[intersect]`` select the values for the intersecting photons in the same
+    order as the returned values. In the special case of ``probability`` the
     return value should only contain the probability assigned in **this** element. This value
     will be multiplied with the previous probabilities of each photon automatically.
     '''
@@ -179,53 +268,103 @@ class FlatOpticalElement(OpticalElement):
     loc_coos_name = ['y', 'z']
     '''name for output columns that contain the interaction point in local coordinates.'''
 
-    def __init__(self, **kwargs):
-        super(FlatOpticalElement, self).__init__(**kwargs)
+    def _geometry_from_pos4d(self):
+        super(FlatOpticalElement, self)._geometry_from_pos4d()
+        # This is called for every element when a `marxs.simulator.Parallel` is
+        # regenerated, so avoid the overhead of h2e and np.cross for single vectors.
+        # All v_* are directions (w=0).
         for c in 'xyz':
-            self.geometry['e_' + c] = self.geometry['v_' + c] / np.linalg.norm(self.geometry['v_' + c])
-        normal = e2h(np.cross(h2e(self.geometry['e_y']), h2e(self.geometry['e_z'])), 0)
+            v = self.geometry['v_' + c]
+            self.geometry['e_' + c] = v / np.sqrt(np.dot(v, v))
+        ey = self.geometry['e_y']
+        ez = self.geometry['e_z']
+        normal = np.array([ey[1] * ez[2] - ey[2] * ez[1],
+                           ey[2] * ez[0] - ey[0] * ez[2],
+                           ey[0] * ez[1] - ey[1] * ez[0],
+                           0.])
         self.geometry['plane'] = point_dir2plane(self.geometry['center'],
                                                  normal)
-
-    def intersect(self, dir, pos):
+        # Matrix for `intersect`: Multiplying a Euclidean position with the first three
+        # rows of this matrix and adding the last row gives the distance from the
+        # center along the normal, e_y and e_z.
+        # For directions, the first three rows give the projection on the normal, e_y and e_z.
+        center = self.geometry['center'][:3] / self.geometry['center'][3]
+        self._intersect_proj = np.empty((4, 3))
+        self._intersect_proj[:3, :] = np.vstack([normal[:3], ey[:3], ez[:3]]).T
+        self._intersect_proj[3, :] = - np.dot(center, self._intersect_proj[:3, :])
+        self._intersect_size = np.array([np.linalg.norm(self.geometry['v_y']),
+                                         np.linalg.norm(self.geometry['v_z'])])
+
+    def intersect(self, dir, pos, out_interpos=None, out_intercoos=None):
         '''Calculate the intersection point between a ray and the element
 
         Parameters
         ----------
-        dir : `numpy.ndarray` of shape (N, 4)
-            homogeneous coordinates of the direction of the ray
-        pos : `numpy.ndarray` of shape (N, 4)
-            homogeneous coordinates of a point on the ray
+        dir : `numpy.ndarray` of shape (N, 3)
+            Euclidean coordinates of the direction of the ray
+        pos : `numpy.ndarray` of shape (N, 3)
+            Euclidean coordinates of a point on the ray
+        out_interpos : `numpy.ndarray` of shape (N, 3) or ``None``
+            If given, the intersection points are written into this array
+            instead of a newly allocated array.
+        out_intercoos : `numpy.ndarray` of shape (N, 2) or ``None``
+            If given, the local coordinates are written into this array
+            instead of a newly allocated array.
 
         Returns
         -------
         intersect :  boolean array of length N
             ``True`` if an intersection point is found.
-        interpos : `numpy.ndarray` of shape (N, 4)
-            homogeneous coordinates of the intersection point. Values are set
-            to ``np.nan`` is no intersecton point is found.
+        interpos : `numpy.ndarray` of shape (N, 3)
+            Euclidean coordinates of the intersection point.
+            Values are set to ``np.nan`` is no intersecton point is found.
         interpos_local : `numpy.ndarray` of shape (N, 2)
             y and z coordinates in the coordiante system of the active plane.
         '''
-        plucker = dir_point2line(h2e(dir), h2e(pos))
-        interpos =  intersect_line_plane(plucker, self.geometry['plane'])
-        vec_center_inter = - h2e(self.geometry['center']) + h2e(interpos)
-        ey = np.dot(vec_center_inter, h2e(self.geometry['e_y']))
-        ez = np.dot(vec_center_inter, h2e(self.geometry['e_z']))
-        intersect = ((np.abs(ey) <= np.linalg.norm(self.geometry['v_y'])) &
-                     (np.abs(ez) <= np.linalg.norm(self.geometry['v_z'])))
-        if dir.ndim == 2:
-            interpos[~intersect, :3] = np.nan
-        # input of single photon.
-        elif (dir.ndim == 1) and not intersect:
-            interpos[:3] = np.nan
-        return intersect, interpos, np.vstack([ey, ez]).T
+        dir = np.asarray(dir)
+        pos = np.asarray(pos)
+        single = dir.ndim == 1
+        if single:
+            dir = dir[np.newaxis, :]
+            pos = pos[np.newaxis, :]
+        n = dir.shape[0]
+        interpos = np.empty((n, 3)) if out_interpos is None else out_interpos
+        intercoos = np.empty((n, 2)) if out_intercoos is None else out_intercoos
+        self._update_geometry()
+        if kernels.use_numba:
+            intersect = np.empty(n, dtype=bool)
+            # The kernels are compiled for double precision input, see marxs.precision
+            kernels.flat_intersect(np.asarray(dir, dtype=np.float64),
+                                   np.asarray(pos, dtype=np.float64),
+                                   self._intersect_proj, self._intersect_size,
+                                   interpos, intercoos, intersect)
+            if single:
+                return intersect[0], interpos[0], intercoos[0]
+            return intersect, interpos, intercoos
+
+        p_dir = np.dot(dir, self._intersect_proj[:3])
+        p_pos = np.dot(pos, self._intersect_proj[:3])
+        p_pos += self._intersect_proj[3]
+        # Distance along the ray from pos to the plane of the element
+        t = p_pos[:, 0]
+        t /= p_dir[:, 0]
+        t *= -1
+        np.multiply(p_dir[:, 1:], t[:, np.newaxis], out=intercoos)
+        intercoos += p_pos[:, 1:]
+        np.multiply(dir, t[:, np.newaxis], out=interpos)
+        interpos += pos
+        intersect = ((np.abs(intercoos[:, 0]) <= self._intersect_size[0]) &
+                     (np.abs(intercoos[:, 1]) <= self._intersect_size[1]))
+        interpos[~intersect] = np.nan
+        if single:
+            return intersect[0], interpos[0], intercoos[0]
+        return intersect, interpos, intercoos
 
     def process_photons(self, photons, intersect=None, interpos=None, intercoos=None):
         '''
         Parameters
         ----------
-        intersect, interpos, intercoos : array (N, 4)
+        intersect, interpos, intercoos : array (N, 3)
             These parameters are here for performance reasons. In many cases, the
             intersection point between the grating and the rays has been calculated
             by the calling routine to decide which photon is processed by which
@@ -234,25 +373,36 @@ class FlatOpticalElement(OpticalElement):
             coordinate system, ``intercoos`` in the local (y,z) system of the grating.
             If not all three of ``intersect``, ``interpos`` and ``intercoos`` are passed in, they are
             calculated here. No checks are done on passed-in values.
+            ``intersect`` can be a boolean mask or an array of indices of the intersecting
+            photons. Only the rows of ``interpos`` and ``intercoos`` that are listed in
+            ``intersect`` are used.
         '''
         if hasattr(self, 'specific_process_photons'):
+            self._update_geometry()
             if (interpos is None) or (intercoos is None) or (intersect is None):
+                # Photon lists with homogeneous pos and dir columns (N, 4) are converted here,
+                # because this method is also called directly, not only through ``__call__``.
+                # Callers that pass in the intersection points have Euclidean columns already.
+                photons = to_euclidean(photons)
                 intersect, interpos, intercoos = self.intersect(photons['dir'].data, photons['pos'].data)
-            if intersect.sum() > 0:
+            intersect = _as_index(intersect)
+            if len(intersect) > 0:
                 outcols = self.specific_process_photons(photons, intersect, interpos, intercoos)
                 self.add_output_cols(photons, self.loc_coos_name + outcols.keys())
                 # Add ID number to ID col, if requested
+                # Results are scattered into the columns with the index array,
+                # so the cost scales with the number of intersecting photons.
                 if self.id_col is not None:
-                    photons[self.id_col][intersect] = self.id_num
+                    photons[self.id_col].data[intersect] = self.id_num
                 # Set position in different coordinate systems
-                photons['pos'][intersect] = interpos[intersect]
-                photons[self.loc_coos_name[0]][intersect] = intercoos[intersect, 0]
-                photons[self.loc_coos_name[1]][intersect] = intercoos[intersect, 1]
+                photons['pos'].data[intersect] = interpos[intersect]
+                photons[self.loc_coos_name[0]].data[intersect] = intercoos[intersect, 0]
+                photons[self.loc_coos_name[1]].data[intersect] = intercoos[intersect, 1]
                 for col in outcols:
                     if col == 'probability':
-                        photons[col][intersect] *= outcols[col]
+                        photons[col].data[intersect] *= outcols[col]
                     else:
-                        photons[col][intersect] = outcols[col]
+                        photons[col].data[intersect] = outcols[col]
 
             return photons
         else:
@@ -297,6 +447,18 @@ class FlatStack(FlatOpticalElement):
         for elem, k in zip(sequence, keywords):
             self.sequence.append(elem(pos4d=self.pos4d, **k))
 
+    @FlatOpticalElement.pos4d.setter
+    def pos4d(self, pos4d):
+        FlatOpticalElement.pos4d.fset(self, pos4d)
+        # Layers do not exist yet when this is called in __init__.
+        for elem in getattr(self, 'sequence', []):
+            elem.pos4d = pos4d
+
+    def __copy__(self):
+        new = super(FlatStack, self).__copy__()
+        new.sequence = [copy(e) for e in self.sequence]
+        return new
+
     def specific_process_photons(self, *args, **kwargs):
         return {}
 
@@ -304,7 +466,7 @@ class FlatStack(FlatOpticalElement):
         '''
         Parameters
         ----------
-        intersect, interpos, intercoos : array (N, 4)
+        intersect, interpos, intercoos : array (N, 3)
             These parameters are here for performance reasons. In many cases, the
             intersection point between the grating and the rays has been calculated
             by the calling routine to decide which photon is processed by which
@@ -313,10 +475,14 @@ class FlatStack(FlatOpticalElement):
             coordinate system, ``intercoos`` in the local (y,z) system of the grating.
             If not all three of ``intersect``, ``interpos`` and ``intercoos`` are passed in, they are
             calculated here. No checks are done on passed-in values.
+            ``intersect`` can be a boolean mask or an array of indices of the intersecting
+            photons. Only the rows of ``interpos`` and ``intercoos`` that are listed in
+            ``intersect`` are used.
         '''
         if (interpos is None) or (intercoos is None) or (intersect is None):
             intersect, interpos, intercoos = self.intersect(photons['dir'].data, photons['pos'].data)
-        if intersect.sum() > 0:
+        intersect = _as_index(intersect)
+        if len(intersect) > 0:
             # This line calls FlatOpticalElement.process_photons to add ID cols and local coos
             # is requested (this could also be done by any of the contained sequence elements,
             # but we want the user to be able to specify that for either of them).
@@ -327,6 +493,30 @@ class FlatStack(FlatOpticalElement):
         return photons
 
 
+def _as_index(intersect):
+    '''Convert a boolean mask of intersecting photons to an array of indices.'''
+    intersect = np.asanyarray(intersect)
+    if intersect.dtype == bool:
+        return np.flatnonzero(intersect)
+    return intersect
+
+
+def _transform_columns(photons, colnames, matrix):
+    '''Apply an affine 4x4 matrix to the Euclidean coordinates in photon columns.
+
+    The ``pos`` column holds positions, all other columns hold directions,
+    which are not translated.
+    Float columns are changed in place, other columns are replaced.
+    '''
+    for n in colnames:
+        data = photons[n].data
+        w = 1 if n == 'pos' else 0
+        if data.dtype.kind == 'f':
+            apply_affine(matrix, data, w, out=data)
+        else:
+            photons[n] = apply_affine(matrix, data, w)
+
+
 def photonlocalcoords(f, colnames=['pos', 'dir']):
     '''Decorator for calculation that require a local coordinate system
 
@@ -350,13 +540,10 @@ def photonlocalcoords(f, colnames=['pos', 'dir']):
     @wraps(f)
     def wrapper(self, photons, *args, **kwargs):
         # transform to coordsys if single instrument
-        invpos4d = np.linalg.inv(self.pos4d)
-        for n in colnames:
-            photons[n] = np.einsum('...ij,...j', invpos4d, photons[n])
+        _transform_columns(photons, colnames, self.pos4d_inv)
         photons = f(self, photons, *args, **kwargs)
         # transform back into coordsys of satellite
-        for n in colnames:
-            photons[n] = np.einsum('...ij,...j', self.pos4d, photons[n])
+        _transform_columns(photons, colnames, self.pos4d)
         return photons
 
     return wrapper
@@ -42,15 +42,32 @@ class FlatDetector(FlatOpticalElement):
     def __init__(self, pixsize=1, **kwargs):
         self.pixsize = pixsize
         super(FlatDetector, self).__init__(**kwargs)
+        # Check the pixel size right away and not only when the detector is used.
+        self._update_geometry()
+
+    def _geometry_from_pos4d(self):
+        super(FlatDetector, self)._geometry_from_pos4d()
         t, r, zoom, s = decompose44(self.pos4d)
-        self.npix = [0, 0]
-        self.centerpix = [0, 0]
+        self._npix = [0, 0]
+        self._centerpix = [0, 0]
         for i in (0, 1):
             z  = zoom[i + 1]
-            self.npix[i] = int(np.round(2. * z / self.pixsize))
-            if (2. * z / self.pixsize - self.npix[i]) > 1e-3:
+            self._npix[i] = int(np.round(2. * z / self.pixsize))
+            if (2. * z / self.pixsize - self._npix[i]) > 1e-3:
                 warnings.warn('Detector size is not an integer multiple of pixel size in direction {0}. It will be rounded.'.format('xy'[i]), PixelSizeWarning)
-            self.centerpix[i] = (self.npix[i] - 1) / 2
+            self._centerpix[i] = (self._npix[i] - 1) / 2
+
+    @property
+    def npix(self):
+        '''Number of pixels in x and y direction.'''
+        self._update_geometry()
+        return self._npix
+
+    @property
+    def centerpix(self):
+        '''Pixel coordinates of the center of the detector.'''
+        self._update_geometry()
+        return self._centerpix
 
     def specific_process_photons(self, photons, intersect, interpos, intercoos):
         detx = intercoos[intersect, 0] / self.pixsize + self.centerpix[0]
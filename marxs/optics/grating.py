@@ -5,6 +5,8 @@ from transforms3d import axangles
 
 from ..math.pluecker import *
 from ..math.utils import norm_vector
+from ..math.random import check_random_state
+from ..math import kernels
 from .. import energy2wave
 from .base import FlatOpticalElement
 
@@ -25,11 +27,13 @@ def uniform_efficiency_factory(max_order = 3):
     uniform efficiency : callable
         A callable that always returns ``order`` for every photon input.
     '''
-    def uniform_efficiency(energy, *args):
+    def uniform_efficiency(energy, *args, **kwargs):
+        random_state = check_random_state(kwargs.pop('random_state', None))
         if np.isscalar(energy):
-            return np.random.randint(-max_order, max_order + 1), 1.
+            return random_state.randint(-max_order, max_order + 1), 1.
         else:
-            return np.random.randint(-max_order, max_order + 1, len(energy)), np.ones_like(energy)
+            return random_state.randint(-max_order, max_order + 1, len(energy)), np.ones_like(energy)
+    uniform_efficiency.accepts_random_state = True
     return uniform_efficiency
 
 
@@ -86,16 +90,23 @@ class EfficiencyFile(object):
         # Cumulative probability for orders, normalized to 1.
         self.cumprob = np.cumsum(self.prob, axis=1) / self.totalprob[:, None]
 
-    def __call__(self, energies, *args):
+    accepts_random_state = True
+
+    def __call__(self, energies, *args, **kwargs):
+        random_state = check_random_state(kwargs.pop('random_state', None))
         orderind = np.empty(len(energies), dtype=int)
         ind = np.empty(len(energies), dtype=int)
         for i, e in enumerate(energies):
             ind[i] = np.argmin(np.abs(self.energy - e))
-            orderind[i] = np.min(np.nonzero(self.cumprob[ind[i]] > np.random.rand()))
+            orderind[i] = np.min(np.nonzero(self.cumprob[ind[i]] > random_state.rand()))
         return self.orders[orderind], self.totalprob[ind]
 
 
 
+NO_ORDER = np.iinfo(np.int8).min
+'''Value in the ``order`` column for photons that did not pass through a grating.'''
+
+
 class FlatGrating(FlatOpticalElement):
     '''Flat grating
 
@@ -110,6 +121,9 @@ class FlatGrating(FlatOpticalElement):
         A function or callable object that accepts photon energy, polarization and the blaze angle
         as input and returns a grating order (integer)
         and a probability (float).
+        If the callable has an attribute ``accepts_random_state = True`` (e.g.
+        `uniform_efficiency_factory` and `EfficiencyFile`), the random number
+        generator of the grating is passed to it as keyword ``random_state``.
     transmission : bool
         Set to ``True`` for a transmission grating and to ``False`` for a
         reflection grating. (*Default*: ``True`` )
@@ -117,6 +131,9 @@ class FlatGrating(FlatOpticalElement):
         Angle between the direction of the grooves and the local y axis in radian.
         (*Default*: ``0.``)
 
+    The diffraction order is stored as a small integer in the column ``order``;
+    photons that do not pass through a grating have ``order = NO_ORDER``.
+
     .. warning::
        Reflection gratings are untested so far!
     '''
@@ -124,6 +141,8 @@ class FlatGrating(FlatOpticalElement):
     loc_coos_name = ['grat_y', 'grat_z']
     '''name for output columns that contain the interaction point in local coordinates.'''
 
+    output_column_types = {'order': (np.int8, NO_ORDER)}
+
     def order_sign_convention(self, p):
         '''Set sign convention for grating orders.
 
@@ -156,19 +175,39 @@ class FlatGrating(FlatOpticalElement):
 
         super(FlatGrating, self).__init__(**kwargs)
 
+    def _geometry_from_pos4d(self):
+        super(FlatGrating, self)._geometry_from_pos4d()
         self.groove4d = axangles.axangle2aff(self.geometry['e_x'][:3], self.groove_ang)
         self.geometry['e_groove'] = np.dot(self.groove4d, self.geometry['e_y'])
         self.geometry['e_perp_groove'] = np.dot(self.groove4d, self.geometry['e_z'])
 
     def diffract_photons(self, photons, intersect):
         '''Vectorized implementation'''
-        p = norm_vector(h2e(photons['dir'].data[intersect]))
+        p = norm_vector(photons['dir'].data[intersect])
         n = self.geometry['plane'][:3]
         l = h2e(self.geometry['e_groove'])
         d = h2e(self.geometry['e_perp_groove'])
 
         wave = energy2wave / photons['energy'].data[intersect]
-        m, prob = self.order_selector(photons['energy'].data[intersect], photons['polarization'].data[intersect])
+        if getattr(self.order_selector, 'accepts_random_state', False):
+            m, prob = self.order_selector(photons['energy'].data[intersect],
+                                          photons['polarization'].data[intersect],
+                                          random_state=self.random_state)
+        else:
+            m, prob = self.order_selector(photons['energy'].data[intersect],
+                                          photons['polarization'].data[intersect])
+        sign = self.order_sign_convention(p)
+        # Combine the components with the basis vectors in one matrix product.
+        basis = np.vstack([d, l, n])
+        if kernels.use_numba:
+            # The kernels are compiled for double precision input, see marxs.precision
+            dir, blazeangle = kernels.diffract(np.asarray(p, dtype=np.float64), l, d, n, basis,
+                                               np.asarray(m, dtype=np.float64),
+                                               np.asarray(wave, dtype=np.float64),
+                                               np.ones(len(p)) * sign, float(self.d),
+                                               self.transmission)
+            return dir, m, prob, blazeangle
+
         # calculate angle between normal and (ray projected in plane perpendicular to groove)
         # -> this is the blaze angle
         p_perp_to_grooves = norm_vector(p - np.dot(p, l)[:, np.newaxis] * l)
@@ -178,7 +217,6 @@ class FlatGrating(FlatOpticalElement):
 
         # The idea to calculate the components in the (d,l,n) system separately
         # is taken from MARX
-        sign = self.order_sign_convention(p)
         p_d = np.dot(p, d) + sign * m * wave / self.d
         p_l = np.dot(p, l)
         # The norm for p_n can be derived, but the direction needs to be chosen.
@@ -187,7 +225,7 @@ class FlatGrating(FlatOpticalElement):
         direction = np.sign(np.dot(p, n), dtype=np.float)
         if not self.transmission:
             direction *= -1
-        dir = e2h(p_d[:, None] * d[None, :] + p_l[:, None] * l[None, :] + (direction * p_n)[:, None] * n[None, :], 0)
+        dir = np.dot(np.column_stack([p_d, p_l, direction * p_n]), basis)
         return dir, m, prob, blazeangle
 
     def specific_process_photons(self, photons, intersect, interpos, intercoos):
@@ -12,7 +12,7 @@ import os
 import numpy as np
 from astropy.table import Table, Column, join
 
-from ..math.pluecker import h2e, e2h
+from ..photons import PhotonBatch
 from .base import OpticalElement, photonlocalcoords
 from .aperture import BaseAperture
 
@@ -94,11 +94,11 @@ class MarxMirror(OpticalElement, BaseAperture):
         keep_cffi_pointers['cp'] = cp
         for i in range(n):
             cp[i].energy = photons['energy'][i]
-            pos = h2e(photons['pos'][i])
+            pos = photons['pos'][i]
             cp[i].x.x = pos[0]
             cp[i].x.y = pos[1]
             cp[i].x.z = pos[2]
-            dir = h2e(photons['dir'][i])
+            dir = photons['dir'][i]
             cp[i].p.x = dir[0]
             cp[i].p.y = dir[1]
             cp[i].p.z = dir[2]
@@ -152,7 +152,7 @@ class MarxMirror(OpticalElement, BaseAperture):
         dir = np.empty((n_valid, 3))
         unreflected = np.empty(n_valid, dtype=bool)
         vblocked = np.empty(n_valid, dtype=bool)
-        shell = np.empty(n_valid, dtype=int)
+        shell = np.empty(n_valid, dtype=np.int8)
 
         for i in range(n_valid):
             energy[i] = cp[i].energy
@@ -168,8 +168,6 @@ class MarxMirror(OpticalElement, BaseAperture):
             vblocked[i] = cp[i].flags & marx.PHOTON_MIRROR_VBLOCKED
             shell[i] = cp[i].mirror_shell
 
-        pos = e2h(pos, 1)
-        dir = e2h(dir, 0)
         photons = Table([pos, dir, energy, time, tag,
                          unreflected, vblocked, shell],
                         names=['pos', 'dir', 'energy', 'time', 'tag',
@@ -186,6 +184,9 @@ class MarxMirror(OpticalElement, BaseAperture):
         return self._c2table(c_photon_list)
 
     def process_photons(self, photons, verbose=0):
+        if isinstance(photons, PhotonBatch):
+            # The C interface and the join below work on tables.
+            return PhotonBatch.from_table(self.process_photons(photons.to_table(), verbose))
         self.add_colpos(photons)
         new_photons = self._process_photons_in_c(photons, verbose)
         photons = join(new_photons, photons, keys='tag',
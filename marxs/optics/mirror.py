@@ -1,10 +1,9 @@
 import numpy as np
 
-from transforms3d.axangles import axangle2mat
-
 from .base import FlatOpticalElement
 from ..math.pluecker import *
 from ..math.utils import norm_vector
+from ..math.rotations import axangle2mat
 
 class PerfectLens(FlatOpticalElement):
     '''This describes an infinitely large lens that focusses all rays exactly.
@@ -23,8 +22,8 @@ class PerfectLens(FlatOpticalElement):
     def process_photons(self, photons):
         # A ray through the center is not broken.
         # So, find out where a central ray would go.
-        focuspoints = h2e(self.geometry['center']) + self.focallength * norm_vector(h2e(photons['dir']))
-        photons['dir'] = e2h(focuspoints - h2e(photons['pos']), 0)
+        focuspoints = h2e(self.geometry['center']) + self.focallength * norm_vector(photons['dir'].data)
+        photons['dir'] = focuspoints - photons['pos'].data
         return photons
 
 class ThinLens(FlatOpticalElement):
@@ -64,20 +63,40 @@ class ThinLens(FlatOpticalElement):
         self.focallength = kwargs.pop('focallength')
         super(ThinLens, self).__init__(**kwargs)
 
+    def focus(self, dir, interpos):
+        '''Calculate the direction of rays after they pass through the lens.
+
+        Rays through the center of the lens are not deflected, all other rays are
+        rotated towards the center by an angle proportional to the distance from the
+        center.
+
+        Parameters
+        ----------
+        dir : `numpy.ndarray` of shape (N, 3)
+            Euclidean coordinates of the direction of the incoming rays.
+        interpos : `numpy.ndarray` of shape (N, 3)
+            Euclidean coordinates of the points where the rays pass the lens.
+
+        Returns
+        -------
+        new_dir : `numpy.ndarray` of shape (N, 3)
+            Euclidean coordinates of the direction of the outgoing rays.
+        '''
+        radial = interpos - h2e(self.geometry['center'])
+        distance = np.sqrt((radial * radial).sum(axis=1))
+        new_dir = np.array(dir, dtype=np.float64)
+        # No change of direction for rays through the center.
+        # Need to special case this, because the rotation axis is not defined
+        # in this case.
+        ind = distance > 0.
+        rot = axangle2mat(np.cross(radial[ind], new_dir[ind]), distance[ind] / self.focallength)
+        new_dir[ind] = np.einsum('...ij,...j->...i', rot, new_dir[ind])
+        return new_dir
+
     def process_photon(self, dir, pos, energy, polerization):
         intersect, h_intersect, loc_inter = self.intersect(dir, pos)
-        distance = distance_point_point(h_intersect,
-                                        self.geometry['center'][np.newaxis, :])
-        if distance == 0.:
-            # No change of direction for rays through the origin.
-            # Need to special case this, because rotation axis is not defined
-            # in this case.
-            new_ray_dir = h2e(dir)
-        else:
-            delta_angle = distance / self.focallength
-            e_rotation_axis = np.cross(dir[:3], (h_intersect - self.geometry['center'])[:3])
-            # This is the first step that cannot be done on a stack of photons
-            # Could have a for "i in photons", but might come up with better way
-            rot = axangle2mat(e_rotation_axis, delta_angle)
-            new_ray_dir = np.dot(rot, dir[:3])
-        return e2h(new_ray_dir, 0), h_intersect, energy, polerization, 1.
+        new_ray_dir = self.focus(dir[np.newaxis, :], h_intersect[np.newaxis, :])
+        return new_ray_dir[0], h_intersect, energy, polerization, 1.
+
+    def specific_process_photons(self, photons, intersect, interpos, intercoos):
+        return {'dir': self.focus(photons['dir'].data[intersect], interpos[intersect])}
@@ -3,6 +3,7 @@ from astropy.io import ascii
 
 from .base import FlatOpticalElement
 from ..math.pluecker import *
+from ..math.utils import apply_affine
 
 
 class MultiLayerMirror(FlatOpticalElement):
@@ -54,17 +55,13 @@ class MultiLayerMirror(FlatOpticalElement):
         photons['probability'] *= doesIntersect
         
         # save the direction of the incoming photons as beam_dir
-        beam_dir = (photons['dir'][:,0:3]).copy()
+        beam_dir = (photons['dir'].data).copy()
     	beam_dir /= np.linalg.norm(beam_dir, axis=1)[:, np.newaxis]
         
         # reflect the photons (change direction) by transforming to local coordinates
-        directions = photons['dir']
-        pos4d_inv = np.linalg.inv(self.pos4d)
-        directions = directions.T
-        directions = np.dot(pos4d_inv, directions)
-        directions[0,:] *= -1
-        directions = np.dot(self.pos4d, directions)
-        photons['dir'] = directions.T
+        directions = apply_affine(self.pos4d_inv, photons['dir'].data, 0)
+        directions[:,0] *= -1
+        photons['dir'] = apply_affine(self.pos4d, directions, 0)
         
         # split polarization into s and p components
         # v_1 is s polarization (perpendicular to plane of incidence), v_2 is p polarization (in the plane of incidence)
@@ -72,17 +69,17 @@ class MultiLayerMirror(FlatOpticalElement):
         v_1 /= np.linalg.norm(v_1, axis=1)[:, np.newaxis]
         v_2 = np.cross(beam_dir, v_1)
         # find polarization component in each direction, v1 and v2
-        polarization = (photons['polarization'][:,0:3]).copy()
+        polarization = (photons['polarization'].data).copy()
         # find the dot product of v1 and v2 for each photon with each photon's polarization vector
         p_v_1 = np.einsum('ij,ij->i', polarization, v_1)   # the cosines between the pairs of vectors (these are unit vectors)
         p_v_2 = np.einsum('ij,ij->i', polarization, v_2)
         
         # adjust polarization vectors after reflection
         # find new v_2
-        new_beam_dir = (photons['dir'][:,0:3]).copy()
+        new_beam_dir = (photons['dir'].data).copy()
         new_beam_dir /= np.linalg.norm(new_beam_dir, axis=1)[:, np.newaxis]
         new_v_2 = np.cross(new_beam_dir, v_1)
-        photons['polarization'][:,0:3] = -p_v_1[:, np.newaxis] * v_1 + p_v_2[:, np.newaxis] * new_v_2
+        photons['polarization'][:] = -p_v_1[:, np.newaxis] * v_1 + p_v_2[:, np.newaxis] * new_v_2
         
         # set position to intersection point
         photons['pos'] = intersection
@@ -96,7 +93,7 @@ class MultiLayerMirror(FlatOpticalElement):
 
         # find probability of being reflected due to position
         # put the photon positions and the position values from the reflection file into local coordinates
-        local_intersection = h2e((np.dot(pos4d_inv, intersection.T)).T)
+        local_intersection = apply_affine(self.pos4d_inv, intersection, 1)
         local_coords_in_file = reflectFile['X(mm)'] / np.linalg.norm(self.geometry['v_y']) - 1
         # interpolate 'Peak lambda', 'Peak' [reflectivity], and 'FWHM(nm)' to the actual photon positions
         peak_wavelength = np.interp(local_intersection[:,1], local_coords_in_file, reflectFile['Peak lambda'])
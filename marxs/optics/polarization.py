@@ -1,6 +1,7 @@
 import numpy as np
 
 from ..math.pluecker import *
+from ..math import kernels
 
 
 def polarization_vectors(dir_array, angles):
@@ -12,13 +13,23 @@ def polarization_vectors(dir_array, angles):
 	
 	Parameters
     ----------
-    dir_array : nx4 np.array
-        each row is the homogeneous coordinates for a photon's direction vector
+    dir_array : nx3 np.array
+        each row is the Euclidean coordinates for a photon's direction vector
+        (homogeneous coordinates with 4 columns are also accepted)
     angles : np.array
     	1D array with the polarization angles
+
+    Returns
+    -------
+    polarization : nx3 np.array
+        Euclidean polarization vectors (stored like ``pos`` and ``dir``)
 	'''
+	if kernels.use_numba:
+		dir_array = np.asarray(dir_array, dtype=np.float64)
+		angles = np.asarray(angles, dtype=np.float64)
+		return kernels.polarization_vectors(dir_array, angles)
 	n = len(angles)
-	polarization = np.zeros((n, 4))
+	polarization = np.zeros((n, 3))
 	x = np.array([1., 0., 0.])
 	y = np.array([0., 1., 0.])
 	
@@ -37,8 +48,7 @@ def polarization_vectors(dir_array, angles):
 #			
 #		# right hand coordinate system is v_1, v_2, r (photon direction)
 #		v_2 = np.cross(r, v_1)
-#		polarization[i, 0:3] = v_1 * np.cos(angles[i]) + v_2 * np.sin(angles[i])
-#		polarization[i, 3] = 0
+#		polarization[i] = v_1 * np.cos(angles[i]) + v_2 * np.sin(angles[i])
 	
 	r = dir_array.copy()[:,0:3]
 	r /= np.linalg.norm(r, axis=1)[:, np.newaxis]
@@ -50,7 +60,7 @@ def polarization_vectors(dir_array, angles):
 
 	# right hand coordinate system is v_1, v_2, r (photon direction)
 	v_2 = np.cross(r, v_1)
-	polarization[:, 0:3] = v_1 * np.cos(angles)[:, np.newaxis] + v_2 * np.sin(angles)[:, np.newaxis]
+	polarization[:] = v_1 * np.cos(angles)[:, np.newaxis] + v_2 * np.sin(angles)[:, np.newaxis]
 	
 	return polarization
 	
@@ -11,7 +11,6 @@ random change is added to the direction vector.
 '''
 import numpy as np
 
-from ..math.pluecker import e2h, h2e
 from ..math.rotations import axangle2mat
 from .base import OpticalElement
 
@@ -41,16 +40,17 @@ class RadialMirrorScatter(OpticalElement):
         # change this line, if you want to process only some photons (intersect et al.)
         n = len(photons)
         center = self.pos4d[:-1, -1]
-        radial = h2e(photons['pos'].data) - center
-        perpplane = np.cross(h2e(photons['dir'].data), radial)
-        inplaneangle = np.random.normal(loc=0., scale=self.inplanescatter, size=n)
+        radial = photons['pos'].data - center
+        perpplane = np.cross(photons['dir'].data, radial)
+        inplaneangle = self.random_state.normal(loc=0., scale=self.inplanescatter, size=n)
 
         rot = axangle2mat(perpplane, inplaneangle)
-        photons['dir'] = e2h(np.einsum('...ij,...i->...j', rot, h2e(photons['dir'])), 0)
+        # Write into the existing column to keep its data type.
+        photons['dir'][:] = np.einsum('...ij,...i->...j', rot, photons['dir'].data)
 
         if self.perpplanescatter !=0: # Works for 0 too, but waste of time to run
-            perpangle = np.random.normal(loc=0., scale=self.perpplanescatter, size=n)
+            perpangle = self.random_state.normal(loc=0., scale=self.perpplanescatter, size=n)
             rot = axangle2mat(radial, perpangle)
-            photons['dir'] = e2h(np.einsum('...ij,...i->...j', rot, h2e(photons['dir'])), 0)
+            photons['dir'][:] = np.einsum('...ij,...i->...j', rot, photons['dir'].data)
 
         return photons
@@ -5,11 +5,10 @@ from ..detector import FlatDetector
 from ...test import closeornan
 
 def test_pixelnumbers():
-    pos = np.array([[0, 0., -0.25, 1.],
-                    [0., 9.9, 1., 1.],
-                    [0., 10.1, 1., 1.]])
-    dir = np.ones((3,4), dtype=float)
-    dir[:, 3] = 0.
+    pos = np.array([[0, 0., -0.25],
+                    [0., 9.9, 1.],
+                    [0., 10.1, 1.]])
+    dir = np.ones((3,3), dtype=float)
     photons = Table({'pos': pos, 'dir': dir,
                      'energy': [1,2., 3.], 'polarization': [1.,2, 3.], 'probability': [1., 1., 1.]})
     det = FlatDetector(zoom=[1., 10., 5.], pixsize=0.5)
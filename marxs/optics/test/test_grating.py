@@ -4,23 +4,20 @@ from numpy.random import random
 from astropy.table import Table
 from transforms3d import axangles
 
-from ..grating import (FlatGrating, CATGrating,
+from ..grating import (FlatGrating, CATGrating, NO_ORDER,
                        constant_order_factory, uniform_efficiency_factory, EfficiencyFile)
-from ...math.pluecker import h2e
 from ... import energy2wave
 from ...utils import generate_test_photons
 
 def test_zeros_order():
     '''Photons diffracted into order 0 should just pass through'''
-    photons = Table({'pos': random((10, 4)) * 10 - 5,
-                     'dir': random((10, 4)) * 10 - 5,
+    photons = Table({'pos': random((10, 3)) * 10 - 5,
+                     'dir': random((10, 3)) * 10 - 5,
                      'energy': random(10),
                      'polarization': random(10),
                      'probability': np.ones(10),
                      })
-    # Make sure homogeneous coordiantes are valid
-    # and infall is normal
-    photons['pos'][:, 3] = 1
+    # Make sure infall is normal
     photons['dir'][:, 1:] = 0
 
     p = photons.copy()
@@ -31,8 +28,8 @@ def test_zeros_order():
                      zoom=np.array([1., 5., 5.]))
     p = g0.process_photons(p)
     # Direction unchanged
-    d_in = h2e(photons['dir'])
-    d_out = h2e(p['dir'])
+    d_in = photons['dir']
+    d_out = p['dir']
     # normalize
     d_in =  d_in / np.sqrt(np.sum(d_in**2, axis=-1))[:, None]
     d_out =  d_out / np.sqrt(np.sum(d_out**2, axis=-1))[:, None]
@@ -40,14 +37,14 @@ def test_zeros_order():
     # all intersection points in y-z plane
     assert np.allclose(p['pos'][:, 0], 0.)
     # no offset between old and new ray
-    assert np.allclose(np.cross(h2e(photons['pos']) - h2e(p['pos']), h2e(p['dir'])), 0)
+    assert np.allclose(np.cross(photons['pos'] - p['pos'], p['dir']), 0)
 
 def test_translation_invariance():
     '''For homogeneous gratings, the diffrection eqn does not care where the ray hits.'''
     photons = generate_test_photons(2)
-    photons['dir'] = np.tile(np.array([1., 2., 3., 0.]), (2, 1))
-    pos = np.tile(np.array([1., 0., 0., 1.]), (2, 1))
-    delta_pos = np.array([0, .23, -.34, 0.])
+    photons['dir'] = np.tile(np.array([1., 2., 3.]), (2, 1))
+    pos = np.tile(np.array([1., 0., 0.]), (2, 1))
+    delta_pos = np.array([0, .23, -.34])
     pos[1,:] += delta_pos
     photons['pos'] = pos
     for order in [-1, 0, 1]:
@@ -71,10 +68,10 @@ def test_angle_dependence():
     '''
     d = 0.001
     beta = np.deg2rad([0., 5., 10., 20.])
-    dir = np.zeros((len(beta), 4))
+    dir = np.zeros((len(beta), 3))
     dir[:, 2] = np.sin(beta)
     dir[:, 0] = -np.cos(beta)
-    pos = np.ones((len(beta), 4))
+    pos = np.ones((len(beta), 3))
     photons = Table({'pos': pos,
                      'dir': dir,
                      'energy': np.ones(len(beta)),
@@ -89,8 +86,8 @@ def test_angle_dependence():
 
 def test_order_dependence():
     '''For small theta, the change in direction is m * dtheta'''
-    photons = Table({'pos': np.ones((5,4)),
-                     'dir': np.tile([1., 0, 0, 0], (5,1)),
+    photons = Table({'pos': np.ones((5,3)),
+                     'dir': np.tile([1., 0, 0], (5,1)),
                      'energy': np.ones(5),
                      'polarization': np.ones(5),
                      'probability': np.ones(5),
@@ -108,8 +105,8 @@ def test_order_dependence():
 
 def test_energy_dependence():
     '''The grating angle should depend on the photon wavelength <-> energy.'''
-    photons = Table({'pos': np.ones((5,4)),
-                     'dir': np.tile([1., 0, 0, 0], (5,1)),
+    photons = Table({'pos': np.ones((5,3)),
+                     'dir': np.tile([1., 0, 0], (5,1)),
                      'energy': np.arange(1., 6),
                      'polarization': np.ones(5),
                      'probability': np.ones(5),
@@ -157,11 +154,11 @@ def test_groove_direction():
 
 
 def test_order_convention():
-    dirs = np.zeros((3, 4))
+    dirs = np.zeros((3, 3))
     dirs[1, 2] = 0.01
     dirs[2, 2] = -0.01
     dirs[:, 0] = - 1
-    photons = Table({'pos': np.ones((3, 4)),
+    photons = Table({'pos': np.ones((3, 3)),
                      'dir': dirs,
                      'energy': np.ones(3),
                      'polarization': np.ones(3),
@@ -178,11 +175,11 @@ def test_order_convention():
 
 
 def test_CAT_order_convention():
-    dirs = np.zeros((3, 4))
+    dirs = np.zeros((3, 3))
     dirs[:, 0] = -1.
     dirs[1, 2]= 0.01
     dirs[2, 2]= -0.01
-    photons = Table({'pos': np.ones((3, 4)),
+    photons = Table({'pos': np.ones((3, 3)),
                      'dir': dirs,
                      'energy': np.ones(3),
                      'polarization': np.ones(3),
@@ -193,7 +190,7 @@ def test_CAT_order_convention():
     gm = CATGrating(d=1./5000, order_selector=constant_order_factory(-5), zoom=2)
     m5 = gm.process_photons(photons.copy())
     for g in [gm, gp]:
-        assert np.all(g.order_sign_convention(h2e(photons['dir'])) == np.array([1, 1, -1]))
+        assert np.all(g.order_sign_convention(photons['dir'].data) == np.array([1, 1, -1]))
     assert p5['dir'][1, 2] > 0
     assert p5['dir'][2, 2] < 0
     assert m5['dir'][1, 2] < 0
@@ -241,5 +238,6 @@ def test_CATGRating_misses():
 
     cat = CATGrating(d=1./5000, order_selector=constant_order_factory(5), zoom=2)
     p = cat(photons)
-    assert np.all(np.isnan(p['order'][3:]))
+    assert np.all(p['order'][3:] == NO_ORDER)
+    assert p['order'].dtype == np.int8
     assert np.all(np.isnan(p['grat_y'][3:]))
@@ -29,3 +29,32 @@ def test_PerfectLens(ra):
     photons = mdet.process_photons(photons)
     assert np.std(photons['det_x']) > 1e-4
     assert np.std(photons['det_y']) > 1e-4
+
+
+def test_ThinLens():
+    '''Rays parallel to the optical axis go through the focal point.
+
+    The vectorized `process_photons` must give the same result as `process_photon`.
+    '''
+    mysource = source.PointSource((30., 30.))
+    mypointing = source.FixedPointing(coords=(30., 30.))
+    myslit = optics.RectangleAperture(zoom=[1, 7, 7], position=[200, 0, 0])
+    lens = optics.ThinLens(focallength=100, zoom=10)
+    photons = mypointing(mysource.generate_photons(100))
+    photons = myslit(photons)
+    # One ray through the center, one that misses the lens
+    photons['pos'][0, :] = [1, 0, 0]
+    photons['pos'][1, :] = [1, 15, 0]
+    single = [lens.process_photon(p['dir'], p['pos'], p['energy'], 0.) for p in photons]
+    photons = lens(photons)
+    assert np.allclose(photons['dir'][0], [-1, 0, 0])
+    assert np.allclose(photons['pos'][1], [1, 15, 0])
+    assert np.allclose(photons['dir'][1], [-1, 0, 0])
+    for i in range(2, len(photons)):
+        assert np.allclose(single[i][0], photons['dir'][i])
+        assert np.allclose(single[i][1], photons['pos'][i])
+    # Thin lens is not a perfect lens, but for small angles close enough.
+    mdet = optics.FlatDetector(pixsize=0.01, position=np.array([-100, 0, 0]), zoom=1e5)
+    photons = mdet(photons[2:])
+    assert np.max(np.abs(photons['det_x'])) < 0.05
+    assert np.max(np.abs(photons['det_y'])) < 0.05
@@ -13,6 +13,7 @@ import marxs.optics.aperture
 import marxs.source
 import marxs.source.source
 from marxs.utils import generate_test_photons
+from marxs.math.utils import translation2aff
 
 @pytest.fixture(autouse=True)
 def photons1000():
@@ -57,6 +58,123 @@ def test_pos4d_translation():
     assert np.all(oe.geometry['e_z'] == np.array([0, 0, 1, 0]))
 
 
+def test_move_element():
+    '''Setting pos4d moves an element, same as initializing it at the new position.'''
+    rotation = axangle2aff(np.array([1, 1, 0]), np.deg2rad(90))
+    rotation[:3, 3] = [1, 2, 3]
+    oe = marxs.optics.FlatGrating(d=0.001, order_selector=marxs.optics.constant_order_factory(),
+                                  groove_angle=.3, position=[5, 0, 0])
+    oe.pos4d = rotation
+    oe2 = marxs.optics.FlatGrating(d=0.001, order_selector=marxs.optics.constant_order_factory(),
+                                   groove_angle=.3, pos4d=rotation)
+    assert set(oe.geometry.keys()) == set(oe2.geometry.keys())
+    for k in oe.geometry:
+        if k != 'shape':
+            assert np.allclose(oe.geometry[k], oe2.geometry[k])
+
+
+def test_geometry_lazy():
+    '''The geometry is derived from pos4d when it is needed after a move.'''
+    oe = marxs.optics.FlatDetector(zoom=2, pixsize=.5)
+    oe.pos4d = np.dot(axangle2aff(np.array([0, 0, 1]), np.pi / 2), oe.pos4d)
+    assert oe._geometry_stale
+    assert np.allclose(oe.geometry['e_y'], [-1, 0, 0, 0])
+    assert not oe._geometry_stale
+    oe.pos4d = translation2aff([0, 5, 0])
+    photons = generate_test_photons(2)
+    photons['pos'][:, 1] = [0, 5]
+    photons = oe(photons)
+    assert np.isnan(photons['det_x'][0])
+    assert photons['det_x'][1] == 0
+    assert oe.npix == [4, 4]
+
+
+def test_intersect():
+    '''Compare intersection points with the Pluecker line/plane intersection.'''
+    from marxs.math.pluecker import dir_point2line, intersect_line_plane, h2e
+    oe = marxs.optics.FlatDetector(position=[3, 2, 1], zoom=[1, 3, 5],
+                                   orientation=axangle2aff(np.array([1, 2, 3]), .3)[:3, :3])
+    np.random.seed(0)
+    pos = np.random.normal(size=(1000, 3)) * 3 + [10, 0, 0]
+    dir = np.random.normal(size=(1000, 3)) * .1 + [-1, 0, 0]
+    expected = h2e(intersect_line_plane(dir_point2line(dir, pos),
+                                        oe.geometry['plane']))
+    interpos = np.empty((1000, 3))
+    intercoos = np.empty((1000, 2))
+    intersect, ip, ic = oe.intersect(dir, pos, interpos, intercoos)
+    assert ip is interpos
+    assert ic is intercoos
+    assert intersect.sum() > 100
+    assert not intersect.all()
+    assert np.allclose(interpos[intersect], expected[intersect])
+    assert np.all(np.isnan(interpos[~intersect]))
+    loc = expected - h2e(oe.geometry['center'])
+    assert np.allclose(intercoos[:, 0], np.dot(loc, oe.geometry['e_y'][:3]))
+    assert np.allclose(intercoos[:, 1], np.dot(loc, oe.geometry['e_z'][:3]))
+    # single photon
+    i0, ip0, ic0 = oe.intersect(dir[0], pos[0])
+    assert i0 == intersect[0]
+    assert ip0.shape == (3, )
+    assert ic0.shape == (2, )
+    assert np.allclose(ic0, intercoos[0])
+
+
+def test_intersect_index():
+    '''Passing the intersecting photons as mask or as index array gives the same result.'''
+    photons = generate_test_photons(10)
+    photons['pos'][:, 1] = np.arange(10) - 4.5
+    det = marxs.optics.FlatDetector(zoom=2, pixsize=.1)
+    intersect, interpos, intercoos = det.intersect(photons['dir'].data, photons['pos'].data)
+    assert intersect.sum() == 4
+    p1 = det.process_photons(photons.copy(), intersect, interpos, intercoos)
+    p2 = det.process_photons(photons.copy(), np.flatnonzero(intersect), interpos, intercoos)
+    p3 = det.process_photons(photons.copy())
+    for c in p1.colnames:
+        assert np.allclose(p1[c], p2[c], equal_nan=True)
+        assert np.allclose(p1[c], p3[c], equal_nan=True)
+    assert np.all(np.isnan(p1['det_x'][~intersect]))
+
+
+def test_process_photons_homogeneous():
+    '''Photon lists with homogeneous pos and dir columns can be passed to process_photons.'''
+    from marxs.photons import to_homogeneous
+    photons = generate_test_photons(10)
+    det = marxs.optics.FlatDetector(zoom=2, pixsize=.1)
+    p1 = det.process_photons(photons.copy())
+    p2 = det.process_photons(to_homogeneous(photons.copy()))
+    assert p2['pos'].shape == (10, 3)
+    for c in p1.colnames:
+        assert np.allclose(p1[c], p2[c], equal_nan=True)
+
+
+class ScalarElement(marxs.optics.base.OpticalElement):
+    '''Element that only implements `process_photon`.'''
+    output_columns = ['counter']
+
+    def process_photon(self, dir, pos, energy, polarization):
+        return -dir, pos + 1, energy * 2, polarization, 0.5, energy + 3
+
+
+def test_process_photon_blocks():
+    '''The loop over `process_photon` gives the same result in blocks and in a pool.'''
+    from multiprocessing.pool import ThreadPool
+
+    photons = generate_test_photons(25)
+    photons['energy'] = np.arange(25.)
+    elem = ScalarElement()
+    p1 = elem(photons.copy())
+    elem.process_block_size = 4
+    elem.pool = ThreadPool(3)
+    p2 = elem(photons.copy())
+    elem.pool.close()
+    for p in [p1, p2]:
+        assert np.all(p['dir'][:, 0] == 1)
+        assert np.all(p['pos'][:, 0] == 2)
+        assert np.all(p['energy'] == 2 * np.arange(25.))
+        assert np.all(p['probability'] == 0.5)
+        assert np.all(p['counter'] == np.arange(25.) + 3)
+
+
 
 mark = pytest.mark.parametrize
 
@@ -97,8 +215,8 @@ def test_pos4d_transforms_slit_rotated(photons1000):
 
 def test_photonlocalcoords_decorator():
 
-    pos = np.array([[1, 0, 0, 1], [0, 1, 0, 1]])
-    dir = np.array([[1, 0, 0, 0], [0, 1, 0, 0]])
+    pos = np.array([[1, 0, 0], [0, 1, 0]])
+    dir = np.array([[1, 0, 0], [0, 1, 0]])
     photontab = Table([Column(data=pos, name='pos'),
                        Column(data=dir, name='dir')
                        ])
@@ -107,7 +225,7 @@ def test_photonlocalcoords_decorator():
         @marxs.optics.base.photonlocalcoords
         def functiontodecorate(self, photons):
             assert np.allclose(photons['dir'], dir)
-            assert np.allclose(photons['pos'], np.array([[2., 2, 3, 1], [1, 3, 3, 1]]))
+            assert np.allclose(photons['pos'], np.array([[2., 2, 3], [1, 3, 3]]))
             return photons
 
     oetest = OEforTest(position=np.array([-1., -2, -3]))
@@ -115,6 +233,23 @@ def test_photonlocalcoords_decorator():
     assert np.allclose(photontab['dir'], dir)
     assert np.allclose(photontab['pos'], pos)
 
+    # Float columns are transformed in place
+    photontab = Table({'pos': pos.astype(float), 'dir': dir.astype(float)})
+    col = photontab['pos']
+    photontab = oetest.functiontodecorate(photontab)
+    assert photontab['pos'] is col
+    assert np.allclose(photontab['pos'], pos)
+
+
+def test_pos4d_inv():
+    '''The inverse of pos4d is cached and updated when the element moves.'''
+    oe = marxs.optics.FlatDetector(position=[1, 2, 3], zoom=2)
+    inv = oe.pos4d_inv
+    assert np.allclose(np.dot(inv, oe.pos4d), np.eye(4))
+    assert oe.pos4d_inv is inv
+    oe.pos4d = axangle2aff(np.array([1, 1, 0]), .4)
+    assert np.allclose(np.dot(oe.pos4d_inv, oe.pos4d), np.eye(4))
+
 
 def test_FlatStack():
     '''Run a stack of two elements and check that both are applied to the photons.'''
@@ -135,3 +270,44 @@ def test_FlatStack():
     assert np.allclose(p['probability'], [1, 1, .5, .5, .5])
     assert np.all(np.isnan(p['a'][:2]))
     assert np.allclose(p['a'][2:], [-1.9, -1., 0])
+
+    # Moving the stack moves all layers
+    fs.pos4d = np.eye(4)
+    assert np.allclose(fs.sequence[1].geometry['center'], np.array([0, 0, 0, 1]))
+
+
+@pytest.mark.parametrize('aperture', [marxs.optics.RectangleAperture,
+                                      marxs.optics.CircleAperture])
+def test_aperture_quasi_random(aperture, photons1000):
+    '''Quasi-random positions fill the aperture more evenly than pseudo-random ones.
+
+    Compare the fraction of photons in the inner half of the aperture
+    with the expected value, averaged over a few seeds.
+    '''
+    def error(quasi_random):
+        err = []
+        for seed in range(5):
+            a = aperture(zoom=[1, 2, 2], quasi_random=quasi_random, random_state=seed)
+            p = a(photons1000.copy())
+            if aperture is marxs.optics.RectangleAperture:
+                r = np.abs(p['pos'][:, 1:3]).max(axis=1)
+            else:
+                r = np.linalg.norm(p['pos'][:, 1:3], axis=1)
+            err.append((r < 1).mean() - 0.25)
+        return np.sqrt(np.mean(np.square(err)))
+
+    assert error(True) < error(False) / 2
+
+
+def test_quasi_random_reproducible(photons1000):
+    '''Two runs with the same seed give the same photons.'''
+    def run():
+        a = marxs.optics.CircleAperture(zoom=[1, 2, 2], quasi_random=True, random_state=3)
+        a(photons1000.copy())
+        # rescrambling keeps the bases
+        a.set_random_state(3)
+        return a(photons1000.copy())
+
+    p1 = run()
+    p2 = run()
+    assert np.all(p1['pos'] == p2['pos'])
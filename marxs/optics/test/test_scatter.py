@@ -8,7 +8,7 @@ from ...utils import generate_test_photons
 def test_distribution_of_scattered_rays():
     '''Check that scattered rays have a normal distribution.'''
     photons = generate_test_photons(500)
-    photons['pos'] = np.tile(np.array([0., 1., 0., 1.]), (500, 1))
+    photons['pos'] = np.tile(np.array([0., 1., 0.]), (500, 1))
     rms = RadialMirrorScatter(inplanescatter=0.1)
     det = FlatDetector(position=[-1, 0, 0], zoom=1000)
 
@@ -27,7 +27,7 @@ def test_distribution_scatered_rays_turned():
     Also, do some perpendicular to the plan scattering, that's missing
     from the test above.'''
     photons = generate_test_photons(500)
-    photons['pos'] = np.tile(np.array([0., 0., 1., 1.]), (500, 1))
+    photons['pos'] = np.tile(np.array([0., 0., 1.]), (500, 1))
     rms = RadialMirrorScatter(inplanescatter=0.1, perpplanescatter=0.01)
     det = FlatDetector(position=[-1, 0, 0], zoom=1000)
 
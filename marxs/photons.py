@@ -0,0 +1,349 @@
+'''A light-weight container for photon lists.
+
+Elements in marxs work on an `astropy.table.Table` of photons. Tables are
+very convenient, but each column operation goes through the
+`astropy.table.Column` machinery and adding a column to a table can copy data.
+For large simulations, `PhotonBatch` can be used instead. It stores each
+column in a plain `numpy.ndarray` and supports the subset of the
+`astropy.table.Table` interface that the marxs elements use, so that a
+`PhotonBatch` can be passed through a simulation instead of a Table.
+'''
+from collections import OrderedDict
+from copy import deepcopy
+
+import numpy as np
+from astropy.table import Table
+
+from .math.pluecker import e2h, h2e
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class PhotonColumn(np.ndarray):
+    '''A `numpy.ndarray` with a ``data`` attribute like `astropy.table.Column`.
+
+    marxs elements often use ``photons[colname].data`` to get the numbers in a
+    column without the overhead of a Column object. For a `PhotonBatch` the
+    column is a plain array already and ``data`` just returns a view of it.
+    '''
+    @property
+    def data(self):
+        return self.view(np.ndarray)
+
+
+class PhotonRow(object):
+    '''A single photon in a `PhotonBatch`.'''
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    def __getitem__(self, name):
+        return self._batch._data[name][self._index]
+
+    def __setitem__(self, name, value):
+        self._batch._data[name][self._index] = value
+
+
+class PhotonBatch(object):
+    '''Struct-of-arrays container for photon lists.
+
+    A `PhotonBatch` holds one `numpy.ndarray` per column. The arrays can have
+    more rows than photons in the batch (the ``capacity``), so that appending
+    photons does not require a new allocation every time. When the capacity is
+    exceeded, it is doubled.
+
+    ``photons[colname]`` returns a view of the column (no copy), so that
+    ``photons[colname][index] = value`` changes the data in the batch.
+    Assigning a full column with ``photons[colname] = value`` writes the values
+    into the existing column if the shape and type fit and replaces the column
+    otherwise. Indexing with a boolean mask or an array of integers returns a
+    new `PhotonBatch` with a copy of the selected rows. Indexing with a slice
+    returns a new `PhotonBatch` whose columns are views of the selected rows,
+    like slicing a `numpy.ndarray`; use `copy` to get independent data.
+
+    Use `from_table` and `to_table` to convert between a `PhotonBatch` and an
+    `astropy.table.Table` at the beginning and the end of a simulation, e.g. to
+    write the photons to disk.
+
+    Parameters
+    ----------
+    columns : dict or ``None``
+        Dictionary of column names and data. All columns must have the same length.
+        The data is not copied if it is already a `numpy.ndarray`.
+    meta : dict or ``None``
+        Meta data for the photon list (same format as for `astropy.table.Table`).
+
+    Example
+    -------
+    >>> from marxs.source import PointSource, FixedPointing
+    >>> from marxs.photons import PhotonBatch
+    >>> mysource = PointSource(coords=(30., 30.), flux=1e-3, energy=2.)
+    >>> sky2mission = FixedPointing(coords=(30., 30.))
+    >>> photons = PhotonBatch.from_table(mysource.generate_photons(1e5))
+    >>> photons = sky2mission(photons)
+    >>> len(photons)
+    100
+    >>> photons['dir'].shape
+    (100, 3)
+    '''
+    def __init__(self, columns=None, meta=None):
+        if columns is None:
+            columns = {}
+        if meta is None:
+            meta = {}
+        self._data = OrderedDict()
+        self._n = None
+        for name, data in columns.items():
+            data = np.asanyarray(data).view(np.ndarray)
+            if self._n is None:
+                self._n = data.shape[0]
+            elif data.shape[0] != self._n:
+                raise ValueError('All columns must have the same length.')
+            self._data[name] = data
+        if self._n is None:
+            self._n = 0
+        self.meta = OrderedDict(deepcopy(meta))
+
+    @classmethod
+    def from_table(cls, table, fill_values=None):
+        '''Make a `PhotonBatch` from a table.
+
+        The numbers in the columns of the table are not copied.
+        Masked columns are converted to plain arrays with the masked values filled in.
+        A `PhotonBatch` has no mask, so the fill value has to mark the photons where a
+        value is missing, e.g. photons that were absorbed before they reached the
+        element that sets the column (see
+        `~marxs.base.SimulationSequenceElement.output_column_types`).
+
+        Parameters
+        ----------
+        table : `astropy.table.Table`
+            Input photon list.
+        fill_values : dict or ``None``
+            Fill values for masked columns in the form ``{'column name': value}``.
+            Masked float columns that are not listed here are filled with ``np.nan``,
+            other columns with the ``fill_value`` of the column.
+
+        Returns
+        -------
+        photons : `PhotonBatch`
+        '''
+        if fill_values is None:
+            fill_values = {}
+        columns = OrderedDict()
+        for name in table.colnames:
+            col = table[name]
+            if hasattr(col, 'filled') and hasattr(col, 'mask'):
+                if name in fill_values:
+                    col = col.filled(fill_values[name])
+                elif col.dtype.kind == 'f':
+                    col = col.filled(np.nan)
+                else:
+                    col = col.filled()
+            columns[name] = np.asarray(col)
+        return cls(columns, table.meta)
+
+    def to_table(self):
+        '''Convert to a table.
+
+        The table does not copy the numbers; changing the numbers in the table
+        also changes them in the `PhotonBatch` and vice versa.
+
+        Returns
+        -------
+        table : `astropy.table.Table`
+        '''
+        return Table([self[n].data for n in self.colnames], names=self.colnames,
+                     meta=deepcopy(self.meta), copy=False)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def capacity(self):
+        '''Number of photons that fit into the currently allocated arrays.'''
+        if len(self._data) == 0:
+            return self._n
+        return min([d.shape[0] for d in self._data.values()])
+
+    @property
+    def colnames(self):
+        return list(self._data.keys())
+
+    def keys(self):
+        return self.colnames
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield PhotonRow(self, i)
+
+    def __getitem__(self, item):
+        if isinstance(item, string_types):
+            return self._data[item][:self._n].view(PhotonColumn)
+        elif isinstance(item, (int, np.integer)):
+            if item < 0:
+                item += self._n
+            if (item < 0) or (item >= self._n):
+                raise IndexError('Index {0} is out of range.'.format(item))
+            return PhotonRow(self, item)
+        else:
+            return self.__class__(OrderedDict([(n, d[:self._n][item])
+                                               for n, d in self._data.items()]),
+                                  self.meta)
+
+    def __setitem__(self, name, value):
+        value = np.asanyarray(value)
+        if name in self._data:
+            col = self._data[name][:self._n]
+            if ((value.ndim == 0 or value.shape == col.shape or value.shape == col.shape[1:]) and
+                np.can_cast(value.dtype, col.dtype, 'same_kind')):
+                col[...] = value
+                return
+        if value.ndim == 0:
+            value = np.repeat(value, self._n)
+        self._set_column(name, value)
+
+    def _set_column(self, name, value):
+        if value.shape[0] != self._n:
+            raise ValueError('Column {0} has {1} rows, expected {2}.'.format(name, value.shape[0],
+                                                                           self._n))
+        data = np.empty((self.capacity, ) + value.shape[1:], dtype=value.dtype)
+        data[:self._n] = value
+        self._data[name] = data
+
+    def add_column(self, col, name=None):
+        '''Add a new column.
+
+        Parameters
+        ----------
+        col : `astropy.table.Column` or array
+            Data for the new column. The data is copied.
+        name : string or ``None``
+            Name of the new column. If ``None``, ``col.name`` is used.
+        '''
+        if name is None:
+            name = col.name
+        if name in self._data:
+            raise ValueError('Duplicate column name: {0}'.format(name))
+        self._set_column(name, np.asarray(col))
+
+    def remove_column(self, name):
+        del self._data[name]
+
+    def replace_column(self, name, col):
+        '''Replace a column with new data of any shape and type.
+
+        Parameters
+        ----------
+        name : string
+            Name of the column.
+        col : `astropy.table.Column` or array
+            Data for the new column. The data is copied.
+        '''
+        if name not in self._data:
+            raise ValueError('Column {0} does not exist.'.format(name))
+        self._set_column(name, np.asarray(col))
+
+    def rename_column(self, name, new_name):
+        if new_name in self._data:
+            raise KeyError('Column {0} already exists'.format(new_name))
+        self._data = OrderedDict([(new_name if n == name else n, d)
+                                  for n, d in self._data.items()])
+
+    def copy(self):
+        return self.__class__(OrderedDict([(n, d[:self._n].copy())
+                                           for n, d in self._data.items()]),
+                              self.meta)
+
+    def reserve(self, capacity):
+        '''Make sure the arrays can hold at least ``capacity`` photons.
+
+        Parameters
+        ----------
+        capacity : int
+            Requested capacity.
+        '''
+        if capacity <= self.capacity:
+            return
+        for name, d in self._data.items():
+            new = np.empty((capacity, ) + d.shape[1:], dtype=d.dtype)
+            new[:self._n] = d[:self._n]
+            self._data[name] = new
+
+    def append(self, photons):
+        '''Append photons to the end of the batch.
+
+        The allocated memory grows geometrically, so that appending many small
+        chunks of photons takes amortized linear time.
+
+        Parameters
+        ----------
+        photons : `PhotonBatch` or `astropy.table.Table`
+            Photons to be added. They must have the same columns as this batch.
+        '''
+        if set(photons.colnames) != set(self.colnames):
+            raise ValueError('Photons to be appended must have the same columns.')
+        n = len(photons)
+        if self._n + n > self.capacity:
+            self.reserve(max(2 * self.capacity, self._n + n))
+        for name, d in self._data.items():
+            d[self._n: self._n + n] = np.asarray(photons[name])
+        self._n += n
+
+
+def to_euclidean(photons):
+    '''Convert the ``pos``, ``dir`` and ``polarization`` vectors to Euclidean coordinates.
+
+    marxs stores the position and the direction of each photon as (N, 3) arrays
+    of Euclidean coordinates. Older versions of marxs stored them as (N, 4) arrays
+    of homogeneous coordinates. The same applies to the ``polarization`` vectors
+    of lab sources. Photon lists in that format (e.g. read from
+    disk) are converted by this function, which is called automatically when
+    photons are passed to an element. Columns that are Euclidean already are
+    not touched.
+
+    Parameters
+    ----------
+    photons : `astropy.table.Table` or `PhotonBatch`
+        Photon list. Columns are replaced in place.
+
+    Returns
+    -------
+    photons : `astropy.table.Table` or `PhotonBatch`
+        Same object as the input.
+    '''
+    for name in ['pos', 'dir', 'polarization']:
+        if (name in photons.colnames) and (photons[name].shape[1:] == (4, )):
+            data = photons[name].data
+            photons.replace_column(name, np.ascontiguousarray(h2e(data), dtype=data.dtype))
+    return photons
+
+
+def to_homogeneous(photons):
+    '''Convert the ``pos``, ``dir`` and ``polarization`` vectors to homogeneous coordinates.
+
+    This is the inverse of `to_euclidean` and can be used to write photon lists
+    in the format of older marxs versions or to pass them to code that expects
+    homogeneous coordinates. Columns that are homogeneous already are not touched.
+
+    Parameters
+    ----------
+    photons : `astropy.table.Table` or `PhotonBatch`
+        Photon list. Columns are replaced in place.
+
+    Returns
+    -------
+    photons : `astropy.table.Table` or `PhotonBatch`
+        Same object as the input.
+    '''
+    for name, w in [('pos', 1), ('dir', 0), ('polarization', 0)]:
+        if (name in photons.colnames) and (photons[name].shape[1:] == (3, )):
+            data = photons[name].data
+            photons.replace_column(name, e2h(data, w).astype(data.dtype))
+    return photons
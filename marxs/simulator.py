@@ -1,15 +1,325 @@
+import multiprocessing
+from contextlib import contextmanager
+from copy import copy
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
 import numpy as np
-from transforms3d.affines import decompose44
+from astropy.table import Table, MaskedColumn, vstack
 
-from .math.utils import translation2aff, zoom2aff, mat2aff
+from .math.utils import decompose44_stack
+from .math.pluecker import h2e
+from .math.bvh import BoundingSphereTree
+from .math.random import SeedTree, spawn_random_states
+from .photons import PhotonBatch, to_euclidean
 from .base import SimulationSequenceElement, _parse_position_keywords
-from .optics.base import OpticalElement
+from .optics.base import OpticalElement, FlatOpticalElement
 
 
 class SimulationSetupError(Exception):
     pass
 
 
+def _generate_window(source, times, exposuretime):
+    '''Generate photons with the emission ``times`` of one time window.
+
+    ``times`` are relative to the start of the full exposure (see
+    `marxs.source.source.Source.iter_times`), so that time-dependent
+    properties of the source are evaluated at the correct times. The meta
+    data is set for the full ``exposuretime``.
+    '''
+    photons = source.generate_photons_from_times(times)
+    photons.meta['EXPOSURE'] = (exposuretime, 'total exposure time [s]')
+    return photons
+
+
+def _fill_values(elements):
+    '''Collect the fill values for the output columns of ``elements``.
+
+    Containers (`Sequence` and `Parallel`) are searched recursively.
+
+    Returns
+    -------
+    fill_values : dict
+        Dictionary of the form ``{'column name': fill value}``.
+    '''
+    fill_values = {}
+    for elem in elements:
+        for name, (dtype, fill) in getattr(elem, 'output_column_types', {}).items():
+            fill_values[name] = fill
+        if getattr(elem, 'id_col', None) is not None:
+            fill_values[elem.id_col] = elem.id_col_type[1]
+        for attr in ['sequence', 'elements']:
+            fill_values.update(_fill_values(getattr(elem, attr, [])))
+    return fill_values
+
+
+_worker_setup = {}
+'''Sequence and source in a worker process of `Sequence.run_parallel`.'''
+
+
+def _init_worker(sequence, source):
+    _worker_setup['sequence'] = sequence
+    _worker_setup['source'] = source
+
+
+def _run_chunk(args):
+    '''Generate and process the photons for one chunk of `Sequence.run_parallel`.'''
+    times, exposuretime, seed = args
+    globalseed, sourceseed, sequenceseed = seed.spawn(3)
+    # for elements that do not have their own random number generator
+    np.random.seed(globalseed.generate_state())
+    _worker_setup['source'].set_random_state(sourceseed)
+    _worker_setup['sequence'].set_random_state(sequenceseed)
+    photons = _generate_window(_worker_setup['source'], times, exposuretime)
+    return _worker_setup['sequence'](photons)
+
+
+profile_report_columns = ['element', 'level', 'time', 'n_in', 'n_out',
+                          'live_in', 'live_out', 'cols_added', 'table_bytes_delta',
+                          'peak_bytes']
+'''Columns of the ``profile_report`` of `Sequence` and `Parallel`.'''
+
+_profile_report_dtypes = [str, int, float, int, int, int, int, str, int, int]
+
+
+def _photon_stats(photons):
+    '''Number of photons, live photons, column names and size of a photon list.'''
+    n = len(photons)
+    if 'probability' in photons.colnames:
+        live = int((photons['probability'] > 0).sum())
+    else:
+        live = n
+    nbytes = sum([photons[c].nbytes for c in photons.colnames])
+    return n, live, photons.colnames, nbytes
+
+
+_peak_stack = []
+'''Highest traced memory so far for each element that is currently profiled.
+
+`tracemalloc` has only one peak, which is reset for every element. When a nested
+element returns, its peak is passed on to the element that contains it.
+'''
+
+
+def _tracing():
+    return ((tracemalloc is not None) and tracemalloc.is_tracing() and
+            hasattr(tracemalloc, 'reset_peak'))
+
+
+def _start_peak():
+    '''Start measuring the peak memory of an element.
+
+    Returns
+    -------
+    before : int or ``None``
+        Traced memory before the call or ``None`` if `tracemalloc` is not tracing.
+    '''
+    if not _tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    if len(_peak_stack) > 0:
+        _peak_stack[-1] = max(_peak_stack[-1], peak)
+    tracemalloc.reset_peak()
+    _peak_stack.append(current)
+    return current
+
+
+def _stop_peak(before):
+    '''Return the peak memory allocated since `_start_peak` or -1 if not traced.'''
+    if before is None:
+        return -1
+    peak = max(_peak_stack.pop(), tracemalloc.get_traced_memory()[1])
+    if len(_peak_stack) > 0:
+        _peak_stack[-1] = max(_peak_stack[-1], peak)
+    return peak - before
+
+
+@contextmanager
+def _profiling(container):
+    '''Collect the profile of a container if it is the outermost profiled container.
+
+    Nested containers are called through `_run_element` of their parent, which
+    adds their rows to the profile of the parent.
+    '''
+    if (not container.profile) or (container._profile is not None):
+        yield
+    else:
+        container._profile = ([], 0)
+        container.profile_report = None
+        try:
+            yield
+        finally:
+            # If an element raised, rows may be incomplete. Then no report is made
+            # and the exception of the element is passed on.
+            rows = container._profile[0]
+            container._profile = None
+        if len(rows) > 0:
+            report = Table(rows=rows, names=profile_report_columns)
+        else:
+            report = Table(names=profile_report_columns, dtype=_profile_report_dtypes)
+        report['time'].unit = 's'
+        report['table_bytes_delta'].unit = 'byte'
+        report['peak_bytes'] = MaskedColumn(report['peak_bytes'],
+                                            mask=report['peak_bytes'] < 0,
+                                            unit='byte')
+        container.profile_report = report
+
+
+def _run_element(container, elem, photons, func, *args):
+    '''Call ``func(photons, *args)`` and add a row to the profile of the container.
+
+    ``elem`` is the element of the container that ``func`` runs. If ``elem`` is a
+    container itself, its elements are added to the same profile one level deeper.
+    '''
+    if container._profile is None:
+        return func(photons, *args)
+    rows, level = container._profile
+    nested = hasattr(elem, '_profile')
+    if nested:
+        elem._profile = (rows, level + 1)
+    # reserve a row, so that the row of a container comes before the rows of its elements
+    index = len(rows)
+    rows.append(None)
+    n_in, live_in, cols_in, bytes_in = _photon_stats(photons)
+    mem_before = _start_peak()
+    t0 = default_timer()
+    try:
+        photons = func(photons, *args)
+    finally:
+        t = default_timer() - t0
+        peak = _stop_peak(mem_before)
+        if nested:
+            elem._profile = None
+    n_out, live_out, cols_out, bytes_out = _photon_stats(photons)
+    name = getattr(elem, 'name', getattr(elem, '__name__', type(elem).__name__))
+    if isinstance(name, type):
+        name = name.__name__
+    rows[index] = (str(name), level, t, n_in, n_out, live_in, live_out,
+                   ','.join([c for c in cols_out if c not in cols_in]),
+                   bytes_out - bytes_in, peak)
+    return photons
+
+
+_flat_intersect = getattr(FlatOpticalElement.intersect, '__func__', FlatOpticalElement.intersect)
+
+
+class _ElementIndex(object):
+    '''Spatial index and stacked intersection geometry for a list of flat elements.
+
+    ``tree`` is a `~marxs.math.bvh.BoundingSphereTree`. If all elements use
+    `~marxs.optics.base.FlatOpticalElement.intersect`, ``proj`` (M, 4, 3) and
+    ``size`` (M, 2) hold the same projection matrices and half-sizes that each
+    element uses, so that the intersections of many photons with many elements
+    can be calculated together in `intersect`. Otherwise, ``proj`` is ``None``.
+    '''
+    def __init__(self, elements, groups=None):
+        # Transform the local geometry here instead of reading elem.geometry,
+        # so that the geometry of elements that were just moved is not derived
+        # before it is needed.
+        self.pos4d = [e.pos4d for e in elements]
+        pos4d = np.array(self.pos4d)
+        local = dict([(k, np.array([e._local_geometry[k] for e in elements]))
+                      for k in ['center', 'v_y', 'v_z']])
+        geom = dict([(k, np.einsum('nij,nj->ni', pos4d, v)) for k, v in local.items()])
+        center = h2e(geom['center'])
+        v_y = geom['v_y'][:, :3]
+        v_z = geom['v_z'][:, :3]
+        self.size = np.sqrt(np.column_stack([(v_y * v_y).sum(axis=1), (v_z * v_z).sum(axis=1)]))
+        self.tree = BoundingSphereTree(center, np.sqrt((self.size**2).sum(axis=1)),
+                                       groups=groups)
+        self.proj = None
+        if all([getattr(type(e).intersect, '__func__', type(e).intersect) is _flat_intersect
+                for e in elements]):
+            e_y = v_y / self.size[:, 0:1]
+            e_z = v_z / self.size[:, 1:2]
+            self.proj = np.empty((len(elements), 4, 3))
+            self.proj[:, :3, 0] = np.cross(e_y, e_z)
+            self.proj[:, :3, 1] = e_y
+            self.proj[:, :3, 2] = e_z
+            self.proj[:, 3, :] = - np.einsum('ni,nij->nj', center, self.proj[:, :3, :])
+
+    def is_current(self, elements):
+        '''Check that none of the ``elements`` was moved since the index was built.'''
+        return all([a is e.pos4d for a, e in zip(self.pos4d, elements)])
+
+    def intersect(self, dir, pos, elem):
+        '''Intersect ray ``j`` with element ``elem[j]`` for all ``j``.
+
+        This gives the same result as `~marxs.optics.base.FlatOpticalElement.intersect`
+        for each ray and element.
+        '''
+        proj = self.proj[elem]
+        p_dir = np.einsum('ni,nij->nj', dir, proj[:, :3, :])
+        p_pos = np.einsum('ni,nij->nj', pos, proj[:, :3, :])
+        p_pos += proj[:, 3, :]
+        t = - p_pos[:, 0] / p_dir[:, 0]
+        intercoos = p_dir[:, 1:] * t[:, np.newaxis]
+        intercoos += p_pos[:, 1:]
+        interpos = dir * t[:, np.newaxis]
+        interpos += pos
+        size = self.size[elem]
+        intersect = ((np.abs(intercoos[:, 0]) <= size[:, 0]) &
+                     (np.abs(intercoos[:, 1]) <= size[:, 1]))
+        return intersect, interpos, intercoos
+
+
+def _element_index(elements, groups=None):
+    '''Build an `_ElementIndex` for ``elements``.
+
+    Returns ``None`` unless all elements are flat optical elements.
+    '''
+    if (len(elements) == 0) or not all(
+            [isinstance(e, FlatOpticalElement) and hasattr(e, 'specific_process_photons')
+             for e in elements]):
+        return None
+    return _ElementIndex(elements, groups)
+
+
+def _snapshot_args(args):
+    '''Copy a value of ``elem_args``.
+
+    Lists, dictionaries and numpy arrays are copied (recursively), so that changes
+    made to them in place later are detected by `_same_args`. All other values are
+    kept as references.
+    '''
+    if isinstance(args, np.ndarray):
+        return args.copy()
+    if isinstance(args, list):
+        return [_snapshot_args(v) for v in args]
+    if isinstance(args, dict):
+        return dict([(k, _snapshot_args(v)) for k, v in args.items()])
+    return args
+
+
+def _same_args(a, b):
+    '''Check if two snapshots of ``(elem_class, elem_args)`` are the same.
+
+    Numpy arrays, lists and dictionaries are compared by value. All other values
+    are compared by identity, so that this works for callables and other objects
+    and does not consider two arguments the same that just compare equal.
+    '''
+    if b is None:
+        return False
+    return _same_value(a, b)
+
+
+def _same_value(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return (isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and
+                (a.dtype == b.dtype) and np.array_equal(a, b))
+    if isinstance(a, (list, tuple)) and isinstance(b, type(a)):
+        return (len(a) == len(b)) and all([_same_value(x, y) for x, y in zip(a, b)])
+    if isinstance(a, dict) and isinstance(b, dict):
+        return (set(a.keys()) == set(b.keys())) and all([_same_value(v, b[k])
+                                                         for k, v in a.items()])
+    return a is b
+
+
 class Sequence(SimulationSequenceElement):
     '''A Sequence is a container that summarizes several optical elements.
 
@@ -29,7 +339,50 @@ class Sequence(SimulationSequenceElement):
     postprocess_steps : list
         See ``preprocess_steps`` except that the steps are run *after* each sequence element
          (*default*: ``[]``).
+    prune_absorbed : bool
+        If ``True``, photons with ``probability == 0`` are removed from the photon list
+        before each element of the sequence, so that the elements (and the
+        ``preprocess_steps`` and ``postprocess_steps``) only process photons that are still
+        alive. This saves time if many photons are absorbed early in the sequence and
+        avoids photons on paths that are physically impossible
+        (*default*: ``False``).
+    keep_absorbed : bool
+        Only relevant if ``prune_absorbed=True``. If ``True``, the absorbed photons are
+        added back to the photon list at the end of the sequence in their original order.
+        Columns that were added after a photon was absorbed are masked for this photon.
+        If ``False``, the absorbed photons are dropped from the output and
+        `pruned_index` holds the input row number of each photon in the output
+        (*default*: ``True``).
+    random_state : ``None``, int, `~marxs.math.random.SeedTree` or `numpy.random.RandomState`
+        Seed for the random number generators of the elements in the sequence, see
+        `set_random_state`. If not given, the random number generators of the elements
+        are not changed.
+    profile : bool
+        If ``True``, measure the run time and the change in the photon list for every
+        element of the sequence, including the elements of nested `Sequence` or
+        `Parallel` containers. After each run, the result is available as
+        ``profile_report`` (see below) (*default*: ``False``).
 
+    Attributes
+    ----------
+    profile_report : `astropy.table.Table` or ``None``
+        Profile of the last run if ``profile=True`` or ``None`` if an element of the
+        last run raised an exception. The table has one row for each
+        element call with the following columns: ``element`` (name of the element),
+        ``level`` (nesting level, 0 for the elements of this sequence), ``time`` (wall time
+        in s), ``n_in`` and ``n_out`` (number of photons before and after the element),
+        ``live_in`` and ``live_out`` (number of photons with ``probability > 0``),
+        ``cols_added`` (names of new columns), ``table_bytes_delta`` (change in the size
+        of the columns of the photon list in bytes) and ``peak_bytes`` (see below).
+        Pre- and postprocessing steps are not included in the timing.
+
+        ``table_bytes_delta`` does not include temporary arrays and is 0 for
+        elements that only change existing columns, however much memory they use.
+        ``peak_bytes`` is the largest amount of memory that was allocated
+        during the call of the element above what was allocated before the call.
+        It is measured with `tracemalloc`, which slows down the simulation,
+        so it is only filled if `tracemalloc` is tracing (e.g. after
+        ``tracemalloc.start()``) and masked otherwise.
 
     Example
     -------
@@ -68,18 +421,207 @@ class Sequence(SimulationSequenceElement):
         self.sequence = kwargs.pop('sequence')
         self.preprocess_steps = kwargs.pop('preprocess_steps', [])
         self.postprocess_steps = kwargs.pop('postprocess_steps', [])
+        self.prune_absorbed = kwargs.pop('prune_absorbed', False)
+        self.keep_absorbed = kwargs.pop('keep_absorbed', True)
+        self.profile = kwargs.pop('profile', False)
         for elem in self.sequence + self.preprocess_steps + self.postprocess_steps:
             if not callable(elem):
                 raise SimulationSetupError('{0} is not callable.'.format(str(elem)))
         super(Sequence, self).__init__(**kwargs)
 
+    pruned_index = None
+    '''Row numbers in the input photon list of the photons in the output.
+
+    This is set by every call with ``prune_absorbed=True``. With ``keep_absorbed=False``,
+    it maps the surviving photons back to their position in the input.
+    '''
+
+    def set_random_state(self, seed):
+        '''Set the random number generators of all elements in the sequence.
+
+        Parameters
+        ----------
+        seed : ``None``, int, `~marxs.math.random.SeedTree` or `numpy.random.RandomState`
+            For an int or a `~marxs.math.random.SeedTree`, each element gets an independent
+            random number stream that is spawned from ``seed``. ``None`` resets all elements to
+            the global random number generator of ``np.random``; a
+            `numpy.random.RandomState` is shared by all elements.
+            Elements that are plain functions are ignored.
+        '''
+        for elem, s in zip(self.sequence, spawn_random_states(seed, len(self.sequence))):
+            if hasattr(elem, 'set_random_state'):
+                elem.set_random_state(s)
+
+    profile = False
+    profile_report = None
+    _profile = None
+
     def process_photons(self, photons):
+        photons = to_euclidean(photons)
+        with _profiling(self):
+            if self.prune_absorbed:
+                return self._process_photons_pruned(photons)
+            for elem in self.sequence:
+                for p in self.preprocess_steps:
+                    p(photons)
+                photons = _run_element(self, elem, photons, elem)
+                for p in self.postprocess_steps:
+                    p(photons)
+            return photons
+
+    def run_stream(self, source, exposuretime, window):
+        '''Generate and process photons in consecutive time windows.
+
+        Instead of generating all photons for the full ``exposuretime`` at once, the
+        photons are generated for one time window of length ``window`` at a time
+        (see `marxs.source.source.Source.iter_photons`).
+        Each chunk of photons is run through the sequence before the next chunk is
+        generated. Thus, the memory needed is set by the length of the window and not
+        by the total exposure time.
+
+        Parameters
+        ----------
+        source : `marxs.source.source.Source`
+            Source that generates the photons.
+        exposuretime : float
+            Total exposure time in seconds.
+        window : float
+            Length of each time window in seconds. The last window is shorter, if
+            ``exposuretime`` is not an integer multiple of ``window``.
+
+        Returns
+        -------
+        photons : generator
+            Generator that yields one `astropy.table.Table` of processed photons for
+            each time window. The times are given relative to the start of the
+            full exposure and the ``EXPOSURE`` keyword in the meta data is set to
+            the total ``exposuretime``.
+
+        Example
+        -------
+        Reusing ``mysource`` and ``my_instrument`` from the example for `Sequence`, the
+        processed photons can be written to disk chunk by chunk or collected in a
+        single table at the end:
+
+        >>> from astropy.table import vstack
+        >>> chunks = my_instrument.run_stream(mysource, 1e5, 1e4) # doctest: +SKIP
+        >>> photons_out = vstack(list(chunks)) # doctest: +SKIP
+        '''
+        for photons in source.iter_photons(exposuretime, window):
+            yield self(photons)
+
+    def run_parallel(self, source, exposuretime, n_chunks, processes=None, seed=None):
+        '''Generate and process photons on several cores.
+
+        The exposure time is split into ``n_chunks`` time windows of equal length.
+        The emission times of the photons are generated in the current process for the
+        full exposure (see `marxs.source.source.Source.iter_times`), so that a
+        time-dependent flux (e.g. a light curve) is sampled in the same way as in
+        `marxs.source.source.Source.generate_photons`. All other photon properties are
+        generated from these times and the photons are processed in a pool of worker
+        processes (see `multiprocessing.Pool`). Each worker holds its own copy of
+        the source and the sequence.
+        Before the times are generated, the random number generator of the source is
+        seeded from ``seed``. Before a chunk is simulated, the random number generators
+        of the source and of all elements in the sequence (see `set_random_state`) and
+        the global random number generator of ``np.random`` are seeded with seeds that
+        depend only on ``seed`` and the number of the chunk, so the result for a given
+        ``seed`` does not depend on the number of processes. Note that this changes the
+        random number generator of the source, and of the elements in the sequence when
+        ``processes=1``. The state of the global random number generator of
+        ``np.random`` in the current process is restored at the end.
+
+        On platforms that do not fork new processes (e.g. Windows), the source and
+        the sequence need to be pickled to be sent to the workers.
+
+        Parameters
+        ----------
+        source : `marxs.source.source.Source`
+            Source that generates the photons.
+        exposuretime : float
+            Total exposure time in seconds.
+        n_chunks : int
+            Number of time windows.
+        processes : int or ``None``
+            Number of worker processes. If ``None``, the number of CPUs is used.
+            For ``processes=1`` all chunks are simulated in the current process
+            without starting a pool.
+        seed : int, `~marxs.math.random.SeedTree` or ``None``
+            Simulation seed. The seeds for each chunk are spawned from this seed.
+
+        Returns
+        -------
+        photons : `astropy.table.Table`
+            Processed photons for the full exposure time. The meta data is taken from
+            the first chunk, with ``EXPOSURE`` set to the total ``exposuretime``.
+        '''
+        if not isinstance(seed, SeedTree):
+            seed = SeedTree(seed)
+        timeseed, chunkseed = seed.spawn(2)
+        source.set_random_state(timeseed)
+        times = list(source.iter_times(exposuretime, float(exposuretime) / n_chunks))
+        seeds = chunkseed.spawn(len(times))
+        tasks = [(t, exposuretime, s) for t, s in zip(times, seeds)]
+        # With processes=1, the chunks are seeded in this process. The global random
+        # number generator of the caller is restored afterwards.
+        state = np.random.get_state()
+        try:
+            if processes == 1:
+                _init_worker(self, source)
+                chunks = [_run_chunk(t) for t in tasks]
+            else:
+                pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                            initargs=(self, source))
+                try:
+                    chunks = pool.map(_run_chunk, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _worker_setup.clear()
+            np.random.set_state(state)
+        meta = chunks[0].meta
+        photons = vstack(chunks, metadata_conflicts='silent')
+        photons.meta = meta
+        photons.meta['EXPOSURE'] = (exposuretime, 'total exposure time [s]')
+        return photons
+
+    def _process_photons_pruned(self, photons):
+        '''Process photons, but pass only photons with probability > 0 to each element.'''
+        # Row number in the input photon list for each row of the working set and
+        # for each block of absorbed photons.
+        index = np.arange(len(photons))
+        absorbed = []
+        absorbed_index = []
         for elem in self.sequence:
+            if 'probability' in photons.colnames:
+                live = photons['probability'] > 0
+                if not np.all(live):
+                    if self.keep_absorbed:
+                        absorbed.append(photons[~live])
+                        absorbed_index.append(index[~live])
+                    photons = photons[live]
+                    index = index[live]
             for p in self.preprocess_steps:
                 p(photons)
-            photons = elem(photons)
+            photons = _run_element(self, elem, photons, elem)
             for p in self.postprocess_steps:
                 p(photons)
+        if self.keep_absorbed and (len(absorbed) > 0):
+            meta = photons.meta
+            batch = isinstance(photons, PhotonBatch)
+            if batch:
+                photons = photons.to_table()
+                absorbed = [a.to_table() for a in absorbed]
+            photons = vstack([photons] + absorbed, join_type='outer',
+                             metadata_conflicts='silent')
+            photons.meta = meta
+            photons = photons[np.argsort(np.concatenate([index] + absorbed_index))]
+            if batch:
+                photons = PhotonBatch.from_table(photons,
+                                                 fill_values=_fill_values(self.sequence))
+            index = np.arange(len(photons))
+        self.pruned_index = index
         return photons
 
 class Parallel(OpticalElement):
@@ -123,7 +665,8 @@ class Parallel(OpticalElement):
     uncertainties. First, run a simulation with optimal position, then change
     the values, regenerate the facets and rerun the simulation. Comparing the
     results will allow you to estimate the effect of the manufacturing
-    misalignment.
+    misalignment. `process_realizations` evaluates many realizations of the
+    uncertainties together in a single pass over the photons.
 
     The order in which all the transformations are applied to the facet is
     chosen such that all rotations are done around the center of the
@@ -155,6 +698,10 @@ class Parallel(OpticalElement):
         Sub-classes of `Parallel` can implement a method `calculate_elempos` to
         determine the position of their elements automatically. In this case, they should set
         ``elem_pos=None``.
+    random_state : ``None``, int, `~marxs.math.random.SeedTree` or `numpy.random.RandomState`
+        Seed for the random number generators of the elements, see `set_random_state`.
+    profile : bool
+        If ``True``, measure the time spent in each element (*default*: ``False``).
 
     Example
     -------
@@ -171,10 +718,37 @@ class Parallel(OpticalElement):
     A column that notes which CCD was hit by each photon will be added to the photon table when it
     is processed by ``photons = detect(photons)``. The name of this colum will be "CCD_ID".
     (If the `id_col` argument is not passed, the name will be the generic "element".)
+
+    When all elements are flat optical elements (derived from
+    `~marxs.optics.base.FlatOpticalElement`), `generate_elements` sorts them into a tree of
+    bounding spheres (see `spatial_index`). Each photon is then only tested for an
+    intersection with those elements that its ray passes close to.
+
+    With ``profile=True``, the result is stored in ``profile_report`` in the same format
+    as for `Sequence`. Only elements
+    that are close to at least one photon are called and appear in the report.
     '''
 
     id_col = 'element'
 
+    spatial_index = True
+    '''If ``True`` use a spatial index to route photons to elements.
+
+    For a structure with many small elements (e.g. the grating facets of a grating array), most
+    photons will pass far away from most elements. In this case it is much faster to first
+    find the elements close to each ray in a `~marxs.math.bvh.BoundingSphereTree` and then
+    calculate the exact intersection for those candidates only.
+    The index is used only if all elements are flat optical elements, otherwise
+    all photons are passed to all elements in turn.
+    '''
+
+    spatial_index_min_photons = 1000
+    '''Minimum number of photons for which the spatial index is used.
+
+    Querying the index has a fixed overhead. For fewer photons than this, all photons
+    are passed to all elements in turn, which is faster in this case.
+    '''
+
     uncertainty = np.eye(4)
     '''Uncertainty of pos4d.
 
@@ -191,7 +765,12 @@ class Parallel(OpticalElement):
     Initially, this is an empty list, it will be filled by `generate_elements`.
     '''
 
+    profile = False
+    profile_report = None
+    _profile = None
+
     def __init__(self, **kwargs):
+        self.profile = kwargs.pop('profile', False)
 
         self.elem_class = kwargs.pop('elem_class')
         # Need to operate on a copy here, to avoid changing elem_args of outer level
@@ -215,6 +794,9 @@ class Parallel(OpticalElement):
         else:
             self.elem_pos = elem_pos
 
+        # Elements do not exist yet, so the random state is set at the end.
+        set_seed = 'random_state' in kwargs
+        seed = kwargs.pop('random_state', None)
         super(Parallel, self).__init__(**kwargs)
 
         if 'id_col' not in self.elem_args:
@@ -226,6 +808,8 @@ class Parallel(OpticalElement):
                 raise ValueError('"elem_pos" must be specified as argument')
         self.elem_uncertainty = [np.eye(4)] * len(self.elem_pos)
         self.generate_elements()
+        if set_seed:
+            self.set_random_state(seed)
 
     def calculate_elempos(self):
         '''Calculate the position of elements based on some algorithm.
@@ -248,56 +832,343 @@ class Parallel(OpticalElement):
         - the position of each element ``Parallel.elem_pos`` relativ to the global position
         - the global uncertainty `uncertainty`.
         - the uncertainty for individual facets.
+
+        If ``elem_class`` and ``elem_args`` are unchanged since the last call, the
+        existing elements are moved to their new positions instead of being initialized
+        again. Thus, any attributes that were changed on individual elements by hand
+        (e.g. the ``order_selector`` of a grating) are kept in this case.
+        Numpy arrays, lists and dictionaries in ``elem_args`` are compared by value, so
+        changing them in place also initializes the elements again; all other values
+        must be replaced by a different object to do so.
         '''
+        n = len(self.elem_pos)
+        # check if elem_args is the same for every element
+        per_elem = [k for k, v in self.elem_args.iteritems()
+                    if isinstance(v, list) and (len(v) == n)]
+        specific_elem_args = []
+        for i in range(n):
+            specific = self.elem_args.copy()
+            for k in per_elem:
+                specific[k] = specific[k][i]
+            if 'name' not in specific:
+                specific['name'] = 'Elem {0} in {1}'.format(i, self.name)
+            specific_elem_args.append(specific)
 
-        self.elements = []
-
-        for i in range(len(self.elem_pos)):
-            # _parse_position_keywords pops off keywords, thus operate on a copy here
-            elem_args = self.elem_args.copy()
-            # check if elem_args is the same for every element
-            specific_elem_args = {}
-            for k, v in elem_args.iteritems():
-                if isinstance(v, list) and (len(v) == len(self.elem_pos)):
-                    specific_elem_args[k] = v[i]
-                else:
-                    specific_elem_args[k] = v
-            if 'name' not in specific_elem_args:
-                specific_elem_args['name'] = 'Elem {0} in {1}'.format(i, self.name)
-
-            elem_pos4d = _parse_position_keywords(specific_elem_args)
-            telem, relem, zelem, Selem = decompose44(elem_pos4d)
-            if not np.allclose(Selem, 0.):
-                raise ValueError('pos4 for elem includes shear, which is not supported here.')
-
-            e_center, e_rot, e_zoom, stemp = decompose44(self.elem_pos[i])
-            tsigelem, rsigelem, zsigelem, stemp = decompose44(self.elem_uncertainty[i])
-            if not np.allclose(stemp, 0.):
-                raise SimulationSetupError('Shear is not supported in the elem uncertainty.')
-            # Will be able to write this so much better in python 3.5,
-            # but for now I don't want to nest np.dot too much so here it goes
-            f_pos4d = np.eye(4)
-            for m in reversed([self.pos4d,                 # global position of ParallelElement
-                               self.uncertainty,           # uncertainty in global positioning
-                               translation2aff(tsigelem),  # uncertaintig in translation for elem
-                               translation2aff(e_center),  # translate elem center to global center
-                               translation2aff(telem),     # offset for all elem. Usually 0.
-                               mat2aff(rsigelem),          # uncertainty in rotation for elem
-                               mat2aff(e_rot),             # Rotation of individual elem
-                               mat2aff(relem),             # Rotation for all  elem, e.g. CAT gratings
-                               zoom2aff(zsigelem),         # uncertainty in the zoom
-                               zoom2aff(e_zoom),           # zoom of individual elem
-                               zoom2aff(zelem),            # sets size for all elem
-                              ]):
-                assert m.shape == (4, 4)
-                f_pos4d = np.dot(m, f_pos4d)
-            self.elements.append(self.elem_class(pos4d = f_pos4d, id_num=i, **specific_elem_args))
+        # _parse_position_keywords pops off keywords, so specific_elem_args is
+        # left with the arguments for the element class.
+        if set(per_elem) & set(['pos4d', 'position', 'orientation', 'zoom']):
+            elem_pos4d = np.array([_parse_position_keywords(a) for a in specific_elem_args])
+        else:
+            elem_pos4d = _parse_position_keywords(self.elem_args.copy())
+            elem_pos4d = np.tile(elem_pos4d, (n, 1, 1))
+            for a in specific_elem_args:
+                for k in ['pos4d', 'position', 'orientation', 'zoom']:
+                    a.pop(k, None)
+        self._elem_args_pos4d = elem_pos4d
+        f_pos4d = self._compose_pos4d([self.elem_uncertainty], [self.uncertainty])[0]
+
+        current_args = (self.elem_class, _snapshot_args(self.elem_args))
+        if (len(self.elements) == n) and _same_args(current_args,
+                                                    getattr(self, '_elem_args_used', None)):
+            for elem, pos4d in zip(self.elements, f_pos4d):
+                elem.pos4d = pos4d
+        else:
+            self.elements = [self.elem_class(pos4d=f_pos4d[i], id_num=i, **specific_elem_args[i])
+                             for i in range(n)]
+            self._elem_args_used = current_args
+        if self._element_seeds is not None:
+            self._apply_element_seeds()
+        self.build_index()
+
+    def _compose_pos4d(self, elem_uncertainty, uncertainty):
+        '''Calculate pos4d of all elements for a stack of uncertainties.
+
+        Parameters
+        ----------
+        elem_uncertainty : array of shape (K, M, 4, 4)
+            ``K`` realizations of the uncertainty for the ``M`` elements.
+        uncertainty : array of shape (K, 4, 4)
+            ``K`` realizations of the global uncertainty.
+
+        Returns
+        -------
+        pos4d : array of shape (K, M, 4, 4)
+            pos4d of each element in each realization.
+        '''
+        elem_uncertainty = np.asanyarray(elem_uncertainty, dtype=float)
+        k, n = elem_uncertainty.shape[:2]
+        telem, relem, zelem, Selem = decompose44_stack(self._elem_args_pos4d)
+        if not np.allclose(Selem, 0.):
+            raise ValueError('pos4 for elem includes shear, which is not supported here.')
+        e_center, e_rot, e_zoom, stemp = decompose44_stack(self.elem_pos)
+        tsigelem, rsigelem, zsigelem, stemp = decompose44_stack(elem_uncertainty.reshape((-1, 4, 4)))
+        if not np.allclose(stemp, 0.):
+            raise SimulationSetupError('Shear is not supported in the elem uncertainty.')
+        tsigelem = tsigelem.reshape((k, n, 3))
+        rsigelem = rsigelem.reshape((k, n, 3, 3))
+        zsigelem = zsigelem.reshape((k, n, 3))
+
+        # Translations, rotations and zooms of each element are combined first in this order:
+        # - uncertaintig in translation for elem
+        # - translate elem center to global center
+        # - offset for all elem. Usually 0.
+        # - uncertainty in rotation for elem
+        # - Rotation of individual elem
+        # - Rotation for all  elem, e.g. CAT gratings
+        # - uncertainty in the zoom
+        # - zoom of individual elem
+        # - sets size for all elem
+        # Then the global position and the global uncertainty are applied.
+        rot = np.matmul(rsigelem, np.matmul(e_rot, relem))
+        local = np.zeros((k, n, 4, 4))
+        local[..., :3, :3] = rot * (zsigelem * e_zoom * zelem)[..., None, :]
+        local[..., :3, 3] = tsigelem + e_center + telem
+        local[..., 3, 3] = 1.
+        glob = np.matmul(self.pos4d, np.asanyarray(uncertainty, dtype=float))
+        return np.matmul(glob[:, None, :, :], local)
+
+    _element_seeds = None
+
+    def set_random_state(self, seed):
+        '''Set the random number generators of all elements.
+
+        Each element gets its own random number stream, spawned from ``seed`` (see
+        `marxs.math.random.spawn_random_states`). The streams are remembered and
+        applied again when the elements are regenerated with `generate_elements`.
+
+        Parameters
+        ----------
+        seed : ``None``, int, `~marxs.math.random.SeedTree` or `numpy.random.RandomState`
+            Seed for the elements.
+        '''
+        self._element_seeds = spawn_random_states(seed, len(self.elem_pos))
+        self._apply_element_seeds()
+
+    def _apply_element_seeds(self):
+        for elem, s in zip(self.elements, self._element_seeds):
+            if hasattr(elem, 'set_random_state'):
+                elem.set_random_state(s)
+
+    def process_realizations(self, photons, elem_uncertainty=None, uncertainty=None,
+                             summary=None, batch_size=None):
+        '''Process the same photons for several realizations of the misalignments.
+
+        To estimate the effect of manufacturing tolerances, the same photon list is
+        processed for ``K`` different realizations of `elem_uncertainty` and
+        `uncertainty`.
+
+        All ``K`` realizations are evaluated together: The positions of all ``K * M``
+        elements are calculated in one vectorized step and each element is copied to
+        its position in every realization. The photon list is repeated ``K`` times and
+        traced through all copies in a single pass with the spatial index (see
+        `spatial_index`). Each repetition of the photons is only routed to the
+        elements of its own realization. The elements of this structure are not moved.
 
+        The memory needed grows with ``K`` times the number of photons; use
+        ``batch_size`` to limit the number of realizations that are evaluated
+        together. If the elements cannot be sorted into a spatial index,
+        the realizations in each batch are processed one after the other.
 
+        Parameters
+        ----------
+        photons : `astropy.table.Table`
+            Input photon list. It is not changed.
+        elem_uncertainty : array of shape (K, M, 4, 4) or ``None``
+            For each realization, one affine transformation matrix for each of the
+            ``M`` elements. If ``None``, the current ``elem_uncertainty`` is used for
+            all realizations.
+        uncertainty : array of shape (K, 4, 4) or ``None``
+            For each realization, the global uncertainty. If ``None``, the current
+            ``uncertainty`` is used for all realizations.
+        summary : callable or ``None``
+            If not ``None``, this is called with the processed photons for each
+            realization and its return value is kept instead of the photon list, e.g.
+            to calculate the spectral resolution without keeping all photons in memory.
+        batch_size : int or ``None``
+            Maximal number of realizations that are evaluated together. If ``None``,
+            all realizations are evaluated together.
+
+        Returns
+        -------
+        results : list
+            List of ``K`` processed photon lists or the ``summary`` of each of them.
+
+        Example
+        -------
+        >>> import numpy as np
+        >>> from transforms3d.affines import compose
+        >>> from marxs.simulator import Parallel
+        >>> from marxs.optics import FlatDetector
+        >>> from marxs.utils import generate_test_photons
+        >>> det = Parallel(elem_class=FlatDetector, elem_args={'zoom': 5},
+        ...                elem_pos={'position': [[0, 0, 0], [0, 20, 0]]})
+        >>> shifts = [compose([0, 0, z], np.eye(3), np.ones(3)) for z in [0, 1, 2]]
+        >>> unc = np.array([[s, s] for s in shifts])
+        >>> det.process_realizations(generate_test_photons(1), elem_uncertainty=unc,
+        ...                          summary=lambda p: float(p['det_y'][0]))
+        [0.0, -1.0, -2.0]
+        '''
+        if (elem_uncertainty is None) and (uncertainty is None):
+            raise ValueError('elem_uncertainty or uncertainty must be given.')
+        if elem_uncertainty is None:
+            elem_uncertainty = [self.elem_uncertainty] * len(uncertainty)
+        if uncertainty is None:
+            uncertainty = [self.uncertainty] * len(elem_uncertainty)
+        elem_uncertainty = np.asanyarray(elem_uncertainty, dtype=float)
+        uncertainty = np.asanyarray(uncertainty, dtype=float)
+        if elem_uncertainty.shape[1:] != (len(self.elem_pos), 4, 4):
+            raise ValueError('elem_uncertainty must have one matrix per element for each realization.')
+        if uncertainty.shape[1:] != (4, 4):
+            raise ValueError('uncertainty must have one matrix for each realization.')
+        if len(elem_uncertainty) != len(uncertainty):
+            raise ValueError('elem_uncertainty and uncertainty must have the same number of realizations.')
+
+        photons = to_euclidean(photons.copy())
+        pos4d = self._compose_pos4d(elem_uncertainty, uncertainty)
+        if batch_size is None:
+            batch_size = max(len(pos4d), 1)
+        results = []
+        with _profiling(self):
+            for start in range(0, len(pos4d), batch_size):
+                out = self._process_realization_batch(photons, pos4d[start: start + batch_size])
+                results.extend(out if summary is None else [summary(p) for p in out])
+        return results
+
+    def _process_realization_batch(self, photons, pos4d):
+        '''Process photons for the realizations in ``pos4d`` of shape (K, M, 4, 4).'''
+        k, m = pos4d.shape[:2]
+        elements = []
+        for realization in pos4d:
+            for elem, p in zip(self.elements, realization):
+                e = copy(elem)
+                e.pos4d = p
+                elements.append(e)
+        index = _element_index(elements, np.repeat(np.arange(k), m)) if self.spatial_index else None
+        if index is None:
+            out = []
+            for i in range(k):
+                p = photons.copy()
+                for elem in elements[i * m: (i + 1) * m]:
+                    p = _run_element(self, elem, p, elem)
+                out.append(p)
+            return out
+
+        n = len(photons)
+        batch = self._route_photons(photons[np.tile(np.arange(n), k)], elements, index,
+                                    np.repeat(np.arange(k), n))
+        return [batch[i * n: (i + 1) * n] for i in range(k)]
+
+    def build_index(self):
+        '''Sort the elements into a tree of bounding spheres.
+
+        This is called automatically by `generate_elements`. If the list of elements is
+        modified or individual elements are moved later on, the index is rebuilt when
+        photons are processed next.
+        For elements that are not flat optical elements, no index is built.
+        '''
+        self._indexed_elements = list(self.elements)
+        self._index = _element_index(self.elements) if self.spatial_index else None
 
     def process_photons(self, photons):
-        for elem in self.elements:
-            photons = elem(photons)
+        photons = to_euclidean(photons)
+        if ((getattr(self, '_indexed_elements', None) != self.elements) or
+                ((self._index is not None) and not self._index.is_current(self.elements))):
+            self.build_index()
+        with _profiling(self):
+            if ((not self.spatial_index) or (self._index is None) or
+                    (len(photons) < self.spatial_index_min_photons)):
+                for elem in self.elements:
+                    photons = _run_element(self, elem, photons, elem)
+                return photons
+            return self._route_photons(photons, self.elements, self._index)
+
+    def _route_photons(self, photons, elements, index, groups=None):
+        '''Pass photons to the ``elements`` that are close to them according to ``index``.
+
+        ``groups`` is the group number of each photon for an index that was built
+        with groups (see `~marxs.math.bvh.BoundingSphereTree`).
+        '''
+        # Photons are routed in passes. In each pass, the elements are called in
+        # order with their candidates. A photon that interacts with an element and
+        # changes direction has left its old ray, so its old candidates for the
+        # following elements are no longer valid. All photons that changed direction
+        # in a pass are routed again with a single query and passed to the following
+        # elements in the next pass.
+        # Photons that interact with an element without changing direction stay on their
+        # ray, so the intersections of all candidates in a pass can be calculated at the
+        # beginning of the pass and elements are only called for the photons that hit them.
+        n = len(photons)
+        changed = np.zeros(n, dtype=bool)
+        last = np.empty(n, dtype=int)
+        last[:] = -1
+        # Intersection points for all elements are collected in the same arrays.
+        # Elements only read the rows of the photons that intersect them.
+        buffers = (np.empty((n, 3)), np.empty((n, 2)))
+        candidates = index.tree.query(photons['dir'].data, photons['pos'].data, groups)
+        while candidates:
+            changed[:] = False
+            order = sorted(candidates)
+            if index.proj is None:
+                for i in order:
+                    ind = candidates[i]
+                    ind = ind[~changed[ind]]
+                    if len(ind) > 0:
+                        photons = _run_element(self, elements[i], photons,
+                                               self._process_candidates,
+                                               elements[i], i, ind, changed, last, buffers)
+            else:
+                ind = np.concatenate([candidates[i] for i in order])
+                elem = np.concatenate([np.repeat(i, len(candidates[i])) for i in order])
+                intersect, interpos, intercoos = index.intersect(photons['dir'].data[ind],
+                                                                 photons['pos'].data[ind], elem)
+                bounds = np.cumsum([0] + [len(candidates[i]) for i in order])
+                for j, i in enumerate(order):
+                    sl = slice(bounds[j], bounds[j + 1])
+                    hit = intersect[sl] & ~changed[ind[sl]]
+                    if hit.any():
+                        photons = _run_element(self, elements[i], photons, self._process_hits,
+                                               elements[i], i, ind[sl][hit],
+                                               interpos[sl][hit], intercoos[sl][hit],
+                                               changed, last, buffers)
+            rerouted = np.nonzero(changed)[0]
+            if len(rerouted) == 0:
+                break
+            newcand = index.tree.query(photons['dir'].data[rerouted],
+                                       photons['pos'].data[rerouted],
+                                       None if groups is None else groups[rerouted])
+            candidates = {}
+            for k, v in newcand.items():
+                v = rerouted[v]
+                v = v[last[v] < k]
+                if len(v) > 0:
+                    candidates[k] = v
+        return photons
+
+    def _process_candidates(self, photons, elem, i, ind, changed, last, buffers):
+        '''Process photons ``ind`` that are close to element ``elem`` according to the spatial index.'''
+        intersect, interpos, intercoos = elem.intersect(photons['dir'].data[ind],
+                                                        photons['pos'].data[ind])
+        hit = ind[intersect]
+        if len(hit) == 0:
+            return photons
+        return self._process_hits(photons, elem, i, hit, interpos[intersect],
+                                  intercoos[intersect], changed, last, buffers)
+
+    def _process_hits(self, photons, elem, i, hit, interpos, intercoos, changed, last, buffers):
+        '''Process photons ``hit`` that intersect element ``elem`` at ``interpos``.
+
+        For photons that interact with the element, the index ``i`` of the element is
+        stored in ``last``. Those that also change direction are marked in
+        ``changed``. ``buffers`` are arrays of shape
+        (N, 3) and (N, 2) that are used to pass the intersection points to the element.
+        '''
+        full_interpos, full_intercoos = buffers
+        full_interpos[hit] = interpos
+        full_intercoos[hit] = intercoos
+        olddir = photons['dir'].data[hit]
+        photons = elem.process_photons(photons, hit, full_interpos, full_intercoos)
+        changed[hit] = np.any(photons['dir'].data[hit] != olddir, axis=1)
+        last[hit] = i
         return photons
 
     def intersect(self, photons):
@@ -4,6 +4,7 @@ from astropy.table import Table, Column
 from ..optics.base import FlatOpticalElement
 from .source import Source
 from ..optics.polarization import polarization_vectors
+from ..math.utils import apply_affine
 
 
 class FarLabPointSource(Source, FlatOpticalElement):
@@ -27,23 +28,20 @@ class FarLabPointSource(Source, FlatOpticalElement):
         self.sourcePos = sourcePos
         super(FarLabPointSource, self).__init__(**kwargs)
 
-    def generate_photons(self, exposuretime):
-        photons = super(FarLabPointSource, self).generate_photons(exposuretime)
+    def generate_photons_from_times(self, times):
+        photons = super(FarLabPointSource, self).generate_photons_from_times(times)
         n = len(photons)
         # randomly choose direction - photons uniformly distributed over aperture area
         # measurements in mm
-        pos = np.dot(self.pos4d, np.array([np.zeros(n),
-                                           np.random.uniform(-1, 1, n),
-                                           np.random.uniform(-1, 1, n),
-                                           np.ones(n)]))
-
-        dir = np.array([pos[0, :] - self.sourcePos[0],
-                        pos[1, :] - self.sourcePos[1],
-                        pos[2, :] - self.sourcePos[2],
-                        np.zeros(n)])
-        photons['pos'] = pos.T
-        photons['dir'] = dir.T
-        photons['polarization'] = polarization_vectors(dir.T, photons['polangle'])
+        u_y, u_z = self.draw_uniform(n, 2, 'pos')
+        pos = apply_affine(self.pos4d, np.column_stack([np.zeros(n),
+                                                        2. * u_y - 1.,
+                                                        2. * u_z - 1.]), 1)
+
+        dir = pos - np.asarray(self.sourcePos)[:3]
+        photons['pos'] = pos
+        photons['dir'] = dir
+        photons['polarization'] = polarization_vectors(dir, photons['polangle'])
         return photons
 
 
@@ -72,23 +70,22 @@ class LabPointSource(Source):
         self.position = position
         super(LabPointSource, self).__init__(**kwargs)
 
-    def generate_photons(self, exposuretime):
-        photons = super(LabPointSource, self).generate_photons(exposuretime)
+    def generate_photons_from_times(self, times):
+        photons = super(LabPointSource, self).generate_photons_from_times(times)
         n = len(photons)
 
         # assign position to photons
         pos = np.array([self.position[0] * np.ones(n),
                         self.position[1] * np.ones(n),
-                        self.position[2] * np.ones(n),
-                        np.ones(n)])
+                        self.position[2] * np.ones(n)])
 
         # randomly choose direction - photons go in all directions from source
-        theta = np.random.uniform(0, 2 * np.pi, n);
-        phi = np.arcsin(np.random.uniform(-1, 1, n))
+        u_theta, u_phi = self.draw_uniform(n, 2, 'dir')
+        theta = 2 * np.pi * u_theta
+        phi = np.arcsin(2. * u_phi - 1.)
         dir = np.array([np.cos(theta) * np.cos(phi),
                         np.sin(theta) * np.cos(phi),
-                        np.sin(phi),
-                        np.zeros(n)])
+                        np.sin(phi)])
 
         if (self.dir != None):
         	if (self.dir[1] == 'x'):
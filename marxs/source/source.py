@@ -1,47 +1,140 @@
 import numpy as np
-from scipy.stats import expon
 from astropy.table import Table, Column
 from transforms3d.euler import euler2mat
 
 from ..base import SimulationSequenceElement
 from ..optics.polarization import polarization_vectors
-from ..math.random import RandomArbitraryPdf
+from ..math.random import RandomArbitraryPdf, RandomSampler, check_random_state
+from ..precision import float_type
 
 
-def poisson_process(rate):
-    '''Return a function that generates Poisson distributed times with rate ``rate``.
+def _windows(exposuretime, window):
+    '''Split the interval 0..exposuretime into windows of length ``window``.
+
+    The last window is shorter, if ``exposuretime`` is not an integer multiple
+    of ``window``.
+
+    Returns
+    -------
+    windows : generator
+        Yields ``(tstart, tstop)`` for each window.
+    '''
+    if window <= 0:
+        raise ValueError('window must be positive.')
+    nwindows = int(np.ceil(exposuretime / window))
+    for i in range(nwindows):
+        # Rounding can add an empty window at the end, e.g. for window = exposuretime / 3
+        if i * window < exposuretime:
+            yield i * window, min((i + 1) * window, exposuretime)
+
+
+class PoissonProcess(object):
+    '''Generate photon arrival times for a source with constant rate.
+
+    The number of photons in an interval of length ``T`` is Poisson
+    distributed with expectation value ``rate * T`` and, given that
+    number, the arrival times are independent and uniformly distributed in the
+    interval. This class draws the number of photons first and then sorts that
+    many uniform random numbers; thus, the number of photons follows the
+    Poisson distribution exactly and no more random numbers than needed are
+    drawn.
+
+    Because the photons in two non-overlapping intervals are independent,
+    long exposures can be split into windows with `iter_times`, which
+    only ever holds the photons of one window in memory.
 
     Parameters
     ----------
     rate : float
         Expectation value for the rate of events.
 
-    Returns
+    Example
     -------
-    poisson_rate : function
-        Function that generates Poisson distributed times with rate ``rate``.
+    >>> from marxs.source.source import PoissonProcess, PointSource
+    >>> star = PointSource(coords=(11., 12.), flux=PoissonProcess(100.))
     '''
-    def poisson_rate(exposuretime):
+    accepts_random_state = True
+
+    def __init__(self, rate):
+        if rate < 0:
+            raise ValueError('rate must be non-negative.')
+        self.rate = rate
+
+    def times(self, tstart, tstop, random_state=None):
+        '''Generate Poisson distributed times in the interval tstart..tstop.
+
+        Parameters
+        ----------
+        tstart, tstop : float
+            Start and end of the interval.
+        random_state : ``None``, int or `numpy.random.RandomState`
+            Random number generator, see `marxs.math.random.check_random_state`.
+
+        Returns
+        -------
+        times : `numpy.ndarray`
+            Sorted arrival times.
+        '''
+        random_state = check_random_state(random_state)
+        n = random_state.poisson(self.rate * (tstop - tstart))
+        times = random_state.uniform(tstart, tstop, size=n)
+        times.sort()
+        return times
+
+    def iter_times(self, exposuretime, window, random_state=None):
+        '''Generate Poisson distributed times in consecutive windows.
+
+        Parameters
+        ----------
+        exposuretime : float
+            Total exposure time.
+        window : float
+            Length of each window. The last window ends at ``exposuretime``
+            and can be shorter.
+        random_state : ``None``, int or `numpy.random.RandomState`
+            Random number generator, see `marxs.math.random.check_random_state`.
+
+        Returns
+        -------
+        times : generator
+            Yields one sorted `numpy.ndarray` of times per window.
+        '''
+        random_state = check_random_state(random_state)
+        for tstart, tstop in _windows(exposuretime, window):
+            yield self.times(tstart, tstop, random_state=random_state)
+
+    def __call__(self, exposuretime, random_state=None):
         '''Generate Poisson distributed times.
 
         Parameters
         ----------
         exposuretime : float
+        random_state : ``None``, int or `numpy.random.RandomState`
+            Random number generator, see `marxs.math.random.check_random_state`.
 
         Returns
         -------
         times : `numpy.ndarray`
-            Poisson distributed times.
+            Poisson distributed times between 0 and ``exposuretime``.
         '''
-        # Make 10 % more numbers then we expect to need, because it's random
-        times = expon.rvs(scale=1./rate, size=exposuretime * rate * 1.1)
-        # If we don't have enough numbers right now, add some more.
-        while times.sum() < exposuretime:
-            times = np.hstack([times, expon.rvs(scale=1/rate,
-                                                size=(exposuretime - times.sum() * rate * 1.1))])
-        times = np.cumsum(times)
-        return times[times < exposuretime]
-    return poisson_rate
+        return self.times(0., exposuretime, random_state=random_state)
+
+
+def poisson_process(rate):
+    '''Return a function that generates Poisson distributed times with rate ``rate``.
+
+    Parameters
+    ----------
+    rate : float
+        Expectation value for the rate of events.
+
+    Returns
+    -------
+    poisson_rate : `PoissonProcess`
+        Callable that generates Poisson distributed times with rate ``rate``.
+    '''
+    return PoissonProcess(rate)
+
 
 class SourceSpecificationError(Exception):
     pass
@@ -66,6 +159,9 @@ class Source(SimulationSequenceElement):
         - number: Constant (not Poisson distributed) flux.
         - callable: Function that takes a total exposure time as input and returns an array
           of photon emission times between 0 and the total exposure time.
+          If the callable has an attribute ``accepts_random_state = True`` (e.g. the
+          functions returned by `poisson_process`), the random number generator of the
+          source is passed to it as keyword ``random_state``.
 
     energy : number of callable or (2, N) `numpy.ndarray` or `numpy.recarray` or `dict <dict>` or `astropy.table.Table`
 
@@ -86,6 +182,9 @@ class Source(SimulationSequenceElement):
         - A function or callable object: This option allows for full customization. The
           function must take an array of photon times as input and return an equal length
           array of photon energies in keV.
+        - A `marxs.math.random.RandomSampler`, e.g. a `marxs.math.random.RandomAliasPdf`
+          for spectra with many bins or a `marxs.math.random.RandomPiecewiseLinearPdf` for
+          a smooth model spectrum. The energies are drawn from the sampler.
 
     polarization: contant or ``None``, (2, N) `numpy.ndarray`, `dict <dict>`, `astropy.table.Table` or similar or callable.
         There are several different ways to set the polarization angle of the photons for a
@@ -110,6 +209,14 @@ class Source(SimulationSequenceElement):
           The function is called with two arrays (time and energy values) as input
           and must return an array of equal length that contains the polarization angles in
           radian.
+        - A `marxs.math.random.RandomSampler`: The angles are drawn from the sampler.
+
+    quasi_random : bool
+        If ``True``, energies and polarization angles that are drawn from a tabulated
+        distribution or a sampler, as well as the positions and directions of lab sources,
+        use quasi-random numbers (see
+        `~marxs.base.SimulationSequenceElement.quasi_random`). The photon times are always
+        pseudo-random. The default is ``False``.
     '''
     def __init__(self, **kwargs):
         self.energy = kwargs.pop('energy', 1.)
@@ -118,21 +225,60 @@ class Source(SimulationSequenceElement):
 
         super(Source, self).__init__(**kwargs)
 
+    @property
+    def energy(self):
+        '''Energy of the emitted photons, see `Source` for the possible formats.
+
+        If the energy is given as a spectrum, the random number generator for it is
+        set up when it is first needed and then reused for every call of
+        `generate_energies`. Changing individual numbers in the spectrum in place
+        does not update it; set ``energy`` to a new spectrum instead.
+        '''
+        return self._energy
+
+    @energy.setter
+    def energy(self, energy):
+        self._energy = energy
+        self._energy_sampler = None
+
+    @property
+    def polarization(self):
+        '''Polarization angle of the emitted photons, see `Source` for the possible formats.
+
+        As for `energy`, the random number generator for a tabulated probability
+        density is set up once and reused until ``polarization`` is set again.
+        '''
+        return self._polarization
+
+    @polarization.setter
+    def polarization(self, polarization):
+        self._polarization = polarization
+        self._polarization_sampler = None
+
     def __call__(self, *args, **kwargs):
         return self.generate_photons(*args, **kwargs)
 
     def generate_times(self, exposuretime):
         if callable(self.flux):
+            if getattr(self.flux, 'accepts_random_state', False):
+                return self.flux(exposuretime, random_state=self.random_state)
             return self.flux(exposuretime)
         elif np.isscalar(self.flux):
             return np.arange(0, exposuretime, 1./self.flux)
         else:
             raise SourceSpecificationError('`flux` must be a number or a callable.')
 
+    def _sample(self, sampler, n, key):
+        '''Draw ``n`` numbers from ``sampler`` with the uniform numbers from `draw_uniform`.'''
+        return sampler.from_uniform(self.draw_uniform(n, sampler.n_uniform, key))
+
     def generate_energies(self, t):
         n = len(t)
+        # sampler, e.g. RandomAliasPdf
+        if isinstance(self.energy, RandomSampler):
+            return self._sample(self.energy, n, 'energy')
         # function
-        if callable(self.energy):
+        elif callable(self.energy):
             en = self.energy(t)
             if len(en) != n:
                 raise SourceSpecificationError('`energy` has to return an array of same size as input time array.')
@@ -143,12 +289,14 @@ class Source(SimulationSequenceElement):
             return np.ones(n) * self.energy
         # 2 * n numpy array
         elif hasattr(self.energy, 'shape') and (self.energy.shape[0] == 2):
-            rand = RandomArbitraryPdf(self.energy[0, :], self.energy[1, :])
-            return rand(n)
+            if self._energy_sampler is None:
+                self._energy_sampler = RandomArbitraryPdf(self.energy[0, :], self.energy[1, :])
+            return self._sample(self._energy_sampler, n, 'energy')
         # np.recarray or astropy.table.Table
         elif hasattr(self.energy, '__getitem__'):
-            rand = RandomArbitraryPdf(self.energy['energy'], self.energy['flux'])
-            return rand(n)
+            if self._energy_sampler is None:
+                self._energy_sampler = RandomArbitraryPdf(self.energy['energy'], self.energy['flux'])
+            return self._sample(self._energy_sampler, n, 'energy')
         # anything else
         else:
             raise SourceSpecificationError('`energy` must be number, function, 2*n array or have fields "energy" and "flux".')
@@ -156,8 +304,11 @@ class Source(SimulationSequenceElement):
 
     def generate_polarization(self, times, energies):
         n = len(times)
+        # sampler, e.g. RandomAliasPdf
+        if isinstance(self.polarization, RandomSampler):
+            return self._sample(self.polarization, n, 'polarization')
         # function
-        if callable(self.polarization):
+        elif callable(self.polarization):
             pol = self.polarization(times, energies)
             if len(pol) != n:
                 raise SourceSpecificationError('`polarization` has to return an array of same size as input time and energy arrays.')
@@ -167,20 +318,90 @@ class Source(SimulationSequenceElement):
             return np.ones(n) * self.polarization
         # 2 * n numpy array
         elif hasattr(self.polarization, 'shape') and (self.polarization.shape[0] == 2):
-            rand = RandomArbitraryPdf(self.polarization[0, :], self.polarization[1, :])
-            return rand(n)
+            if self._polarization_sampler is None:
+                self._polarization_sampler = RandomArbitraryPdf(self.polarization[0, :],
+                                                                self.polarization[1, :])
+            return self._sample(self._polarization_sampler, n, 'polarization')
         # np.recarray or astropy.table.Table
         elif hasattr(self.polarization, '__getitem__'):
-            rand = RandomArbitraryPdf(self.polarization['angle'], self.polarization['probability'])
-            return rand(n)
+            if self._polarization_sampler is None:
+                self._polarization_sampler = RandomArbitraryPdf(self.polarization['angle'],
+                                                                self.polarization['probability'])
+            return self._sample(self._polarization_sampler, n, 'polarization')
         elif self.polarization is None:
-            return np.random.uniform(0, 2 * np.pi, n)
+            return 2 * np.pi * self.draw_uniform(n, 1, 'polarization')[0]
         else:
             raise SourceSpecificationError('`polarization` must be number (angle), callable, None (unpolarized), 2.n array or have fields "angle" (in rad) and "probability".')
 
+    def iter_times(self, exposuretime, window):
+        '''Generate photon emission times in consecutive time windows.
+
+        If `flux` has an ``iter_times`` method (e.g. `PoissonProcess`), the
+        times for each window are generated independently, so that only the
+        times of one window are held in memory. For a constant flux, the times
+        are the same as for `generate_times`. Any other callable is called once
+        for the full exposure time and the result is split into windows.
+
+        Parameters
+        ----------
+        exposuretime : float
+            Total exposure time in seconds.
+        window : float
+            Length of each time window in seconds.
+
+        Returns
+        -------
+        times : generator
+            Yields one `numpy.ndarray` of times per window.
+        '''
+        if hasattr(self.flux, 'iter_times'):
+            for times in self.flux.iter_times(exposuretime, window,
+                                              random_state=self.random_state):
+                yield times
+        elif callable(self.flux):
+            alltimes = self.generate_times(exposuretime)
+            windows = list(_windows(exposuretime, window))
+            ind = np.digitize(alltimes, [w[1] for w in windows[:-1]])
+            for i in range(len(windows)):
+                yield alltimes[ind == i]
+        elif np.isscalar(self.flux):
+            # Same values as np.arange in generate_times
+            step = 1. / self.flux
+            for tstart, tstop in _windows(exposuretime, window):
+                yield np.arange(np.ceil(tstart / step), np.ceil(tstop / step)) * step
+        else:
+            raise SourceSpecificationError('`flux` must be a number or a callable.')
+
     def generate_photon(self):
         raise NotImplementedError
 
+    def generate_photons_from_times(self, times):
+        '''Generate photons with the given emission times.
+
+        This generates all photon properties except for the time according to
+        the `energy` and `polarization` of this source. Derived classes that
+        add more columns (e.g. the position on the sky) should override this
+        method, so that the columns are added in `generate_photons` and in
+        `iter_photons`.
+
+        Parameters
+        ----------
+        times : `numpy.ndarray`
+            Emission times of the photons.
+
+        Returns
+        -------
+        photons : `astropy.table.Table`
+            Table with photon properties.
+        '''
+        energies = self.generate_energies(times)
+        pol = self.generate_polarization(times, energies)
+        n = len(times)
+        return Table({'time': np.asarray(times, dtype=float_type('time')),
+                      'energy': np.asarray(energies, dtype=float_type('energy')),
+                      'polangle': np.asarray(pol, dtype=float_type('polangle')),
+                      'probability': np.ones(n, dtype=float_type('probability'))})
+
     def generate_photons(self, exposuretime):
         '''Central function to generate photons.
 
@@ -200,17 +421,41 @@ class Source(SimulationSequenceElement):
         photons : `astropy.table.Table`
             Table with photon properties.
         '''
-        times = self.generate_times(exposuretime)
-        energies = self.generate_energies(times)
-        pol = self.generate_polarization(times, energies)
-        n = len(times)
-        photons = Table({'time': times, 'energy': energies, 'polangle': pol,
-                         'probability': np.ones(n)})
+        photons = self.generate_photons_from_times(self.generate_times(exposuretime))
         photons.meta['EXPOSURE'] = (exposuretime, 'total exposure time [s]')
 
         #photons.meta['DATE-OBS'] =
         return photons
 
+    def iter_photons(self, exposuretime, window):
+        '''Generate photons in consecutive time windows.
+
+        This generates the same kind of photons as `generate_photons`, but
+        split into chunks of photons with times in the windows
+        0..window, window..2*window, etc. (see `iter_times`).
+        Only one chunk is held in memory at any time, which keeps the memory
+        use constant for long exposures.
+
+        Parameters
+        ----------
+        exposuretime : float
+            Total exposure time in seconds.
+        window : float
+            Length of each time window in seconds. The last window is shorter, if
+            ``exposuretime`` is not an integer multiple of ``window``.
+
+        Returns
+        -------
+        photons : generator
+            Yields one `astropy.table.Table` for each time window. The times are
+            given relative to the start of the full exposure and the ``EXPOSURE``
+            keyword in the meta data is set to the total ``exposuretime``.
+        '''
+        for times in self.iter_times(exposuretime, window):
+            photons = self.generate_photons_from_times(times)
+            photons.meta['EXPOSURE'] = (exposuretime, 'total exposure time [s]')
+            yield photons
+
 
 class PointSource(Source):
     '''Astrophysical point source.
@@ -227,8 +472,8 @@ class PointSource(Source):
         self.coords = coords
         super(PointSource, self).__init__(**kwargs)
 
-    def generate_photons(self, exposuretime):
-        photons = super(PointSource, self).generate_photons(exposuretime)
+    def generate_photons_from_times(self, times):
+        photons = super(PointSource, self).generate_photons_from_times(times)
         photons['ra'] = np.ones(len(photons)) * self.coords[0]
         photons['dec'] = np.ones(len(photons)) * self.coords[1]
 
@@ -252,22 +497,22 @@ class SymbolFSource(Source):
     def __init__(self, coords, size=1, **kwargs):
         self.coords = coords
         self.size = size
-        super(PointSource, self).__init__(**kwargs)
+        super(SymbolFSource, self).__init__(**kwargs)
 
-    def generate_photons(self, exposuretime):
-        photons = super(PointSource, self).generate_photons(exposuretime)
+    def generate_photons_from_times(self, times):
+        photons = super(SymbolFSource, self).generate_photons_from_times(times)
         n = len(photons)
-        elem = np.random.choice(3, size=n)
+        elem = self.random_state.choice(3, size=n)
 
         ra = np.empty(n)
         ra[:] = self.coords[0]
         dec = np.empty(n)
         dec[:] = self.coords[1]
-        ra[elem == 0] += self.size * np.random.random(np.sum(elem == 0))
+        ra[elem == 0] += self.size * self.random_state.random_sample(np.sum(elem == 0))
         ra[elem == 1] += self.size
-        dec[elem == 1] += 0.5 * self.size * np.random.random(np.sum(elem == 1))
+        dec[elem == 1] += 0.5 * self.size * self.random_state.random_sample(np.sum(elem == 1))
         ra[elem == 2] += 0.8 * self.size
-        dec[elem == 2] += 0.3 * self.size * np.random.random(np.sum(elem == 2))
+        dec[elem == 2] += 0.3 * self.size * self.random_state.random_sample(np.sum(elem == 2))
 
         photons['ra'] = ra
         photons['dec'] = dec
@@ -295,11 +540,8 @@ class PointingModel(SimulationSequenceElement):
     '''
     def add_dir(self, photons):
         linecoords = Column(name='dir', length=len(photons),
-                            shape=(4,))
+                            shape=(3,), dtype=float_type('dir'))
         photons.add_column(linecoords)
-        # Leave everything unset, but chances are I will forget the 4th
-        # component. Play safe here.
-        photons['dir'][:, 3] = 0
 
     def process_photons(self, photons):
         # Could also loop over single photons if not implemented in
@@ -351,7 +593,7 @@ class FixedPointing(PointingModel):
                                np.deg2rad(-self.roll), 'rzyx')
 
     def photons_dir(self, ra, dec, time):
-        '''Calculate direction on photons in homogeneous coordinates.
+        '''Calculate direction on photons in Euclidean coordinates.
 
         Parameters
         ----------
@@ -364,15 +606,15 @@ class FixedPointing(PointingModel):
 
         Returns
         -------
-        photons_dir : np.array of shape (n, 4)
-            Homogeneous direction vector for each photon
+        photons_dir : np.array of shape (n, 3)
+            Euclidean direction vector for each photon
         '''
         # Minus sign here because photons start at +inf and move towards origin
-        photons_dir = np.zeros((len(ra), 4))
+        photons_dir = np.zeros((len(ra), 3))
         photons_dir[:, 0] = - np.cos(dec) * np.cos(ra)
         photons_dir[:, 1] = - np.cos(dec) * np.sin(ra)
         photons_dir[:, 2] = - np.sin(dec)
-        photons_dir[:, :3] = np.dot(self.mat3d.T, photons_dir[:, :3].T).T
+        photons_dir = np.dot(photons_dir, self.mat3d)
 
         return photons_dir
 
@@ -388,8 +630,9 @@ class FixedPointing(PointingModel):
         photons = super(FixedPointing, self).process_photons(photons)
         ra = np.deg2rad(photons['ra'].data)
         dec = np.deg2rad(photons['dec'].data)
-        photons['dir'] = self.photons_dir(ra, dec, photons['time'].data)
-        photons['polarization'] = self.photons_pol(ra, dec, photons['time'].data, photons['polangle'].data)
+        photons['dir'][:] = self.photons_dir(ra, dec, photons['time'].data)
+        pol = self.photons_pol(ra, dec, photons['time'].data, photons['polangle'].data)
+        photons['polarization'] = np.asarray(pol, dtype=float_type('polarization'))
         photons.meta['RA_PNT'] = (self.ra, '[deg] Pointing RA')
         photons.meta['DEC_PNT'] = (self.dec, '[deg] Pointing Dec')
         photons.meta['ROLL_PNT'] = (self.roll, '[deg] Pointing Roll')
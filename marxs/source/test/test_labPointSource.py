@@ -10,7 +10,10 @@ def test_photon_generation():
 	source = LabSource(pos, flux=rate, energy=5.)
 
 	photons = source.generate_photons(1.)
-	assert np.all(photons['pos'] == np.ones([10, 4]))
+	assert np.all(photons['pos'] == np.ones([10, 3]))
+	assert photons['polarization'].shape == (10, 3)
+	# polarization is perpendicular to the direction
+	assert np.allclose(np.einsum('ij,ij->i', photons['polarization'], photons['dir']), 0)
 
 def test_photon_direction():
 	'''This tests the lab point source. It checks the optional 'direction' parameter.
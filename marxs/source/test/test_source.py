@@ -2,7 +2,10 @@ import numpy as np
 import pytest
 from astropy.table import Table
 
-from ..source import Source, SourceSpecificationError, poisson_process
+from ..source import (Source, SourceSpecificationError, poisson_process, PoissonProcess,
+                      PointSource, SymbolFSource)
+from ..labSource import LabPointSource, FarLabPointSource
+from ...math.random import RandomAliasPdf
 
 def test_energy_input_default():
     '''For convenience and testing, defaults for time, energy and pol are set.'''
@@ -130,3 +133,103 @@ def test_poisson_process():
     times = p(100.)
     assert (len(times) > 1500) and (len(times) < 2500)
     assert (times[-1] > 99.) and (times[-1] < 100.)
+
+def test_poisson_process_count():
+    '''The number of events follows the Poisson distribution and times are sorted.'''
+    p = PoissonProcess(3.)
+    rs = np.random.RandomState(0)
+    n = np.array([len(p(2., random_state=rs)) for i in range(2000)])
+    assert np.isclose(n.mean(), 6., rtol=0.05)
+    assert np.isclose(n.var(), 6., rtol=0.1)
+    times = p(1000., random_state=rs)
+    assert np.all(np.diff(times) >= 0)
+    assert times.min() >= 0
+    assert times.max() < 1000.
+
+def test_poisson_process_windows():
+    '''Windows cover the exposure time without gaps or overlap.'''
+    p = PoissonProcess(10.)
+    chunks = list(p.iter_times(25., 10., random_state=1))
+    assert len(chunks) == 3
+    for i, c in enumerate(chunks):
+        assert np.all((c >= 10. * i) & (c < min(10. * (i + 1), 25.)))
+    times = np.hstack(chunks)
+    assert np.all(np.diff(times) >= 0)
+    assert 150 < len(times) < 350
+
+def test_iter_photons_constant_flux():
+    '''For a constant flux, the chunks are the same as a single call.'''
+    s = Source(flux=10., energy=2.)
+    photons = s.generate_photons(10.)
+    chunks = list(s.iter_photons(10., 3.))
+    assert len(chunks) == 4
+    assert np.all(np.hstack([c['time'] for c in chunks]) == photons['time'])
+    for c in chunks:
+        assert c.meta['EXPOSURE'][0] == 10.
+        assert c.colnames == photons.colnames
+
+def test_iter_photons_callable():
+    '''A callable without iter_times is split into windows.'''
+    s = Source(flux=lambda t: np.array([0., 1., 4., 5., 9.9]))
+    chunks = list(s.iter_photons(10., 5.))
+    assert [len(c) for c in chunks] == [3, 2]
+
+def test_iter_photons_poisson():
+    '''Chunks from a Poisson process are continuous and sorted.'''
+    s = Source(flux=PoissonProcess(50.), random_state=0)
+    chunks = list(s.iter_photons(100., 7.))
+    assert len(chunks) == 15
+    times = np.hstack([c['time'] for c in chunks])
+    assert np.all(np.diff(times) >= 0)
+    assert 0 <= times[0] < 1
+    assert 99 < times[-1] < 100
+    assert np.abs(len(times) - 5000) < 5 * np.sqrt(5000)
+
+@pytest.mark.parametrize('source', [PointSource(coords=(30., 30.)),
+                                    SymbolFSource(coords=(30., 30.)),
+                                    LabPointSource(position=[0, 0, 0]),
+                                    FarLabPointSource(sourcePos=[10, 0, 0])])
+def test_iter_photons_subclasses(source):
+    '''Derived classes add the same columns in both methods.'''
+    photons = source.generate_photons(10.)
+    chunks = list(source.iter_photons(10., 4.))
+    assert [len(c) for c in chunks] == [4, 4, 2]
+    for c in chunks:
+        assert set(c.colnames) == set(photons.colnames)
+
+def test_sampler_cached():
+    '''Spectra are set up once and again after energy or polarization are set.'''
+    en1 = {'energy': np.array([1., 2., 3.]), 'flux': np.array([0., 1., 0.])}
+    en2 = {'energy': np.array([1., 2., 3.]), 'flux': np.array([0., 0., 1.])}
+    s = Source(energy=en1, polarization=np.array([[1., 2.], [0., 1.]]), random_state=0)
+    e = s.generate_energies(np.zeros(20))
+    assert np.all((e >= 1.) & (e < 2.))
+    sampler = s._energy_sampler
+    s.generate_photons(5)
+    assert s._energy_sampler is sampler
+    assert s._polarization_sampler is not None
+    s.energy = en2
+    assert s._energy_sampler is None
+    e = s.generate_energies(np.zeros(20))
+    assert np.all((e >= 2.) & (e < 3.))
+    s.polarization = None
+    assert s._polarization_sampler is None
+
+def test_sampler_input():
+    '''energy and polarization can be samplers.'''
+    s = Source(energy=RandomAliasPdf(np.array([1., 2., 3.]), np.array([0., 0., 1.])),
+               polarization=RandomAliasPdf(np.array([0., 1.]), np.array([0., 1.])))
+    photons = s.generate_photons(100)
+    assert np.all((photons['energy'] >= 2.) & (photons['energy'] < 3.))
+    assert np.all((photons['polangle'] >= 0.) & (photons['polangle'] < 1.))
+
+def test_quasi_random_energies():
+    '''Quasi-random energies follow the spectrum more closely.'''
+    en = np.array([[1., 2., 3.], [0., 1., 3.]])
+
+    def error(quasi_random):
+        s = Source(energy=en, quasi_random=quasi_random, random_state=0)
+        err = [(s.generate_photons(400)['energy'] < 2).mean() - 0.25 for i in range(10)]
+        return np.sqrt(np.mean(np.square(err)))
+
+    assert error(True) < error(False) / 2
@@ -0,0 +1,162 @@
+import numpy as np
+from astropy.table import Table
+import pytest
+
+from ..photons import PhotonBatch, to_euclidean, to_homogeneous
+from ..simulator import Sequence, Parallel
+from ..source import PointSource, FixedPointing
+from ..optics import (RectangleAperture, FlatGrating, FlatDetector,
+                      uniform_efficiency_factory)
+from ..optics.grating import NO_ORDER
+
+
+def test_table_roundtrip():
+    '''Converting to a PhotonBatch and back keeps all columns and meta data.'''
+    t = Table({'a': [1, 2, 3], 'b': np.ones((3, 4))})
+    t.meta['EXPOSURE'] = (5., 'exposure')
+    p = PhotonBatch.from_table(t)
+    assert len(p) == 3
+    assert set(p.colnames) == set(['a', 'b'])
+    assert p['b'].shape == (3, 4)
+    assert isinstance(p['a'].data, np.ndarray)
+    t2 = p.to_table()
+    for c in t.colnames:
+        assert np.all(t[c] == t2[c])
+    assert t2.meta['EXPOSURE'][0] == 5.
+
+
+def test_column_views():
+    '''Columns are views, indexing rows makes copies.'''
+    p = PhotonBatch({'a': np.arange(5.), 'b': np.zeros((5, 2))})
+    p['a'][[1, 3]] = -1
+    assert np.all(p['a'] == [0, -1, 2, -1, 4])
+    p['b'] = 1
+    assert np.all(p['b'] == 1)
+    # type does not fit: column is replaced
+    p['a'] = np.array(['x'] * 5)
+    assert p['a'][0] == 'x'
+    sub = p[p['b'][:, 0] > 0][:2]
+    assert len(sub) == 2
+    sub['b'][:] = 5
+    assert np.all(p['b'] == 1)
+    with pytest.raises(ValueError):
+        p['c'] = np.arange(3)
+    # rows write into the batch
+    for row in p:
+        row['b'] = row['b'] * 2
+    assert np.all(p['b'] == 2)
+
+
+def test_append_amortized():
+    '''Capacity grows geometrically when photons are appended.'''
+    p = PhotonBatch({'a': np.arange(2), 'b': np.zeros((2, 4))})
+    chunk = PhotonBatch({'b': np.ones((3, 4)), 'a': np.arange(3)})
+    capacities = []
+    for i in range(20):
+        p.append(chunk)
+        capacities.append(p.capacity)
+    assert len(p) == 62
+    assert len(set(capacities)) < 8
+    assert np.all(p['a'][2:] == np.tile(np.arange(3), 20))
+    assert np.all(p['b'][:2] == 0)
+    assert np.all(p['b'][2:] == 1)
+    with pytest.raises(ValueError):
+        p.append(PhotonBatch({'a': np.arange(3)}))
+
+
+@pytest.mark.parametrize('cls', [Table, PhotonBatch])
+def test_homogeneous_roundtrip(cls):
+    '''pos, dir and polarization can be converted to homogeneous coordinates and back.'''
+    pos = np.random.rand(5, 3)
+    direc = np.random.rand(5, 3)
+    p = cls({'pos': pos.copy(), 'dir': direc.copy(), 'polarization': direc.copy(),
+             'energy': np.ones(5)})
+    p = to_homogeneous(p)
+    assert p['pos'].shape == (5, 4)
+    assert np.all(p['pos'][:, 3] == 1)
+    assert np.all(p['dir'][:, 3] == 0)
+    assert np.all(p['polarization'][:, 3] == 0)
+    # Converting twice does not change anything
+    p = to_homogeneous(p)
+    assert p['dir'].shape == (5, 4)
+    p = to_euclidean(p)
+    assert p['pos'].shape == (5, 3)
+    assert p['pos'].dtype == pos.dtype
+    assert np.allclose(p['pos'], pos)
+    assert np.allclose(p['dir'], direc)
+    assert np.allclose(p['polarization'], direc)
+
+
+def test_homogeneous_input():
+    '''Elements accept photon lists with homogeneous pos and dir columns.'''
+    mysource = PointSource(coords=(30., 30.), flux=1., energy=1.)
+    photons = mysource.generate_photons(100)
+    instrument = Sequence(sequence=[FixedPointing(coords=(30., 30.)),
+                                    RectangleAperture(position=[50, 0, 0]),
+                                    FlatDetector(zoom=100, pixsize=1)])
+    np.random.seed(0)
+    p3 = instrument(photons.copy())
+    np.random.seed(0)
+    p4 = instrument(to_homogeneous(photons.copy()))
+    assert p4['pos'].shape == (100, 3)
+    for c in p3.colnames:
+        assert np.allclose(p3[c], p4[c], equal_nan=True)
+
+
+def test_simulation_same_as_table():
+    '''Running a PhotonBatch through a simulation gives the same result as a Table.'''
+    mysource = PointSource(coords=(30., 30.), flux=1., energy=1.)
+    photons = mysource.generate_photons(1000)
+    instrument = Sequence(sequence=[FixedPointing(coords=(30., 30.)),
+                                    RectangleAperture(position=[50, 0, 0]),
+                                    FlatGrating(d=1./500, order_selector=uniform_efficiency_factory(),
+                                                position=[20, 0, 0], zoom=40),
+                                    FlatDetector(zoom=100, pixsize=1)],
+                          prune_absorbed=True)
+    np.random.seed(0)
+    ptab = instrument(photons.copy())
+    np.random.seed(0)
+    pbatch = instrument(PhotonBatch.from_table(photons))
+    assert isinstance(pbatch, PhotonBatch)
+    assert set(ptab.colnames) == set(pbatch.colnames)
+    for c in ptab.colnames:
+        assert np.allclose(ptab[c], pbatch[c], equal_nan=True)
+
+
+def test_pruned_absorbed_same_as_table():
+    '''Absorbed photons get the declared fill values in a PhotonBatch.
+
+    In a Table the values are masked instead.
+    '''
+    def absorb_half(photons):
+        photons['probability'][::2] = 0
+        return photons
+
+    mysource = PointSource(coords=(30., 30.), flux=1., energy=1.)
+    photons = mysource.generate_photons(1000)
+    pos = [[0, y, z] for y in [-50, 50] for z in [-50, 50]]
+    instrument = Sequence(sequence=[FixedPointing(coords=(30., 30.)),
+                                    RectangleAperture(position=[50, 0, 0]),
+                                    absorb_half,
+                                    FlatGrating(d=1./500, order_selector=uniform_efficiency_factory(),
+                                                position=[20, 0, 0], zoom=40),
+                                    Parallel(elem_class=FlatDetector,
+                                             elem_args={'zoom': 50, 'pixsize': 1},
+                                             elem_pos={'position': pos}, id_col='CCD_ID')],
+                          prune_absorbed=True)
+    np.random.seed(0)
+    ptab = instrument(photons.copy())
+    np.random.seed(0)
+    pbatch = instrument(PhotonBatch.from_table(photons))
+    assert set(ptab.colnames) == set(pbatch.colnames)
+    assert np.all(ptab['CCD_ID'].mask[::2])
+    assert np.all(pbatch['CCD_ID'][::2] == -1)
+    assert np.all(pbatch['CCD_ID'][1::2] >= 0)
+    assert np.all(pbatch['order'][::2] == NO_ORDER)
+    assert np.all(np.isnan(pbatch['det_x'][::2]))
+    fill = {'CCD_ID': -1, 'order': NO_ORDER}
+    for c in ptab.colnames:
+        col = ptab[c]
+        if hasattr(col, 'mask'):
+            col = col.filled(fill.get(c, np.nan))
+        assert np.allclose(col, pbatch[c], equal_nan=True)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from .. import precision
+from ..source import PointSource, FixedPointing
+from ..optics import (RectangleAperture, ThinLens, RadialMirrorScatter, FlatGrating,
+                      FlatDetector, uniform_efficiency_factory)
+from ..simulator import Sequence
+
+
+def test_set_precision():
+    '''The context manager restores the previous setting.'''
+    assert precision.get_precision() == 'double'
+    with precision.precision('single'):
+        assert precision.float_type('dir') is np.float32
+        assert precision.float_type('pos') is np.float64
+    assert precision.get_precision() == 'double'
+    with pytest.raises(ValueError):
+        precision.set_precision('half')
+
+
+def test_single_same_as_double():
+    '''A simulation in single precision gives almost the same result as in double.'''
+    def run(value):
+        with precision.precision(value):
+            src = PointSource(coords=(30., 30.), energy=1., random_state=0)
+            instrum = Sequence(sequence=[FixedPointing(coords=(30., 30.)),
+                                         RectangleAperture(position=[500., 0, 0], zoom=[1, 50, 50]),
+                                         ThinLens(focallength=500., position=[500., 0, 0], zoom=50),
+                                         RadialMirrorScatter(inplanescatter=1e-5),
+                                         FlatGrating(d=2e-4, position=[250., 0, 0], zoom=50,
+                                                     order_selector=uniform_efficiency_factory()),
+                                         FlatDetector(pixsize=0.04, zoom=100)],
+                               random_state=0)
+            return instrum(src.generate_photons(1000))
+
+    p64 = run('double')
+    p32 = run('single')
+    for c in ['dir', 'energy', 'probability', 'det_x', 'detpix_x']:
+        assert p32[c].dtype == np.float32
+    assert p32['pos'].dtype == np.float64
+    assert np.all(p32['order'] == p64['order'])
+    assert np.allclose(p32['det_x'], p64['det_x'], atol=1e-3, equal_nan=True)
+    assert np.allclose(p32['det_y'], p64['det_y'], atol=1e-3, equal_nan=True)
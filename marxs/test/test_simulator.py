@@ -3,6 +3,7 @@ from astropy.table import Table
 import pytest
 
 from ..simulator import Sequence, SimulationSetupError, Parallel
+from ..math.utils import translation2aff
 from ..optics import ThinLens, FlatGrating, uniform_efficiency_factory
 
 def test_pre_post_process():
@@ -77,3 +78,372 @@ def test_list_elemargs():
                       )
     assert 'All elements in elem_pos must have the same number' in str(e.value)
 
+
+def test_parallel_spatial_index():
+    '''Routing photons with the spatial index gives the same result as looping over elements.'''
+    from ..optics import FlatDetector
+    pos = [[0, y, z] for y in np.arange(-10, 10, 2.1) for z in np.arange(-10, 10, 2.1)]
+    det = Parallel(elem_class=FlatDetector, elem_args={'pixsize': 0.01, 'zoom': 1},
+                   elem_pos={'position': pos}, id_col='CCD_ID')
+    assert det._index is not None
+    photons = Table({'pos': np.tile([1., 0., 0., 1.], (1000, 1)),
+                     'dir': np.tile([-1., 0., 0., 0.], (1000, 1)),
+                     'energy': np.ones(1000),
+                     'polarization': np.ones(1000),
+                     'probability': np.ones(1000)})
+    photons['pos'][:, 1:3] = np.random.uniform(-11, 11, size=(1000, 2))
+    photons['dir'][:, 1:3] = np.random.uniform(-.1, .1, size=(1000, 2))
+
+    p1 = det(photons.copy())
+    det.spatial_index = False
+    p2 = det(photons.copy())
+    for col in ['CCD_ID', 'det_x', 'det_y', 'detpix_x', 'detpix_y']:
+        assert np.allclose(p1[col], p2[col], equal_nan=True)
+    # The rays start at x=1 with dir[0]=-1, so they reach the chips at x=0 at pos + dir.
+    # Each chip covers its center +- 1 in y and z.
+    centers = np.arange(-10, 10, 2.1)
+    hitpos = photons['pos'][:, 1:3] + photons['dir'][:, 1:3]
+    on_chip = np.abs(hitpos[:, :, None] - centers[None, None, :]).min(axis=2) <= 1
+    n_miss = np.sum(~np.all(on_chip, axis=1))
+    assert 0 < n_miss < 500
+    assert np.sum(p1['CCD_ID'] < 0) == n_miss
+    # ID columns are small integers, -1 for photons that miss all elements
+    assert p1['CCD_ID'].dtype == np.int16
+    assert set(p1['CCD_ID']) <= set([-1] + list(range(len(det.elements))))
+
+    # Below spatial_index_min_photons, the loop is used. The index gives the
+    # same result for a few photons, too.
+    det.spatial_index = True
+    det.spatial_index_min_photons = 0
+    p3 = det(photons[:10].copy())
+    assert np.allclose(p3['CCD_ID'], p2['CCD_ID'][:10])
+
+    # Moving a single element by hand rebuilds the index.
+    det.elements[0].pos4d = translation2aff([0, 100, 100])
+    p4 = det(photons.copy())
+    assert not np.any(p4['CCD_ID'] == 0)
+
+def test_prune_absorbed():
+    '''Elements in a pruning sequence only see photons with probability > 0.'''
+    def absorb_odd(photons):
+        photons['probability'][1::2] = 0
+        return photons
+
+    def count(photons):
+        photons.meta['n'].append(len(photons))
+        photons['energy'] = 5
+        photons['seen'] = 1
+        return photons
+
+    photons = Table({'energy': np.ones(10), 'probability': np.ones(10)})
+    photons.meta['n'] = []
+    seq = Sequence(sequence=[absorb_odd, count], prune_absorbed=True)
+    p = seq(photons.copy())
+    assert p.meta['n'] == [5]
+    assert len(p) == 10
+    assert set(p.colnames) == set(['energy', 'probability', 'seen'])
+    assert np.all(p['energy'] == [5, 1] * 5)
+    assert np.all(p['seen'].mask == [False, True] * 5)
+
+    photons.meta['n'] = []
+    seq = Sequence(sequence=[absorb_odd, count], prune_absorbed=True, keep_absorbed=False)
+    p = seq(photons.copy())
+    assert len(p) == 5
+    assert np.all(p['probability'] == 1)
+    assert np.all(seq.pruned_index == [0, 2, 4, 6, 8])
+
+    def fail(photons):
+        raise ValueError('element failed')
+
+    # The input photon list does not get any temporary columns, even if an element fails.
+    p_in = photons.copy()
+    seq = Sequence(sequence=[absorb_odd, fail], prune_absorbed=True)
+    with pytest.raises(ValueError):
+        seq(p_in)
+    assert p_in.colnames == photons.colnames
+
+def test_run_stream():
+    '''Photons are generated and processed in consecutive time windows.'''
+    from ..source import PointSource
+
+    def mark(photons):
+        photons['processed'] = np.ones(len(photons))
+        return photons
+
+    seq = Sequence(sequence=[mark])
+    s = PointSource(coords=(30., 30.), flux=10.)
+    chunks = list(seq.run_stream(s, 10., 2.5))
+    assert len(chunks) == 4
+    times = np.hstack([c['time'] for c in chunks])
+    assert len(times) == 100
+    assert np.allclose(np.diff(times), 0.1)
+    for c in chunks:
+        assert np.all(c['processed'] == 1)
+        assert c.meta['EXPOSURE'][0] == 10.
+
+def test_run_parallel():
+    '''Result depends on the seed, but not on the number of processes.'''
+    from ..source import PointSource, FixedPointing
+    from ..optics import RectangleAperture
+
+    s = PointSource(coords=(30., 30.), flux=10.)
+    seq = Sequence(sequence=[FixedPointing(coords=(30., 30.)), RectangleAperture()])
+    p1 = seq.run_parallel(s, 10., 4, processes=1, seed=3)
+    p2 = seq.run_parallel(s, 10., 4, processes=2, seed=3)
+    assert len(p1) == 100
+    assert np.allclose(np.diff(p1['time']), 0.1)
+    assert p1.meta['EXPOSURE'][0] == 10.
+    assert p1.meta['RA_PNT'][0] == 30.
+    for col in ['time', 'polangle', 'pos', 'dir']:
+        assert np.all(p1[col] == p2[col])
+    p3 = seq.run_parallel(s, 10., 4, processes=1, seed=4)
+    assert not np.all(p1['pos'] == p3['pos'])
+
+
+def test_run_parallel_serial_side_effects():
+    '''A run in the current process leaves the global RNG and the worker setup alone.'''
+    from ..source import PointSource
+    from .. import simulator
+
+    def fail(photons):
+        raise ValueError('element failed')
+
+    s = PointSource(coords=(30., 30.), flux=10.)
+    np.random.seed(12)
+    expected = np.random.uniform(size=5)
+    np.random.seed(12)
+    Sequence(sequence=[]).run_parallel(s, 10., 4, processes=1, seed=3)
+    assert np.all(np.random.uniform(size=5) == expected)
+
+    np.random.seed(12)
+    with pytest.raises(ValueError):
+        Sequence(sequence=[fail]).run_parallel(s, 10., 4, processes=1, seed=3)
+    assert simulator._worker_setup == {}
+    assert np.all(np.random.uniform(size=5) == expected)
+
+
+def flare(exposuretime):
+    '''Light curve for `test_run_parallel_time_dependent`: a flare at the end.'''
+    return np.hstack([np.arange(0, 9, 0.5), np.arange(9, exposuretime, 0.01)])
+
+
+def energy_from_time(t):
+    return 1. + np.asarray(t) / 10.
+
+
+def test_run_parallel_time_dependent():
+    '''Time-dependent sources see the same times as in a single run.'''
+    from ..source import PointSource, FixedPointing
+    from ..optics import RectangleAperture
+
+    s = PointSource(coords=(30., 30.), flux=flare, energy=energy_from_time)
+    seq = Sequence(sequence=[FixedPointing(coords=(30., 30.)), RectangleAperture()])
+    expected = s.generate_photons(10.)
+    for processes in [1, 2]:
+        p = seq.run_parallel(s, 10., 3, processes=processes, seed=3)
+        assert len(p) == len(expected)
+        assert np.allclose(p['time'], expected['time'])
+        assert np.allclose(p['energy'], expected['energy'])
+        assert np.allclose(p['energy'], 1. + p['time'] / 10.)
+
+
+def test_profile():
+    '''The profile report has one row per element call, including nested elements.'''
+    from ..source import PointSource, FixedPointing
+    from ..optics import RectangleAperture, FlatDetector
+
+    photons = PointSource(coords=(30., 30.), flux=100.).generate_photons(10)
+    det = Parallel(elem_class=FlatDetector, elem_args={'pixsize': 0.01, 'zoom': 5},
+                   elem_pos={'position': [[0, -5.1, 0], [0, 5.1, 0]]}, id_col='CCD_ID',
+                   name='Detector')
+    seq = Sequence(sequence=[FixedPointing(coords=(30., 30.)),
+                             RectangleAperture(zoom=[1, 10, 5], name='Aperture'),
+                             det], profile=True)
+    photons = seq(photons)
+    rep = seq.profile_report
+    assert list(rep['element'][1:]) == ['Aperture', 'Detector',
+                                        'Elem 0 in Detector', 'Elem 1 in Detector']
+    assert list(rep['level']) == [0, 0, 0, 1, 1]
+    assert np.all(rep['n_in'] == 1000)
+    assert np.all(rep['time'] >= 0)
+    assert 'pos' in rep['cols_added'][1]
+    assert 'CCD_ID' in rep['cols_added'][2]
+    assert rep['live_out'][-1] == 1000
+    assert rep['table_bytes_delta'][1] > 0
+    assert np.all(rep['peak_bytes'].mask)
+    # nested containers do not keep a report of their own
+    assert det.profile_report is None
+
+
+def test_profile_failing_element():
+    '''An exception in a profiled element is passed on unchanged.'''
+    def fail(photons):
+        raise ValueError('element failed')
+
+    photons = Table({'energy': np.ones(10), 'probability': np.ones(10)})
+    seq = Sequence(sequence=[lambda p: p, Sequence(sequence=[lambda p: p, fail])],
+                   profile=True)
+    with pytest.raises(ValueError) as e:
+        seq(photons)
+    assert 'element failed' in str(e.value)
+    assert seq.profile_report is None
+    seq = Sequence(sequence=[fail], profile=True)
+    with pytest.raises(ValueError) as e:
+        seq(photons)
+    assert 'element failed' in str(e.value)
+    # A container that calls no element has an empty report.
+    seq = Sequence(sequence=[], profile=True)
+    seq(photons)
+    assert len(seq.profile_report) == 0
+    assert seq.profile_report.colnames[0] == 'element'
+
+
+def test_profile_peak_memory():
+    '''With tracemalloc, the peak memory includes temporary arrays.'''
+    tracemalloc = pytest.importorskip('tracemalloc')
+    if not hasattr(tracemalloc, 'reset_peak'):
+        pytest.skip('tracemalloc.reset_peak is not available.')
+
+    def temporary(photons):
+        tmp = np.ones((len(photons), 1000))
+        photons['energy'] = tmp.sum(axis=1)
+        return photons
+
+    photons = Table({'energy': np.ones(100)})
+    seq = Sequence(sequence=[temporary, Sequence(sequence=[temporary])], profile=True)
+    tracemalloc.start()
+    try:
+        seq(photons)
+    finally:
+        tracemalloc.stop()
+    rep = seq.profile_report
+    assert list(rep['level']) == [0, 0, 1]
+    assert np.all(rep['table_bytes_delta'] == 0)
+    assert np.all(rep['peak_bytes'] >= 100 * 1000 * 8)
+    assert not np.any(rep['peak_bytes'].mask)
+
+
+def test_random_state():
+    '''Elements in a seeded sequence have independent, reproducible random streams.'''
+    from ..source import PointSource, FixedPointing
+    from ..optics import RectangleAperture
+
+    photons = PointSource(coords=(30., 30.), flux=100.).generate_photons(1)
+    aper = Parallel(elem_class=RectangleAperture, elem_pos={'position': [[0, 0, 0], [1, 0, 0]]})
+    seq = Sequence(sequence=[FixedPointing(coords=(30., 30.)), aper], random_state=5)
+    assert aper.elements[0].random_state is not aper.elements[1].random_state
+    np.random.seed(1)
+    p1 = seq(photons.copy())
+    seq.set_random_state(5)
+    np.random.seed(2)
+    p2 = seq(photons.copy())
+    assert np.all(p1['pos'] == p2['pos'])
+    # Regenerating the elements keeps them seeded
+    aper.generate_elements()
+    assert aper.elements[0].random_state is not np.random.mtrand._rand
+
+
+def test_regenerate_elements_in_place():
+    '''Changing the uncertainty moves the existing elements instead of making new ones.'''
+    from transforms3d.affines import compose
+    from transforms3d.euler import euler2mat
+
+    g = Parallel(elem_class=FlatGrating,
+                 elem_args={'d': 0.002, 'order_selector': uniform_efficiency_factory(),
+                            'zoom': [1, 2, 3]},
+                 elem_pos={'position': [[0, 0, 0], [0, 5, 0], [0, 0, 7]]})
+    elems = list(g.elements)
+    g.elem_uncertainty = [compose([1, 2, 3], euler2mat(.1, .2, .3), [1, 1, 1])] * 3
+    g.uncertainty = compose([.1, 0, 0], euler2mat(0, 0, .1), [1, 1, 1])
+    g.generate_elements()
+    assert all([a is b for a, b in zip(elems, g.elements)])
+    # New elements have the same geometry
+    g.elem_args['d'] = 0.003
+    g.generate_elements()
+    assert not any([a is b for a, b in zip(elems, g.elements)])
+    for a, b in zip(elems, g.elements):
+        assert np.allclose(a.pos4d, b.pos4d)
+        for k in ['center', 'v_y', 'e_groove', 'plane']:
+            assert np.allclose(a.geometry[k], b.geometry[k])
+
+
+def test_regenerate_elements_args_changed_in_place():
+    '''Elements are rebuilt if a value in elem_args is changed in place.'''
+    g = Parallel(elem_class=FlatGrating,
+                 elem_args={'d': 0.002, 'order_selector': uniform_efficiency_factory(),
+                            'zoom': np.array([1., 2., 3.])},
+                 elem_pos={'position': [[0, 0, 0], [0, 5, 0]]})
+    elems = list(g.elements)
+    # Unchanged arguments keep the elements
+    g.generate_elements()
+    assert all([a is b for a, b in zip(elems, g.elements)])
+    g.elem_args['zoom'][1] = 4.
+    g.generate_elements()
+    assert not any([a is b for a, b in zip(elems, g.elements)])
+    for e in g.elements:
+        assert np.allclose(np.linalg.norm(e.geometry['v_y'][:3]), 4.)
+
+
+def test_process_realizations():
+    '''Each realization is processed with its own misalignment, then elements are reset.'''
+    from transforms3d.affines import compose
+    from ..optics import FlatDetector
+    from ..utils import generate_test_photons
+
+    det = Parallel(elem_class=FlatDetector, elem_args={'zoom': 5},
+                   elem_pos={'position': [[0, 0, 0], [0, 20, 0]]})
+    pos4d = [e.pos4d.copy() for e in det.elements]
+    photons = generate_test_photons(5)
+    shifts = np.array([compose([0, 0, z], np.eye(3), np.ones(3)) for z in [0, 1, 30]])
+    res = det.process_realizations(photons, uncertainty=shifts)
+    assert len(res) == 3
+    assert np.allclose(res[0]['det_y'], 0)
+    assert np.allclose(res[1]['det_y'], -1)
+    # photons miss the detector
+    assert np.all(res[2]['pos'] == photons['pos'])
+    assert 'det_y' not in photons.colnames
+    for e, p in zip(det.elements, pos4d):
+        assert np.all(e.pos4d == p)
+    with pytest.raises(ValueError):
+        det.process_realizations(photons, elem_uncertainty=shifts[:, None, :, :])
+
+
+def test_process_realizations_batched():
+    '''All realizations in one pass give the same result as regenerating the elements.'''
+    from transforms3d.affines import compose
+    from transforms3d.euler import euler2mat
+    from ..optics import constant_order_factory
+
+    pos = [[0, y, z] for y in np.arange(-10, 10, 2.1) for z in np.arange(-10, 10, 2.1)]
+    g = Parallel(elem_class=FlatGrating,
+                 elem_args={'d': 0.002, 'order_selector': constant_order_factory(1), 'zoom': 1},
+                 elem_pos={'position': pos})
+    rand = np.random.RandomState(0)
+    photons = Table({'pos': np.tile([1., 0., 0.], (500, 1)),
+                     'dir': np.tile([-1., 0., 0.], (500, 1)),
+                     'energy': np.ones(500),
+                     'polarization': np.ones(500),
+                     'probability': np.ones(500)})
+    photons['pos'][:, 1:3] = rand.uniform(-11, 11, size=(500, 2))
+    n = len(pos)
+    elem_unc = np.array([[compose(rand.normal(scale=.3, size=3),
+                                  euler2mat(*rand.normal(scale=.05, size=3)), np.ones(3))
+                          for i in range(n)] for k in range(4)])
+    unc = np.array([compose([0, .5 * k, 0], euler2mat(0, 0, .02 * k), np.ones(3))
+                    for k in range(4)])
+
+    res = g.process_realizations(photons, elem_uncertainty=elem_unc, uncertainty=unc)
+    res2 = g.process_realizations(photons, elem_uncertainty=elem_unc, uncertainty=unc,
+                                  batch_size=3)
+    g.spatial_index = False
+    res3 = g.process_realizations(photons, elem_uncertainty=elem_unc, uncertainty=unc)
+    g.spatial_index = True
+    for k in range(4):
+        g.elem_uncertainty = list(elem_unc[k])
+        g.uncertainty = unc[k]
+        g.generate_elements()
+        expected = g(photons.copy())
+        assert (expected['element'] >= 0).sum() > 100
+        for r in [res, res2, res3]:
+            for c in ['pos', 'dir', 'order', 'element']:
+                assert np.allclose(r[k][c], expected[c], equal_nan=True)
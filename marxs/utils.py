@@ -1,6 +1,8 @@
 import numpy as np
 from astropy.table import Table
 
+from .precision import float_type
+
 def generate_test_photons(n=1):
     '''Generate a photon structure for testing.
 
@@ -12,6 +14,8 @@ def generate_test_photons(n=1):
     - energy: 1 keV
     - polarization: 1
 
+    Columns are stored with the precision set in `marxs.precision`.
+
     This is useful for testing purposes.
 
     Parameters
@@ -24,12 +28,12 @@ def generate_test_photons(n=1):
     photons : `astropy.table.Table`
         Table of ``n`` identical photons.
     '''
-    dir = np.tile(np.array([-1., 0., 0., 0.]), (n, 1))
-    pos = np.tile(np.array([1., 0., 0., 1.]), (n, 1))
+    dir = np.tile(np.array([-1., 0., 0.], dtype=float_type('dir')), (n, 1))
+    pos = np.tile(np.array([1., 0., 0.], dtype=float_type('pos')), (n, 1))
     photons = Table({'pos': pos,
                      'dir': dir,
-                     'energy': np.ones(n),
-                     'polarization': np.ones(n),
-                     'probability': np.ones(n),
+                     'energy': np.ones(n, dtype=float_type('energy')),
+                     'polarization': np.ones(n, dtype=float_type('polarization')),
+                     'probability': np.ones(n, dtype=float_type('probability')),
                      })
     return photons